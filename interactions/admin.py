@@ -71,7 +71,7 @@ class NotificationAdmin(admin.ModelAdmin):
     """
     list_display = (
         'recipient', 'sender', 'notification_type', 
-        'message_preview', 'is_read', 'created_at'
+        'message_preview', 'actor_count', 'is_read', 'created_at'
     )
     list_filter = ('notification_type', 'is_read', 'created_at')
     search_fields = ('recipient__username', 'sender__username', 'message')
@@ -82,6 +82,9 @@ class NotificationAdmin(admin.ModelAdmin):
         ('Notification Details', {
             'fields': ('recipient', 'sender', 'notification_type', 'message')
         }),
+        ('Actors', {
+            'fields': ('actor_count', 'recent_actors')
+        }),
         ('Status', {
             'fields': ('is_read',)
         }),
@@ -154,6 +154,10 @@ class Notification(models.Model):
     object_id = models.PositiveIntegerField(null=True, blank=True)
     content_object = GenericForeignKey('content_type', 'object_id')
     
+    # Coalesced notifications (see interactions/notifications.py)
+    actor_count = models.PositiveIntegerField(default=1)
+    recent_actors = models.JSONField(default=list, blank=True)
+    
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -175,6 +179,23 @@ class Notification(models.Model):
         self.save(update_fields=['is_read'])
 
 
+class NotificationReceipt(models.Model):
+    """
+    Idempotency key of a delivered notification event, so redelivered events
+    are not applied twice (see interactions/notification_queue.py).
+    """
+    key = models.CharField(max_length=128, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        db_table = 'notification_receipts'
+        verbose_name = 'Notification Receipt'
+        verbose_name_plural = 'Notification Receipts'
+
+    def __str__(self):
+        return self.key
+
+
 class Report(models.Model):
     """
     Model representing user reports on posts or comments.
@@ -232,3 +253,29 @@ class Report(models.Model):
 
     def __str__(self):
         return f"Report by {self.reporter.username} - {self.reason}"
+
+
+class CounterShard(models.Model):
+    """
+    Pending delta of a sharded engagement counter.
+
+    Increments of a hot counter (e.g. likes_count of a viral post) land on one
+    of N shard rows instead of the post row itself, so concurrent writers do
+    not queue on a single row lock. The counter value is the base column plus
+    the sum of its shards; shards are folded back into the base column by
+    ``interactions.tasks.compact_counter_shards``.
+    """
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveBigIntegerField()
+    field = models.CharField(max_length=64)
+    shard = models.PositiveSmallIntegerField()
+    delta = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'counter_shards'
+        unique_together = ('content_type', 'object_id', 'field', 'shard')
+        verbose_name = 'Counter Shard'
+        verbose_name_plural = 'Counter Shards'
+
+    def __str__(self):
+        return f"{self.content_type.model}:{self.object_id}.{self.field}[{self.shard}] {self.delta:+d}"
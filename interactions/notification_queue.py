@@ -0,0 +1,375 @@
+"""
+Batched notification delivery
+
+``LikePost`` and ``SharePost`` used to create their notification inside the
+mutation transaction. They now only queue a small event (``enqueue_notification``)
+once the transaction commits, and ``drain`` delivers queued events in batches
+of ``BATCH_SIZE`` through ``interactions.notifications.deliver_events``: bulk
+lookups of the users, ``bulk_create`` / ``bulk_update`` of the coalesced rows.
+
+The queue is pluggable through ``settings.NOTIFICATION_QUEUE['BACKEND']``:
+
+- ``RedisNotificationQueue``: a Redis list shared by the web and Celery
+  processes. The first event queued schedules ``interactions.tasks.
+  deliver_notifications`` ``BATCH_DELAY`` seconds later, so events that arrive
+  meanwhile are delivered together. The task also runs periodically.
+- ``LocalNotificationQueue``: process-local, drained by the process that
+  queued the events, for development and tests.
+
+Delivery is at least once. A batch taken from the queue stays in flight until
+it is acknowledged, and goes back to the queue if it is not acknowledged
+within ``VISIBILITY_TIMEOUT`` seconds (e.g. the worker died). Every event has
+an idempotency key (``like:<id>``, ``share:<id>``), and delivered keys are
+recorded in ``NotificationReceipt`` in the same transaction as the
+notifications, so redelivered events are skipped.
+
+When a batch fails, its events are delivered one by one, so a single bad event
+cannot block the others. Events that still fail are retried on a later drain,
+and after ``MAX_ATTEMPTS`` attempts they are moved to a dead-letter list.
+Queue depth, delivery lag, batch sizes and outcomes are exported as metrics,
+to watch the consumer keep up with the producers.
+"""
+
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from social_media_backend.metrics import COUNT_BUCKETS, REGISTRY
+
+from .notifications import deliver_events
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BACKEND': 'interactions.notification_queue.LocalNotificationQueue',
+    'REDIS_URL': None,
+    'BATCH_SIZE': 500,
+    # Seconds between the first queued event and its delivery task
+    'BATCH_DELAY': 1,
+    # Batches delivered per drain
+    'MAX_BATCHES': 20,
+    'MAX_ATTEMPTS': 5,
+    # Seconds before an unacknowledged batch is delivered again
+    'VISIBILITY_TIMEOUT': 300,
+}
+
+DRAIN_SCHEDULED_KEY = 'notifications:drain-scheduled'
+
+LAG_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+EVENTS_QUEUED = REGISTRY.counter(
+    'notification_events_queued_total', 'Notification events queued, by type.', ('type',)
+)
+EVENTS_DELIVERED = REGISTRY.counter(
+    'notification_events_delivered_total',
+    'Notification events delivered, by outcome (created, merged, duplicate, dropped).',
+    ('result',)
+)
+EVENTS_RETRIED = REGISTRY.counter(
+    'notification_events_retried_total', 'Notification events queued again after a failure.'
+)
+EVENTS_DEAD_LETTERED = REGISTRY.counter(
+    'notification_events_dead_lettered_total',
+    'Notification events given up on after MAX_ATTEMPTS failures.'
+)
+QUEUE_DEPTH = REGISTRY.gauge(
+    'notification_queue_depth', 'Notification events waiting for delivery.'
+)
+BATCH_SIZE = REGISTRY.histogram(
+    'notification_batch_size', 'Events per delivered notification batch.',
+    buckets=COUNT_BUCKETS + (1000,)
+)
+DELIVERY_LAG = REGISTRY.histogram(
+    'notification_delivery_lag_seconds',
+    'Delay between queueing a notification event and its delivery.',
+    buckets=LAG_BUCKETS
+)
+
+
+def get_notification_queue_settings():
+    return {**DEFAULTS, **getattr(settings, 'NOTIFICATION_QUEUE', {})}
+
+
+class LocalNotificationQueue:
+    """
+    Process-local queue, drained by the process that queues the events.
+    """
+
+    # Whether other processes (the Celery workers) can drain it
+    shared = False
+
+    def __init__(self, visibility_timeout=300, **options):
+        self.visibility_timeout = visibility_timeout
+        self._lock = threading.Lock()
+        self._queue = deque()
+        self._in_flight = {}
+        self._dead = []
+
+    def push(self, messages):
+        with self._lock:
+            self._queue.extend(messages)
+
+    def take(self, limit):
+        """Move up to ``limit`` messages in flight and return them."""
+        deadline = time.time() + self.visibility_timeout
+        with self._lock:
+            messages = [self._queue.popleft() for _ in range(min(limit, len(self._queue)))]
+            for message in messages:
+                self._in_flight[message] = deadline
+        return messages
+
+    def ack(self, messages):
+        with self._lock:
+            for message in messages:
+                self._in_flight.pop(message, None)
+
+    def retry(self, messages, retries):
+        """Acknowledge ``messages`` and queue ``retries`` in their place."""
+        with self._lock:
+            for message in messages:
+                self._in_flight.pop(message, None)
+            self._queue.extend(retries)
+
+    def dead_letter(self, messages):
+        with self._lock:
+            for message in messages:
+                self._in_flight.pop(message, None)
+            self._dead.extend(messages)
+
+    def recover(self):
+        """Queue again the messages in flight past their deadline."""
+        now = time.time()
+        with self._lock:
+            expired = [message for message, deadline in self._in_flight.items() if deadline < now]
+            for message in expired:
+                del self._in_flight[message]
+            self._queue.extend(expired)
+        return len(expired)
+
+    def __len__(self):
+        return len(self._queue)
+
+
+class RedisNotificationQueue:
+    """
+    Messages wait in the ``notifications:queue`` list. Taking a batch moves it
+    atomically to the ``notifications:in-flight`` sorted set, scored by its
+    redelivery deadline.
+    """
+
+    shared = True
+
+    queue_key = 'notifications:queue'
+    in_flight_key = 'notifications:in-flight'
+    dead_key = 'notifications:dead'
+
+    TAKE_SCRIPT = """
+    local messages = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+    if #messages > 0 then
+        redis.call('LTRIM', KEYS[1], #messages, -1)
+        for _, message in ipairs(messages) do
+            redis.call('ZADD', KEYS[2], ARGV[2], message)
+        end
+    end
+    return messages
+    """
+
+    RECOVER_SCRIPT = """
+    local messages = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+    for _, message in ipairs(messages) do
+        redis.call('ZREM', KEYS[2], message)
+        redis.call('RPUSH', KEYS[1], message)
+    end
+    return #messages
+    """
+
+    def __init__(self, redis_url=None, visibility_timeout=300, **options):
+        import redis
+
+        self.visibility_timeout = visibility_timeout
+        self.client = redis.Redis.from_url(redis_url or settings.REDIS_URL, decode_responses=True)
+        self._take = self.client.register_script(self.TAKE_SCRIPT)
+        self._recover = self.client.register_script(self.RECOVER_SCRIPT)
+
+    def push(self, messages):
+        if messages:
+            self.client.rpush(self.queue_key, *messages)
+
+    def take(self, limit):
+        deadline = time.time() + self.visibility_timeout
+        return self._take(keys=[self.queue_key, self.in_flight_key], args=[limit, deadline])
+
+    def ack(self, messages):
+        if messages:
+            self.client.zrem(self.in_flight_key, *messages)
+
+    def retry(self, messages, retries):
+        pipe = self.client.pipeline()
+        if messages:
+            pipe.zrem(self.in_flight_key, *messages)
+        if retries:
+            pipe.rpush(self.queue_key, *retries)
+        pipe.execute()
+
+    def dead_letter(self, messages):
+        if messages:
+            pipe = self.client.pipeline()
+            pipe.zrem(self.in_flight_key, *messages)
+            pipe.rpush(self.dead_key, *messages)
+            pipe.execute()
+
+    def recover(self):
+        return self._recover(keys=[self.queue_key, self.in_flight_key], args=[time.time()])
+
+    def __len__(self):
+        return self.client.llen(self.queue_key)
+
+
+_queue = None
+
+
+def get_notification_queue():
+    """Return the configured notification queue (one instance per process)."""
+    global _queue
+    if _queue is None:
+        config = get_notification_queue_settings()
+        queue_class = import_string(config['BACKEND'])
+        _queue = queue_class(
+            redis_url=config['REDIS_URL'],
+            visibility_timeout=config['VISIBILITY_TIMEOUT'],
+        )
+    return _queue
+
+
+def enqueue_notification(key, recipient_id, sender_id, notification_type, message,
+                         content_type_id=None, object_id=None):
+    """
+    Queue a notification event once the current transaction commits.
+    ``key`` identifies the event, e.g. ``'like:<like id>'``.
+    """
+    event = {
+        'key': key,
+        'recipient_id': recipient_id,
+        'sender_id': sender_id,
+        'type': notification_type,
+        'message': message,
+        'content_type_id': content_type_id,
+        'object_id': object_id,
+        'attempts': 0,
+    }
+    transaction.on_commit(lambda: push_events([event]))
+
+
+def push_events(events):
+    """Queue ``events`` and make sure a drain is coming."""
+    queued_at = time.time()
+    try:
+        queue = get_notification_queue()
+        queue.push([json.dumps({**event, 'queued_at': queued_at}) for event in events])
+    except Exception as e:
+        # The write already committed: deliver now rather than lose the notification
+        logger.warning(f"Could not queue notifications, delivering inline: {e}")
+        try:
+            deliver_events(events)
+        except Exception:
+            logger.exception('Inline notification delivery failed')
+        return
+    for event in events:
+        EVENTS_QUEUED.inc(type=event['type'])
+    schedule_drain(queue)
+
+
+def schedule_drain(queue):
+    """Run a drain after ``BATCH_DELAY`` seconds, unless one is already scheduled."""
+    if not queue.shared:
+        drain()
+        return
+    delay = get_notification_queue_settings()['BATCH_DELAY']
+    if not cache.add(DRAIN_SCHEDULED_KEY, uuid.uuid4().hex, delay):
+        return
+    from .tasks import deliver_notifications
+
+    try:
+        deliver_notifications.apply_async(countdown=delay)
+    except Exception as e:
+        # The periodic deliver_notifications run picks the events up
+        logger.error(f"Could not schedule notification delivery: {e}")
+
+
+def _retry(queue, failed, config):
+    retries, dead = [], []
+    for message, event in failed:
+        attempts = event.get('attempts', 0) + 1
+        if attempts >= config['MAX_ATTEMPTS']:
+            dead.append(message)
+        else:
+            retries.append(json.dumps({**event, 'attempts': attempts}))
+    queue.retry([message for message, _ in failed if message not in dead], retries)
+    queue.dead_letter(dead)
+    EVENTS_RETRIED.inc(len(retries))
+    EVENTS_DEAD_LETTERED.inc(len(dead))
+    if dead:
+        logger.error(f"Gave up on {len(dead)} notification events after {config['MAX_ATTEMPTS']} attempts")
+
+
+def _deliver_batch(queue, messages, config):
+    """Deliver one batch; returns whether every event was delivered."""
+    events = [json.loads(message) for message in messages]
+    BATCH_SIZE.observe(len(events))
+    outcomes = {}
+    failed = []
+    try:
+        outcomes = deliver_events(events)
+    except Exception:
+        logger.exception(f"Notification batch of {len(events)} events failed, delivering one by one")
+        for message, event in zip(messages, events):
+            try:
+                for result, count in deliver_events([event]).items():
+                    outcomes[result] = outcomes.get(result, 0) + count
+            except Exception:
+                logger.exception(f"Notification event {event['key']} failed")
+                failed.append((message, event))
+    failed_messages = {message for message, _ in failed}
+    queue.ack([message for message in messages if message not in failed_messages])
+    if failed:
+        _retry(queue, failed, config)
+    now = time.time()
+    DELIVERY_LAG.observe_many(
+        [now - event['queued_at'] for message, event in zip(messages, events)
+         if message not in failed_messages]
+    )
+    for result, count in outcomes.items():
+        EVENTS_DELIVERED.inc(count, result=result)
+    return not failed
+
+
+def drain():
+    """Deliver queued events in batches. Returns the number of events taken."""
+    config = get_notification_queue_settings()
+    queue = get_notification_queue()
+    recovered = queue.recover()
+    if recovered:
+        logger.warning(f"Redelivering {recovered} unacknowledged notification events")
+    taken = 0
+    for _ in range(config['MAX_BATCHES']):
+        messages = queue.take(config['BATCH_SIZE'])
+        if not messages:
+            break
+        taken += len(messages)
+        if not _deliver_batch(queue, messages, config):
+            # Retry failed events on the next drain, not right away
+            break
+    else:
+        if queue.shared and len(queue):
+            # Falling behind: keep draining in another run
+            schedule_drain(queue)
+    QUEUE_DEPTH.set(len(queue))
+    return taken
@@ -0,0 +1,237 @@
+"""
+Coalesced notifications ("alice and 12 others liked your post")
+
+Every like or share of a post used to insert its own ``Notification`` row, so a
+viral post wrote tens of thousands of rows for one recipient. ``notify`` merges
+the types of ``settings.NOTIFICATIONS['GROUPED_TYPES']`` into the latest
+notification with the same recipient, type and target object, if that one is
+less than ``GROUP_WINDOW`` seconds old. A merge updates the existing row in place:
+
+- ``actor_count`` goes up and ``sender`` becomes the new actor;
+- ``recent_actors`` keeps the ids of the last ``RECENT_ACTORS`` actors;
+- the message is rewritten;
+- the row becomes unread and moves back to the top of the list.
+
+The window slides, so a post that keeps getting likes keeps a single row.
+
+``LikePost`` and ``SharePost`` queue notification events
+(``interactions.notification_queue``), and ``deliver_events`` creates or
+merges their rows in bulk. ``notify`` does the same for a single
+notification, for ``interactions.tasks.send_notification``. Merges for one
+recipient are serialized by a lock on the recipient's row.
+
+An actor who is already in ``recent_actors`` is not counted again, for example
+after a like, an unlike and another like. Older actors can be counted twice.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from social_media_backend.pubsub import notifications_channel, publish_on_commit
+
+from .models import Notification, NotificationReceipt
+
+DEFAULTS = {
+    # Notification types merged per (recipient, type, target object)
+    'GROUPED_TYPES': ('like', 'share'),
+    # Seconds since the last merge during which new actors join the same row
+    'GROUP_WINDOW': 24 * 3600,
+    # Actor ids kept on a coalesced notification, most recent first
+    'RECENT_ACTORS': 5,
+}
+
+# Columns written when actors are merged into a notification
+MERGED_FIELDS = ('sender', 'actor_count', 'recent_actors', 'message', 'is_read', 'created_at')
+
+# Message of a coalesced notification, by type
+GROUP_MESSAGES = {
+    'like': '{actor} and {others} liked your post',
+    'share': '{actor} and {others} shared your post',
+}
+
+
+def get_notification_settings():
+    return {**DEFAULTS, **getattr(settings, 'NOTIFICATIONS', {})}
+
+
+def group_message(notification_type, actor, actor_count, default):
+    """Message of a notification from ``actor`` and ``actor_count - 1`` others."""
+    template = GROUP_MESSAGES.get(notification_type)
+    if template is None or actor_count < 2:
+        return default
+    others = actor_count - 1
+    return template.format(
+        actor=actor.username,
+        others='1 other' if others == 1 else f'{others} others',
+    )
+
+
+def _add_actor(notification, sender, message, config):
+    """Merge ``sender`` into the coalesced ``notification`` (in memory)."""
+    previous = [pk for pk in notification.recent_actors if pk != sender.pk]
+    if len(previous) == len(notification.recent_actors):
+        notification.actor_count += 1
+    notification.sender = sender
+    notification.recent_actors = ([sender.pk] + previous)[:config['RECENT_ACTORS']]
+    notification.message = group_message(
+        notification.notification_type, sender, notification.actor_count, message
+    )
+    notification.is_read = False
+    notification.created_at = timezone.now()
+
+
+def _lock_recipients(recipient_ids):
+    """Lock (and return) the recipients' rows, in a consistent order."""
+    from users.models import User
+
+    recipients = User.objects.select_for_update().filter(pk__in=recipient_ids).order_by('pk')
+    return {user.pk: user for user in recipients}
+
+
+def _publish_created(notifications):
+    for notification in notifications:
+        publish_on_commit(
+            [notifications_channel(notification.recipient_id)],
+            'notificationCreated',
+            {'id': notification.pk},
+        )
+
+
+def notify(recipient, sender, notification_type, message, content_type=None, object_id=None):
+    """
+    Notify ``recipient``, merging into a recent notification of the same
+    group when the type is grouped. Returns ``(notification, merged)``.
+    """
+    config = get_notification_settings()
+    recent_actors = [sender.pk] if sender is not None else []
+    if sender is None or notification_type not in config['GROUPED_TYPES']:
+        notification = Notification.objects.create(
+            recipient=recipient,
+            sender=sender,
+            notification_type=notification_type,
+            message=message,
+            content_type=content_type,
+            object_id=object_id,
+            recent_actors=recent_actors,
+        )
+        return notification, False
+
+    with transaction.atomic():
+        _lock_recipients([recipient.pk])
+        group = Notification.objects.filter(
+            recipient=recipient,
+            notification_type=notification_type,
+            content_type=content_type,
+            object_id=object_id,
+            created_at__gte=timezone.now() - timedelta(seconds=config['GROUP_WINDOW']),
+        ).order_by('-created_at').first()
+        if group is None:
+            notification = Notification.objects.create(
+                recipient=recipient,
+                sender=sender,
+                notification_type=notification_type,
+                message=message,
+                content_type=content_type,
+                object_id=object_id,
+                recent_actors=recent_actors,
+            )
+            return notification, False
+
+        _add_actor(group, sender, message, config)
+        # update() rather than save(): merges are announced as new notifications
+        Notification.objects.filter(pk=group.pk).update(
+            **{field: getattr(group, field) for field in MERGED_FIELDS}
+        )
+        _publish_created([group])
+    return group, True
+
+
+def deliver_events(events):
+    """
+    Create or merge the notifications of queued ``events`` in bulk. Returns
+    the number of events per outcome: ``created``, ``merged``, ``duplicate``
+    (idempotency key already delivered) and ``dropped`` (user deleted).
+
+    Recipients and senders are loaded in two queries, the open groups of the
+    batch in a third, and rows are written with ``bulk_create`` /
+    ``bulk_update`` along with the receipts of the events' idempotency keys.
+    Neither sends ``post_save``, so subscription events are published here.
+    """
+    from users.models import User
+
+    config = get_notification_settings()
+    stats = dict.fromkeys(('created', 'merged', 'duplicate', 'dropped'), 0)
+    pending = {}
+    for event in events:
+        if event['key'] in pending:
+            stats['duplicate'] += 1
+        else:
+            pending[event['key']] = event
+
+    with transaction.atomic():
+        recipients = _lock_recipients({event['recipient_id'] for event in pending.values()})
+        delivered = set(
+            NotificationReceipt.objects.filter(key__in=list(pending)).values_list('key', flat=True)
+        )
+        stats['duplicate'] += len(delivered)
+        events = [event for key, event in pending.items() if key not in delivered]
+        senders = User.objects.in_bulk(
+            list({event['sender_id'] for event in events if event['sender_id'] is not None})
+        )
+
+        grouped = [event for event in events if event['type'] in config['GROUPED_TYPES']]
+        groups = {}
+        if grouped:
+            open_groups = Notification.objects.filter(
+                recipient_id__in={event['recipient_id'] for event in grouped},
+                notification_type__in={event['type'] for event in grouped},
+                object_id__in={event['object_id'] for event in grouped},
+                created_at__gte=timezone.now() - timedelta(seconds=config['GROUP_WINDOW']),
+            ).order_by('created_at')
+            for notification in open_groups:
+                # The latest notification of each group wins
+                groups[(
+                    notification.recipient_id, notification.notification_type,
+                    notification.content_type_id, notification.object_id,
+                )] = notification
+
+        created, merged = [], {}
+        for event in events:
+            recipient = recipients.get(event['recipient_id'])
+            sender = senders.get(event['sender_id'])
+            if recipient is None or (event['sender_id'] is not None and sender is None):
+                stats['dropped'] += 1
+                continue
+            group_key = (
+                recipient.pk, event['type'], event['content_type_id'], event['object_id'],
+            )
+            group = groups.get(group_key) if sender is not None else None
+            if group is not None and event['type'] in config['GROUPED_TYPES']:
+                _add_actor(group, sender, event['message'], config)
+                if group.pk is not None:
+                    merged[group.pk] = group
+                stats['merged'] += 1
+                continue
+            notification = Notification(
+                recipient=recipient,
+                sender=sender,
+                notification_type=event['type'],
+                message=event['message'],
+                content_type_id=event['content_type_id'],
+                object_id=event['object_id'],
+                recent_actors=[sender.pk] if sender is not None else [],
+            )
+            created.append(notification)
+            groups[group_key] = notification
+            stats['created'] += 1
+
+        Notification.objects.bulk_create(created)
+        Notification.objects.bulk_update(list(merged.values()), MERGED_FIELDS)
+        NotificationReceipt.objects.bulk_create(
+            [NotificationReceipt(key=event['key']) for event in events]
+        )
+        _publish_created([*created, *merged.values()])
+    return stats
@@ -9,7 +9,16 @@ from django.contrib.contenttypes.models import ContentType
 from django.db import transaction
 
 from .models import Like, Share, Bookmark, Notification, Report
+from .notification_queue import enqueue_notification
 from posts.models import Post, Comment
+from users.schema import UserType
+from social_media_backend import counters
+from social_media_backend.async_graphql import concurrent_resolver
+from social_media_backend.dataloaders import get_loaders, load_related
+from social_media_backend.query_planner import optimize_queryset
+from social_media_backend.pagination import (
+    connection_from_queryset, optimize_connection_queryset,
+)
 
 
 class LikeType(DjangoObjectType):
@@ -19,6 +28,9 @@ class LikeType(DjangoObjectType):
     class Meta:
         model = Like
         fields = '__all__'
+    
+    def resolve_user(self, info):
+        return load_related(info, self, 'user')
 
 
 class ShareType(DjangoObjectType):
@@ -28,6 +40,12 @@ class ShareType(DjangoObjectType):
     class Meta:
         model = Share
         fields = '__all__'
+    
+    def resolve_user(self, info):
+        return load_related(info, self, 'user')
+    
+    def resolve_post(self, info):
+        return load_related(info, self, 'post')
 
 
 class BookmarkType(DjangoObjectType):
@@ -37,15 +55,33 @@ class BookmarkType(DjangoObjectType):
     class Meta:
         model = Bookmark
         fields = '__all__'
+    
+    def resolve_user(self, info):
+        return load_related(info, self, 'user')
+    
+    def resolve_post(self, info):
+        return load_related(info, self, 'post')
 
 
 class NotificationType(DjangoObjectType):
     """
     GraphQL Type for Notification model
     """
+    recent_actors = graphene.List(UserType)
+    
     class Meta:
         model = Notification
         fields = '__all__'
+    
+    def resolve_recipient(self, info):
+        return load_related(info, self, 'recipient')
+    
+    def resolve_sender(self, info):
+        return load_related(info, self, 'sender')
+    
+    def resolve_recent_actors(self, info):
+        users = get_loaders(info).users.load_many(self.recent_actors)
+        return [user for user in users if user is not None]
 
 
 class ReportType(DjangoObjectType):
@@ -66,6 +102,38 @@ class ReportType(DjangoObjectType):
         fields = '__all__'
 
 
+class LikeConnection(graphene.relay.Connection):
+    """
+    Relay connection of likes, paginated by (created_at, id) cursors
+    """
+    class Meta:
+        node = LikeType
+
+
+class ShareConnection(graphene.relay.Connection):
+    """
+    Relay connection of shares, paginated by (created_at, id) cursors
+    """
+    class Meta:
+        node = ShareType
+
+
+class BookmarkConnection(graphene.relay.Connection):
+    """
+    Relay connection of bookmarks, paginated by (created_at, id) cursors
+    """
+    class Meta:
+        node = BookmarkType
+
+
+class NotificationConnection(graphene.relay.Connection):
+    """
+    Relay connection of notifications, paginated by (created_at, id) cursors
+    """
+    class Meta:
+        node = NotificationType
+
+
 class InteractionQuery(graphene.ObjectType):
     """
     GraphQL Queries for Interactions
@@ -91,6 +159,43 @@ class InteractionQuery(graphene.ObjectType):
     my_reports = graphene.List(ReportType)  # User's own reports
     content_reports = graphene.List(ReportType, content_type=graphene.String(required=True), object_id=graphene.ID(required=True))
     
+    # Cursor-paginated connections
+    post_likes_connection = graphene.Field(
+        LikeConnection,
+        post_id=graphene.ID(required=True),
+        first=graphene.Int(),
+        after=graphene.String()
+    )
+    user_likes_connection = graphene.Field(
+        LikeConnection,
+        user_id=graphene.ID(required=True),
+        first=graphene.Int(),
+        after=graphene.String()
+    )
+    post_shares_connection = graphene.Field(
+        ShareConnection,
+        post_id=graphene.ID(required=True),
+        first=graphene.Int(),
+        after=graphene.String()
+    )
+    user_shares_connection = graphene.Field(
+        ShareConnection,
+        user_id=graphene.ID(required=True),
+        first=graphene.Int(),
+        after=graphene.String()
+    )
+    user_bookmarks_connection = graphene.Field(
+        BookmarkConnection,
+        first=graphene.Int(),
+        after=graphene.String()
+    )
+    my_notifications_connection = graphene.Field(
+        NotificationConnection,
+        unread_only=graphene.Boolean(),
+        first=graphene.Int(),
+        after=graphene.String()
+    )
+    
     def resolve_post_likes(self, info, post_id):
         post_content_type = ContentType.objects.get_for_model(Post)
         return Like.objects.filter(
@@ -116,15 +221,17 @@ class InteractionQuery(graphene.ObjectType):
     
     @login_required
     def resolve_user_bookmarks(self, info):
-        return Bookmark.objects.filter(user=info.context.user)
+        return optimize_queryset(Bookmark.objects.filter(user=info.context.user), info)
     
+    @concurrent_resolver
     @login_required
     def resolve_my_notifications(self, info, unread_only=False):
         notifications = Notification.objects.filter(recipient=info.context.user)
         if unread_only:
             notifications = notifications.filter(is_read=False)
-        return notifications
+        return optimize_queryset(notifications, info)
     
+    @concurrent_resolver
     @login_required
     def resolve_unread_count(self, info):
         return Notification.objects.filter(
@@ -159,6 +266,49 @@ class InteractionQuery(graphene.ObjectType):
             content_type=content_type_obj,
             object_id=object_id
         ).order_by('-created_at')
+    
+    def resolve_post_likes_connection(self, info, post_id, first=None, after=None):
+        likes = Like.objects.filter(
+            content_type=ContentType.objects.get_for_model(Post),
+            object_id=post_id
+        )
+        likes = optimize_connection_queryset(likes, info, LikeConnection)
+        return connection_from_queryset(LikeConnection, likes, first, after)
+    
+    def resolve_user_likes_connection(self, info, user_id, first=None, after=None):
+        likes = optimize_connection_queryset(
+            Like.objects.filter(user_id=user_id), info, LikeConnection
+        )
+        return connection_from_queryset(LikeConnection, likes, first, after)
+    
+    def resolve_post_shares_connection(self, info, post_id, first=None, after=None):
+        shares = optimize_connection_queryset(
+            Share.objects.filter(post_id=post_id), info, ShareConnection
+        )
+        return connection_from_queryset(ShareConnection, shares, first, after)
+    
+    def resolve_user_shares_connection(self, info, user_id, first=None, after=None):
+        shares = optimize_connection_queryset(
+            Share.objects.filter(user_id=user_id), info, ShareConnection
+        )
+        return connection_from_queryset(ShareConnection, shares, first, after)
+    
+    @login_required
+    def resolve_user_bookmarks_connection(self, info, first=None, after=None):
+        bookmarks = optimize_connection_queryset(
+            Bookmark.objects.filter(user=info.context.user), info, BookmarkConnection
+        )
+        return connection_from_queryset(BookmarkConnection, bookmarks, first, after)
+    
+    @login_required
+    def resolve_my_notifications_connection(self, info, unread_only=False, first=None, after=None):
+        notifications = Notification.objects.filter(recipient=info.context.user)
+        if unread_only:
+            notifications = notifications.filter(is_read=False)
+        notifications = optimize_connection_queryset(
+            notifications, info, NotificationConnection
+        )
+        return connection_from_queryset(NotificationConnection, notifications, first, after)
 
 
 class LikePost(graphene.Mutation):
@@ -188,18 +338,18 @@ class LikePost(graphene.Mutation):
                 
                 if created:
                     # Update post likes count
-                    post.likes_count += 1
-                    post.save(update_fields=['likes_count'])
+                    counters.increment(post, 'likes_count')
                     
                     # Create notification for post author
-                    if post.author != user:
-                        Notification.objects.create(
-                            recipient=post.author,
-                            sender=user,
-                            notification_type='like',
-                            message=f"{user.username} liked your post",
-                            content_type=post_content_type,
-                            object_id=post_id
+                    if post.author_id != user.id:
+                        enqueue_notification(
+                            f"like:{like.id}",
+                            post.author_id,
+                            user.id,
+                            'like',
+                            f"{user.username} liked your post",
+                            post_content_type.id,
+                            post.id
                         )
                 
                 return LikePost(like=like, success=True, errors=[])
@@ -235,8 +385,7 @@ class UnlikePost(graphene.Mutation):
                 like.delete()
                 
                 # Update post likes count
-                post.likes_count -= 1
-                post.save(update_fields=['likes_count'])
+                counters.decrement(post, 'likes_count')
                 
                 return UnlikePost(success=True, errors=[])
         except Like.DoesNotExist:
@@ -278,19 +427,19 @@ class SharePost(graphene.Mutation):
                 
                 if created:
                     # Update post shares count
-                    post.shares_count += 1
-                    post.save(update_fields=['shares_count'])
+                    counters.increment(post, 'shares_count')
                     
                     # Create notification for post author
-                    if post.author != user:
+                    if post.author_id != user.id:
                         post_content_type = ContentType.objects.get_for_model(Post)
-                        Notification.objects.create(
-                            recipient=post.author,
-                            sender=user,
-                            notification_type='share',
-                            message=f"{user.username} shared your post",
-                            content_type=post_content_type,
-                            object_id=post_id
+                        enqueue_notification(
+                            f"share:{share.id}",
+                            post.author_id,
+                            user.id,
+                            'share',
+                            f"{user.username} shared your post",
+                            post_content_type.id,
+                            post.id
                         )
                 
                 return SharePost(share=share, success=True, errors=[])
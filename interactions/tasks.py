@@ -4,13 +4,15 @@ Celery tasks for interactions app.
 
 from celery import shared_task
 from django.contrib.contenttypes.models import ContentType
-from .models import Notification
+from .models import Notification, NotificationReceipt
+from .notifications import notify
 
 
 @shared_task
 def send_notification(recipient_id, sender_id, notification_type, message, content_type_id=None, object_id=None):
     """
-    Send a notification to a user.
+    Send a notification to a user, coalesced with a recent one of the same
+    group when its type is grouped (see interactions/notifications.py).
     """
     try:
         from users.models import User
@@ -20,22 +22,34 @@ def send_notification(recipient_id, sender_id, notification_type, message, conte
         
         content_type = None
         if content_type_id:
-            content_type = ContentType.objects.get(id=content_type_id)
+            content_type = ContentType.objects.get_for_id(content_type_id)
         
-        notification = Notification.objects.create(
-            recipient=recipient,
-            sender=sender,
-            notification_type=notification_type,
-            message=message,
-            content_type=content_type,
-            object_id=object_id
+        notification, merged = notify(
+            recipient, sender, notification_type, message, content_type, object_id
         )
         
+        if merged:
+            return f"Notification {notification.id} merged for {recipient.username} ({notification.actor_count} actors)"
         return f"Notification {notification.id} sent to {recipient.username}"
     except Exception as e:
         return f"Error sending notification: {str(e)}"
 
 
+@shared_task
+def deliver_notifications():
+    """
+    Deliver queued notification events in batches
+    (see interactions/notification_queue.py).
+    """
+    from .notification_queue import drain
+    
+    try:
+        taken = drain()
+        return f"Delivered {taken} notification events"
+    except Exception as e:
+        return f"Error delivering notifications: {str(e)}"
+
+
 @shared_task
 def cleanup_old_notifications():
     """
@@ -51,6 +65,11 @@ def cleanup_old_notifications():
             created_at__lt=cutoff_date
         ).delete()[0]
         
+        # Queued events are redelivered within minutes, not days
+        NotificationReceipt.objects.filter(
+            created_at__lt=timezone.now() - timedelta(days=7)
+        ).delete()
+        
         return f"Cleaned up {deleted_count} old notifications"
     except Exception as e:
         return f"Error cleaning up notifications: {str(e)}"
@@ -62,26 +81,26 @@ def update_trending_hashtags():
     Update trending hashtags based on recent activity.
     """
     try:
-        from posts.models import Hashtag, PostHashtag
-        from django.utils import timezone
-        from datetime import timedelta
-        from django.db import models
+        from posts.trending import prune_buckets, refresh_trending
         
-        # Get hashtags used in the last 7 days
-        week_ago = timezone.now() - timedelta(days=7)
-        recent_hashtags = PostHashtag.objects.filter(
-            created_at__gte=week_ago
-        ).values('hashtag').annotate(
-            recent_count=models.Count('hashtag')
-        )
+        # Same ranking as posts.tasks.update_trending_hashtags
+        ranking = refresh_trending()
+        prune_buckets()
         
-        # Update trending scores (simplified algorithm)
-        for item in recent_hashtags:
-            hashtag = Hashtag.objects.get(id=item['hashtag'])
-            # Simple trending score: recent posts * 2 + total posts
-            hashtag.trending_score = item['recent_count'] * 2 + hashtag.posts_count
-            hashtag.save(update_fields=['trending_score'])
-        
-        return f"Updated trending scores for {len(recent_hashtags)} hashtags"
+        return f"Updated trending scores for {len(ranking)} hashtags"
     except Exception as e:
         return f"Error updating trending hashtags: {str(e)}"
+
+
+@shared_task
+def compact_counter_shards():
+    """
+    Fold sharded engagement counter deltas back into their base columns.
+    """
+    from social_media_backend.counters import compact_shards
+    
+    try:
+        compacted = compact_shards()
+        return f"Compacted {compacted} sharded counters"
+    except Exception as e:
+        return f"Error compacting counter shards: {str(e)}"
@@ -1,3 +1,337 @@
-from django.test import TestCase
+import json
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from posts import view_counter
+from posts.models import Post
+from social_media_backend import counters
+from social_media_backend.graphql_testing import QueryBudgetMixin
+from social_media_backend.schema import schema
+from users.models import User
+
+from . import notification_queue
+from .models import CounterShard, Notification, NotificationReceipt
+from .notification_queue import LocalNotificationQueue, drain, push_events
+from .notifications import deliver_events, notify
+
+
+class NotificationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = cls.create_user('author')
+        cls.fans = [cls.create_user(f'fan{i}') for i in range(4)]
+        cls.post = Post.objects.create(author=cls.author, content='hello')
+        cls.other_post = Post.objects.create(author=cls.author, content='again')
+        cls.post_type = ContentType.objects.get_for_model(Post)
+
+    @staticmethod
+    def create_user(username):
+        return User.objects.create_user(
+            username=username, email=f'{username}@example.com', password='secret'
+        )
+
+    def like(self, fan, post=None):
+        post = post or self.post
+        return {
+            'key': f'like:{fan.pk}:{post.pk}',
+            'recipient_id': self.author.pk,
+            'sender_id': fan.pk,
+            'type': 'like',
+            'message': f'{fan.username} liked your post',
+            'content_type_id': self.post_type.pk,
+            'object_id': post.pk,
+            'attempts': 0,
+        }
+
+    def notifications(self):
+        return Notification.objects.filter(recipient=self.author)
+
+
+class CoalescingTests(NotificationTestCase):
+    def notify_like(self, fan, post=None):
+        post = post or self.post
+        return notify(
+            self.author, fan, 'like', f'{fan.username} liked your post', self.post_type, post.pk
+        )
+
+    def test_likes_of_a_post_are_merged(self):
+        for fan in self.fans[:3]:
+            self.notify_like(fan)
+        notification = self.notifications().get()
+        self.assertEqual(notification.actor_count, 3)
+        self.assertEqual(notification.sender, self.fans[2])
+        self.assertEqual(notification.recent_actors, [fan.pk for fan in reversed(self.fans[:3])])
+        self.assertEqual(notification.message, 'fan2 and 2 others liked your post')
+
+    def test_single_like_keeps_its_message(self):
+        notification, merged = self.notify_like(self.fans[0])
+        self.assertFalse(merged)
+        self.assertEqual(notification.actor_count, 1)
+        self.assertEqual(notification.message, 'fan0 liked your post')
+
+    def test_posts_are_grouped_separately(self):
+        self.notify_like(self.fans[0])
+        self.notify_like(self.fans[1], self.other_post)
+        self.assertEqual(self.notifications().count(), 2)
+
+    def test_likes_and_shares_are_grouped_separately(self):
+        self.notify_like(self.fans[0])
+        notify(self.author, self.fans[1], 'share', 'fan1 shared your post', self.post_type, self.post.pk)
+        self.assertEqual(
+            sorted(self.notifications().values_list('notification_type', 'actor_count')),
+            [('like', 1), ('share', 1)],
+        )
+
+    def test_repeated_actor_is_counted_once(self):
+        self.notify_like(self.fans[0])
+        self.notify_like(self.fans[1])
+        self.notify_like(self.fans[0])
+        notification = self.notifications().get()
+        self.assertEqual(notification.actor_count, 2)
+        self.assertEqual(notification.recent_actors, [self.fans[0].pk, self.fans[1].pk])
+        self.assertEqual(notification.message, 'fan0 and 1 other liked your post')
+
+    @override_settings(NOTIFICATIONS={'RECENT_ACTORS': 2})
+    def test_recent_actors_are_capped(self):
+        for fan in self.fans:
+            self.notify_like(fan)
+        notification = self.notifications().get()
+        self.assertEqual(notification.actor_count, 4)
+        self.assertEqual(notification.recent_actors, [self.fans[3].pk, self.fans[2].pk])
+
+    def test_merge_marks_the_notification_unread(self):
+        notification, _ = self.notify_like(self.fans[0])
+        Notification.objects.filter(pk=notification.pk).update(is_read=True)
+        self.notify_like(self.fans[1])
+        self.assertFalse(self.notifications().get().is_read)
+
+    def test_window_expiry_starts_a_new_group(self):
+        notification, _ = self.notify_like(self.fans[0])
+        Notification.objects.filter(pk=notification.pk).update(
+            created_at=timezone.now() - timedelta(days=2)
+        )
+        _, merged = self.notify_like(self.fans[1])
+        self.assertFalse(merged)
+        self.assertEqual(self.notifications().count(), 2)
+
+    def test_ungrouped_types_are_not_merged(self):
+        for fan in self.fans[:2]:
+            notify(self.author, fan, 'comment', 'new comment', self.post_type, self.post.pk)
+        self.assertEqual(self.notifications().count(), 2)
+
+
+class DeliverEventsTests(NotificationTestCase):
+    def test_batch_is_coalesced_per_post(self):
+        events = [self.like(fan) for fan in self.fans] + [self.like(self.fans[0], self.other_post)]
+        stats = deliver_events(events)
+        self.assertEqual(stats, {'created': 2, 'merged': 3, 'duplicate': 0, 'dropped': 0})
+        counts = dict(self.notifications().values_list('object_id', 'actor_count'))
+        self.assertEqual(counts, {self.post.pk: 4, self.other_post.pk: 1})
+        notification = self.notifications().get(object_id=self.post.pk)
+        self.assertEqual(notification.message, 'fan3 and 3 others liked your post')
+
+    def test_merges_into_an_existing_notification(self):
+        deliver_events([self.like(self.fans[0])])
+        stats = deliver_events([self.like(self.fans[1]), self.like(self.fans[2])])
+        self.assertEqual(stats['merged'], 2)
+        self.assertEqual(self.notifications().get().actor_count, 3)
+
+    def test_same_event_twice_is_delivered_once(self):
+        event = self.like(self.fans[0])
+        self.assertEqual(deliver_events([event, event])['duplicate'], 1)
+        self.assertEqual(deliver_events([event])['duplicate'], 1)
+        self.assertEqual(self.notifications().get().actor_count, 1)
+        self.assertTrue(NotificationReceipt.objects.filter(key=event['key']).exists())
+
+    def test_events_of_deleted_users_are_dropped(self):
+        ghost = self.create_user('ghost')
+        event = self.like(ghost)
+        ghost.delete()
+        self.assertEqual(deliver_events([event])['dropped'], 1)
+        self.assertFalse(self.notifications().exists())
+
+
+@override_settings(NOTIFICATION_QUEUE={
+    'BACKEND': 'interactions.notification_queue.LocalNotificationQueue',
+    'BATCH_SIZE': 2,
+    'MAX_BATCHES': 10,
+})
+class NotificationQueueTests(NotificationTestCase):
+    def setUp(self):
+        self.queue = LocalNotificationQueue()
+        patcher = mock.patch.object(notification_queue, '_queue', self.queue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def queue_events(self, events):
+        self.queue.push([json.dumps({**event, 'queued_at': 0}) for event in events])
+
+    def test_drain_delivers_in_batches(self):
+        self.queue_events([self.like(fan) for fan in self.fans])
+        with mock.patch.object(
+            notification_queue, 'deliver_events', wraps=deliver_events
+        ) as deliver:
+            self.assertEqual(drain(), 4)
+        self.assertEqual([len(call.args[0]) for call in deliver.call_args_list], [2, 2])
+        self.assertEqual(len(self.queue), 0)
+        self.assertEqual(self.notifications().get().actor_count, 4)
+
+    def test_redelivered_batch_creates_no_duplicates(self):
+        self.queue_events([self.like(fan) for fan in self.fans[:2]])
+        drain()
+        self.queue_events([self.like(fan) for fan in self.fans[:2]])
+        drain()
+        notification = self.notifications().get()
+        self.assertEqual(notification.actor_count, 2)
+        self.assertEqual(NotificationReceipt.objects.count(), 2)
+
+    def test_unacknowledged_batch_is_recovered_once(self):
+        self.queue_events([self.like(self.fans[0])])
+        self.queue.visibility_timeout = -1
+        # Taken by a worker that died before delivering it
+        self.assertEqual(len(self.queue.take(10)), 1)
+        self.assertEqual(len(self.queue), 0)
+        with self.assertLogs(notification_queue.logger, 'WARNING'):
+            self.assertEqual(drain(), 1)
+        self.assertEqual(drain(), 0)
+        self.assertEqual(self.notifications().get().actor_count, 1)
+
+    def test_failed_event_is_retried_then_dead_lettered(self):
+        self.queue_events([self.like(self.fans[0])])
+        with mock.patch.object(notification_queue, 'deliver_events', side_effect=RuntimeError):
+            for _ in range(notification_queue.DEFAULTS['MAX_ATTEMPTS']):
+                with self.assertLogs(notification_queue.logger, 'ERROR'):
+                    self.assertEqual(drain(), 1)
+        self.assertEqual(len(self.queue), 0)
+        self.assertEqual(len(self.queue._dead), 1)
+        self.assertFalse(self.notifications().exists())
+
+    def test_one_bad_event_does_not_block_the_batch(self):
+        self.queue_events([self.like(self.fans[0]), self.like(self.fans[1])])
+        bad_key = self.like(self.fans[1])['key']
+
+        def deliver(events):
+            if any(event['key'] == bad_key for event in events):
+                raise RuntimeError('bad event')
+            return deliver_events(events)
+
+        with mock.patch.object(notification_queue, 'deliver_events', side_effect=deliver):
+            with self.assertLogs(notification_queue.logger, 'ERROR') as logs:
+                drain()
+        self.assertIn(f'Notification event {bad_key} failed', logs.output[-1])
+        self.assertEqual(self.notifications().get().sender, self.fans[0])
+        self.assertEqual(len(self.queue), 1)
+        drain()
+        self.assertEqual(self.notifications().get().actor_count, 2)
+
+    def test_push_events_drains_the_local_queue(self):
+        push_events([self.like(self.fans[0]), self.like(self.fans[1])])
+        self.assertEqual(len(self.queue), 0)
+        self.assertEqual(self.notifications().get().actor_count, 2)
+
+    def test_like_mutations_are_queued_on_commit(self):
+        query = 'mutation($id: ID!) { likePost(postId: $id) { success } }'
+        for fan in self.fans[:3]:
+            request = RequestFactory().post('/graphql/')
+            request.user = fan
+            with self.captureOnCommitCallbacks(execute=True):
+                result = schema.execute(
+                    query, context_value=request, variable_values={'id': str(self.post.pk)}
+                )
+            self.assertIsNone(result.errors)
+        notification = self.notifications().get()
+        self.assertEqual(notification.actor_count, 3)
+        self.assertEqual(notification.message, 'fan2 and 2 others liked your post')
+
+
+class CounterTests(NotificationTestCase):
+    def setUp(self):
+        caches['default'].clear()
+
+    def mutate(self, fan, mutation, post=None):
+        request = RequestFactory().post('/graphql/')
+        request.user = fan
+        result = schema.execute(
+            f'mutation($id: ID!) {{ {mutation}(postId: $id) {{ success errors }} }}',
+            context_value=request, variable_values={'id': str((post or self.post).pk)},
+        )
+        self.assertIsNone(result.errors)
+        return result.data[mutation]
+
+    def likes(self):
+        return Post.objects.values_list('likes_count', flat=True).get(pk=self.post.pk)
+
+    def test_stale_instances_do_not_lose_increments(self):
+        # Each writer read the row before any of the others wrote it
+        copies = [Post.objects.get(pk=self.post.pk) for _ in range(3)]
+        for copy in copies:
+            counters.increment(copy, 'likes_count')
+        self.assertEqual(self.likes(), 3)
+        self.assertEqual([copy.likes_count for copy in copies], [1, 1, 1])
+
+    def test_decrements_clamp_at_zero(self):
+        Post.objects.filter(pk=self.post.pk).update(likes_count=1)
+        copies = [Post.objects.get(pk=self.post.pk) for _ in range(2)]
+        for copy in copies:
+            counters.decrement(copy, 'likes_count')
+        self.assertEqual(self.likes(), 0)
+        self.assertEqual([copy.likes_count for copy in copies], [0, 0])
+
+    def test_interleaved_likes_and_unlikes(self):
+        self.mutate(self.fans[0], 'likePost')
+        self.mutate(self.fans[1], 'likePost')
+        # A repeated like is not counted twice
+        self.assertTrue(self.mutate(self.fans[0], 'likePost')['success'])
+        self.assertEqual(self.likes(), 2)
+        self.mutate(self.fans[0], 'unlikePost')
+        self.assertEqual(
+            self.mutate(self.fans[0], 'unlikePost'),
+            {'success': False, 'errors': ['Like not found']},
+        )
+        self.assertEqual(self.likes(), 1)
+        # A drifted counter is not pushed below zero
+        Post.objects.filter(pk=self.post.pk).update(likes_count=0)
+        self.mutate(self.fans[1], 'unlikePost')
+        self.assertEqual(self.likes(), 0)
+
+    @override_settings(COUNTERS={'SHARDED_FIELDS': ('posts.Post.likes_count',), 'SHARDS': 2})
+    def test_sharded_counter(self):
+        for fan in self.fans[:3]:
+            self.mutate(fan, 'likePost')
+        self.mutate(self.fans[0], 'unlikePost')
+        self.assertEqual(self.likes(), 0)
+        self.assertLessEqual(CounterShard.objects.count(), 2)
+        self.assertEqual(counters.counter_value(Post.objects.get(pk=self.post.pk), 'likes_count'), 2)
+        with mock.patch.object(view_counter, '_buffer', view_counter.LocalViewBuffer(flush_interval=0)):
+            result = schema.execute(
+                'query($id: ID!) { post(id: $id) { likesCount } }',
+                context_value=RequestFactory().get('/graphql/'), variable_values={'id': self.post.pk},
+            )
+        self.assertEqual(result.data['post']['likesCount'], 2)
+        self.assertEqual(counters.compact_shards(), 1)
+        self.assertEqual(self.likes(), 2)
+        self.assertFalse(CounterShard.objects.exists())
+
+
+class NotificationQueryBudgetTests(QueryBudgetMixin, NotificationTestCase):
+    def setUp(self):
+        caches['default'].clear()
+        deliver_events([self.like(fan) for fan in self.fans])
+        deliver_events([self.like(self.fans[0], self.other_post)])
+        for fan in self.fans:
+            notify(self.author, fan, 'follow', f'{fan.username} followed you')
+
+    def test_my_notifications(self):
+        result = self.assertQueryBudget(
+            """{ myNotifications {
+                id message actorCount
+                sender { username } recipient { username } recentActors { username }
+            } }""",
+            5, user=self.author
+        )
+        self.assertEqual(len(result.data['myNotifications']), 6)
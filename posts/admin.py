@@ -5,6 +5,7 @@ Admin configuration for Posts app
 from django.contrib import admin
 from django.utils.html import format_html
 from .models import Post, Comment, Hashtag, PostHashtag
+from .search import get_search_backend
 
 
 @admin.register(Post)
@@ -47,6 +48,14 @@ class PostAdmin(admin.ModelAdmin):
     
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('author')
+    
+    def get_search_results(self, request, queryset, search_term):
+        """Match content through the full-text index instead of ILIKE"""
+        if not search_term:
+            return super().get_search_results(request, queryset, search_term)
+        matches = get_search_backend().filter_queryset(queryset, search_term)
+        by_author = queryset.filter(author__username__icontains=search_term)
+        return matches | by_author, False
 
 
 @admin.register(Comment)
@@ -0,0 +1,111 @@
+"""
+In-memory hashtag autocomplete
+
+``autocompleteHashtags`` is called on every keystroke of the post composer, so
+it is served from a process-local index and never queries the database on the
+hot path. The index is a sorted list of hashtag names: the names starting with
+a prefix form one contiguous range found by bisection, ranked by
+``posts_count``. Rankings of short prefixes (the widest ranges) are memoized.
+
+The index is rebuilt from ``Hashtag`` on first use and then every
+``REBUILD_INTERVAL`` seconds, and ``attach_hashtags`` feeds it the tags of each
+new post once the transaction commits, so new tags are suggested immediately.
+"""
+
+import bisect
+import heapq
+import threading
+import time
+
+from django.db import transaction
+
+from .models import Hashtag
+
+REBUILD_INTERVAL = 300
+# Prefixes up to this length have their ranking memoized
+MEMOIZED_PREFIX_LENGTH = 2
+MAX_SUGGESTIONS = 50
+
+
+class HashtagPrefixIndex:
+    """
+    Sorted prefix index of ``(name, id, posts_count)`` entries.
+    """
+
+    def __init__(self, rebuild_interval=REBUILD_INTERVAL):
+        self.rebuild_interval = rebuild_interval
+        self._lock = threading.Lock()
+        self._names = []
+        self._entries = {}
+        self._memo = {}
+        self._built_at = None
+
+    def rebuild(self):
+        rows = Hashtag.objects.values_list('name', 'id', 'posts_count')
+        entries = {name: (hashtag_id, posts_count) for name, hashtag_id, posts_count in rows}
+        with self._lock:
+            self._entries = entries
+            self._names = sorted(entries)
+            self._memo = {}
+            self._built_at = time.monotonic()
+        return len(entries)
+
+    def _ensure_fresh(self):
+        if self._built_at is None or time.monotonic() - self._built_at >= self.rebuild_interval:
+            self.rebuild()
+
+    def suggest(self, prefix, limit=10):
+        """``[(name, id, posts_count), ...]`` most used first."""
+        prefix = prefix.strip().lstrip('#').lower()
+        limit = min(limit, MAX_SUGGESTIONS)
+        if not prefix or limit <= 0:
+            return []
+        self._ensure_fresh()
+        with self._lock:
+            memoized = len(prefix) <= MEMOIZED_PREFIX_LENGTH
+            if memoized and prefix in self._memo:
+                return self._memo[prefix][:limit]
+            start = bisect.bisect_left(self._names, prefix)
+            end = bisect.bisect_left(self._names, prefix + '\U0010ffff', lo=start)
+            size = MAX_SUGGESTIONS if memoized else limit
+            names = heapq.nsmallest(
+                size, self._names[start:end],
+                key=lambda name: (-self._entries[name][1], name)
+            )
+            suggestions = [(name, *self._entries[name]) for name in names]
+            if memoized:
+                self._memo[prefix] = suggestions
+        return suggestions[:limit]
+
+    def add(self, hashtags):
+        """Count one more use of each ``Hashtag``, inserting unknown names."""
+        with self._lock:
+            if self._built_at is None:
+                # Built from the database on first use anyway
+                return
+            for hashtag in hashtags:
+                entry = self._entries.get(hashtag.name)
+                if entry is None:
+                    bisect.insort(self._names, hashtag.name)
+                    self._entries[hashtag.name] = (hashtag.id, 1)
+                else:
+                    self._entries[hashtag.name] = (entry[0], entry[1] + 1)
+                for length in range(1, min(len(hashtag.name), MEMOIZED_PREFIX_LENGTH) + 1):
+                    self._memo.pop(hashtag.name[:length], None)
+
+
+_index = None
+
+
+def get_hashtag_index():
+    """Return the process-wide hashtag prefix index."""
+    global _index
+    if _index is None:
+        _index = HashtagPrefixIndex()
+    return _index
+
+
+def add_hashtags_on_commit(hashtags):
+    hashtags = list(hashtags)
+    if hashtags:
+        transaction.on_commit(lambda: get_hashtag_index().add(hashtags))
@@ -0,0 +1,61 @@
+"""
+Hashtag extraction and bulk resolution for new posts
+
+Tags come from the explicit ``hashtags`` argument of ``createPost`` and from
+``#tags`` written in the content. They are normalized, deduplicated and
+resolved with a constant number of queries whatever their count: one
+``bulk_create(ignore_conflicts=True)`` for unknown names, one ``IN`` lookup,
+one ``bulk_create`` of the links and one ``F()`` update of ``posts_count``.
+"""
+
+import re
+
+from social_media_backend import counters
+from .hashtag_autocomplete import add_hashtags_on_commit
+from .models import Hashtag, PostHashtag
+from .trending import record_hashtag_uses
+
+MAX_HASHTAG_LENGTH = Hashtag._meta.get_field('name').max_length
+
+# A '#' not preceded by a word character or another '#' (so "a#b" and "##b"
+# are not tags), followed by letters, digits or underscores in any script.
+HASHTAG_PATTERN = re.compile(r'(?<![\w#])#(\w+)')
+
+
+def normalize_hashtag(name):
+    return name.strip().lstrip('#').lower()
+
+
+def extract_hashtags(content):
+    """Tags written in ``content``, in order of appearance."""
+    return HASHTAG_PATTERN.findall(content or '')
+
+
+def merge_hashtags(explicit, content):
+    """Normalized, deduplicated union of explicit and inline tags."""
+    names = {}
+    for name in list(explicit or []) + extract_hashtags(content):
+        name = normalize_hashtag(name)
+        if name and len(name) <= MAX_HASHTAG_LENGTH:
+            names.setdefault(name, None)
+    return list(names)
+
+
+def attach_hashtags(post, names):
+    """Create missing hashtags, link them to ``post`` and count the use."""
+    if not names:
+        return []
+    Hashtag.objects.bulk_create(
+        [Hashtag(name=name) for name in names],
+        ignore_conflicts=True
+    )
+    hashtags = list(Hashtag.objects.filter(name__in=names))
+    PostHashtag.objects.bulk_create(
+        [PostHashtag(post=post, hashtag=hashtag) for hashtag in hashtags]
+    )
+    hashtag_ids = [hashtag.id for hashtag in hashtags]
+    counters.increment_many(Hashtag, hashtag_ids, 'posts_count')
+    # Hourly usage buckets behind trendingHashtags
+    record_hashtag_uses(hashtag_ids)
+    add_hashtags_on_commit(hashtags)
+    return hashtags
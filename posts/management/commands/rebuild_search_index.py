@@ -0,0 +1,24 @@
+"""
+Django management command to rebuild the post search index.
+"""
+
+from django.core.management.base import BaseCommand
+from posts.search import InMemorySearchBackend, get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Recompute the full-text search documents of every post'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        if isinstance(backend, InMemorySearchBackend):
+            self.stdout.write(self.style.WARNING(
+                'The in-memory search index lives in each web process and is '
+                'built on first search; nothing to rebuild here'
+            ))
+            return
+
+        indexed = backend.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully reindexed {indexed} posts')
+        )
@@ -0,0 +1,43 @@
+"""
+Django management command to rebuild materialized home timelines.
+"""
+
+from django.core.management.base import BaseCommand
+from users.models import User
+from posts.timelines import get_timeline_backend, rebuild_timeline
+
+
+class Command(BaseCommand):
+    help = 'Rebuild home timelines from the follow graph (cold users by default)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            nargs='+',
+            help='IDs of the users whose timeline should be rebuilt'
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Rebuild every timeline, even the ones already materialized'
+        )
+
+    def handle(self, *args, **options):
+        backend = get_timeline_backend()
+        users = User.objects.filter(is_active=True).order_by('id')
+        if options['users']:
+            users = users.filter(id__in=options['users'])
+        force = options['all'] or bool(options['users'])
+
+        rebuilt = 0
+        for user in users.iterator(chunk_size=500):
+            if not force and backend.exists(user.id):
+                continue
+            entries = rebuild_timeline(user)
+            rebuilt += 1
+            self.stdout.write(f'Rebuilt timeline of @{user.username} ({entries} posts)')
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully rebuilt {rebuilt} timelines')
+        )
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0004_post_engagement_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HashtagBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('hashtag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='buckets', to='posts.hashtag')),
+            ],
+            options={
+                'verbose_name': 'Hashtag Bucket',
+                'verbose_name_plural': 'Hashtag Buckets',
+                'db_table': 'hashtag_buckets',
+                'indexes': [models.Index(fields=['hour'], name='hashtag_buc_hour_fb69cf_idx')],
+                'unique_together': {('hashtag', 'hour')},
+            },
+        ),
+    ]
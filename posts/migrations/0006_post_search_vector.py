@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:51
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    # GIN indexes and tsvectors only exist on PostgreSQL; other databases use
+    # the in-memory search backend.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS posts_search_vector_gin '
+        'ON posts USING gin (search_vector)'
+    )
+    schema_editor.execute(
+        "UPDATE posts SET search_vector = setweight(to_tsvector('english', content), 'A')"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS posts_search_vector_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0005_hashtagbucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def mark_existing_timelines(apps, schema_editor):
+    """Timelines that already have entries were built before the marker existed."""
+    TimelineEntry = apps.get_model('posts', 'TimelineEntry')
+    MaterializedTimeline = apps.get_model('posts', 'MaterializedTimeline')
+    user_ids = TimelineEntry.objects.values_list('user_id', flat=True).distinct()
+    MaterializedTimeline.objects.bulk_create(
+        [MaterializedTimeline(user_id=user_id) for user_id in user_ids.iterator()],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_search_indexes'),
+        ('posts', '0007_deferredtask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaterializedTimeline',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='materialized_timeline', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('built_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Materialized Timeline',
+                'verbose_name_plural': 'Materialized Timelines',
+                'db_table': 'materialized_timelines',
+            },
+        ),
+        migrations.RunPython(mark_existing_timelines, migrations.RunPython.noop),
+    ]
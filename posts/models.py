@@ -4,6 +4,7 @@ Post models for the social media backend.
 
 from django.db import models
 from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
 from django.utils import timezone
 from django.core.validators import FileExtensionValidator
 
@@ -46,6 +47,10 @@ class Post(models.Model):
     comments_count = models.PositiveIntegerField(default=0)
     shares_count = models.PositiveIntegerField(default=0)
     views_count = models.PositiveIntegerField(default=0)
+    # Maintained by posts.tasks.update_post_engagement_scores (see posts/ranking.py)
+    engagement_score = models.FloatField(default=0)
+    # Full-text search document, GIN-indexed on PostgreSQL (see posts/search.py)
+    search_vector = SearchVectorField(null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -58,6 +63,7 @@ class Post(models.Model):
             models.Index(fields=['-created_at']),
             models.Index(fields=['author', '-created_at']),
             models.Index(fields=['visibility', '-created_at']),
+            models.Index(fields=['visibility', '-engagement_score']),
         ]
 
     def __str__(self):
@@ -160,3 +166,104 @@ class PostHashtag(models.Model):
 
     def __str__(self):
         return f"{self.post} - {self.hashtag}"
+
+
+class HashtagBucket(models.Model):
+    """
+    Model counting the uses of a hashtag during one hour, used to compute
+    trending scores over a sliding window (see posts/trending.py).
+    """
+    hashtag = models.ForeignKey(
+        Hashtag,
+        on_delete=models.CASCADE,
+        related_name='buckets'
+    )
+    hour = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'hashtag_buckets'
+        unique_together = ('hashtag', 'hour')
+        verbose_name = 'Hashtag Bucket'
+        verbose_name_plural = 'Hashtag Buckets'
+        indexes = [
+            models.Index(fields=['hour']),
+        ]
+
+    def __str__(self):
+        return f"#{self.hashtag.name} @ {self.hour:%Y-%m-%d %H:00}: {self.count}"
+
+
+class TimelineEntry(models.Model):
+    """
+    Model representing one post materialized in a user's home timeline.
+    Only used by the database timeline backend (see posts/timelines.py).
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries'
+    )
+    # Copy of post.created_at so timelines are read from a single index
+    created_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'timeline_entries'
+        unique_together = ('user', 'post')
+        verbose_name = 'Timeline Entry'
+        verbose_name_plural = 'Timeline Entries'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.post} in timeline of @{self.user.username}"
+
+
+class MaterializedTimeline(models.Model):
+    """
+    Marks a user's database timeline as built, even when it holds no entries.
+    Only used by the database timeline backend (see posts/timelines.py).
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='materialized_timeline'
+    )
+    built_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'materialized_timelines'
+        verbose_name = 'Materialized Timeline'
+        verbose_name_plural = 'Materialized Timelines'
+
+    def __str__(self):
+        return f"Timeline of user {self.user_id}"
+
+
+class DeferredTask(models.Model):
+    """
+    Celery task that could not be enqueued (e.g. broker outage), sent again in
+    order by ``posts.tasks.send_deferred_tasks``.
+    See ``social_media_backend.celery.enqueue_on_commit``.
+    """
+    task = models.CharField(max_length=200)
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'deferred_tasks'
+        verbose_name = 'Deferred Task'
+        verbose_name_plural = 'Deferred Tasks'
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.task}{tuple(self.args)}"
@@ -0,0 +1,128 @@
+"""
+Engagement scores for the "ranked" post orderings
+
+``Post.engagement_score`` is the weighted sum of the engagement counters,
+decayed by age (minus 10% per day, floored at 10%). It is recomputed in bulk by
+``posts.tasks.update_post_engagement_scores``: rows are read with
+``values_list`` in id-ordered chunks, scored with vectorized NumPy arithmetic
+(pure Python when NumPy is not installed) and only the rows whose score moved
+are written back with ``bulk_update``.
+
+A post needs rescoring when it is still inside the decay window or when its
+counters changed since it was last scored, i.e. when its stored score no longer
+matches the fully decayed score of its current counters. Both conditions are
+evaluated in SQL, so settled posts are never read.
+"""
+
+import math
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import ExpressionWrapper, F, FloatField, Q, Value
+from django.db.models.functions import Abs
+from django.utils import timezone
+from graphql import GraphQLError
+
+from .models import Post
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+WEIGHTS = (
+    ('likes_count', 3),
+    ('comments_count', 5),
+    ('shares_count', 7),
+    ('views_count', 1),
+)
+DECAY_PER_DAY = 0.1
+MIN_TIME_FACTOR = 0.1
+# Age (in whole days) from which the time factor no longer changes
+DECAY_DAYS = math.ceil((1 - MIN_TIME_FACTOR) / DECAY_PER_DAY)
+# Scores closer than this are considered unchanged
+TOLERANCE = 1e-6
+
+RECENT = 'recent'
+RANKED = 'ranked'
+ORDERINGS = {
+    RECENT: ('-created_at', '-id'),
+    RANKED: ('-engagement_score', '-id'),
+}
+# Most recent feed entries considered when ranking the feed
+RANKED_FEED_WINDOW = 200
+
+
+def post_ordering(ordering):
+    """``order_by`` fields for an ``ordering`` argument value."""
+    try:
+        return ORDERINGS[ordering or RECENT]
+    except KeyError:
+        raise GraphQLError(
+            message=f"Unknown ordering '{ordering}', expected one of: {', '.join(ORDERINGS)}",
+            extensions={'code': 'VALIDATION_ERROR'}
+        )
+
+
+def compute_scores(counters, ages):
+    """
+    Scores for rows of ``counters`` (one value per ``WEIGHTS`` entry) and
+    ``ages`` in whole days.
+    """
+    if np is not None:
+        counters = np.asarray(counters, dtype=np.float64).reshape(-1, len(WEIGHTS))
+        weights = np.array([weight for _, weight in WEIGHTS], dtype=np.float64)
+        factors = np.maximum(MIN_TIME_FACTOR, 1 - np.asarray(ages, dtype=np.float64) * DECAY_PER_DAY)
+        return ((counters @ weights) * factors).tolist()
+    weights = [weight for _, weight in WEIGHTS]
+    return [
+        sum(count * weight for count, weight in zip(row, weights))
+        * max(MIN_TIME_FACTOR, 1 - age * DECAY_PER_DAY)
+        for row, age in zip(counters, ages)
+    ]
+
+
+def stale_posts(now=None):
+    """Posts whose stored score may be outdated."""
+    now = now or timezone.now()
+    settled_score = ExpressionWrapper(
+        sum((F(field) * weight for field, weight in WEIGHTS), Value(0)) * Value(MIN_TIME_FACTOR),
+        output_field=FloatField()
+    )
+    return Post.objects.annotate(
+        score_drift=Abs(F('engagement_score') - settled_score)
+    ).filter(
+        Q(created_at__gte=now - timedelta(days=DECAY_DAYS + 1)) |
+        Q(score_drift__gt=TOLERANCE)
+    )
+
+
+def recompute_engagement_scores(chunk_size=2000, now=None):
+    """Rescore stale posts; returns the number of rows whose score changed."""
+    now = now or timezone.now()
+    fields = [field for field, _ in WEIGHTS]
+    queryset = stale_posts(now).order_by('id')
+    updated = 0
+    last_id = 0
+    while True:
+        rows = list(
+            queryset.filter(id__gt=last_id)
+            .values_list('id', 'created_at', 'engagement_score', *fields)[:chunk_size]
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        ages = [(now - row[1]).days for row in rows]
+        scores = compute_scores([row[3:] for row in rows], ages)
+        changed = [
+            Post(id=row[0], engagement_score=score)
+            for row, score in zip(rows, scores)
+            if abs(row[2] - score) > TOLERANCE
+        ]
+        if changed:
+            with transaction.atomic():
+                Post.objects.bulk_update(changed, ['engagement_score'], batch_size=chunk_size)
+            updated += len(changed)
+        if len(rows) < chunk_size:
+            break
+    return updated
@@ -10,7 +10,24 @@ from django.db import transaction
 from django.core.paginator import Paginator
 
 from .models import Post, Comment, Hashtag, PostHashtag
+from .hashtag_autocomplete import get_hashtag_index
+from .hashtags import attach_hashtags, merge_hashtags
 from users.schema import UserType
+from social_media_backend import counters
+from social_media_backend.async_graphql import concurrent_resolver
+from social_media_backend.dataloaders import get_loaders, load_related
+from social_media_backend.query_planner import optimize_queryset
+from social_media_backend.celery import enqueue_on_commit
+from social_media_backend.pagination import (
+    OFFSET_DEPRECATION, connection_from_queryset, connection_from_ranked_ids,
+    decode_cursor, encode_timestamp_cursor, optimize_connection_queryset, page_size,
+)
+from .ranking import ORDERINGS, RANKED, RANKED_FEED_WINDOW, RECENT, post_ordering
+from .search import index_post_on_commit, search_posts, unindex_post_on_commit
+from .timelines import FEED_VISIBILITIES, read_feed, read_feed_entries
+from .trending import trending_hashtags
+from .view_counter import record_view
+from . import tasks
 
 
 class PostType(DjangoObjectType):
@@ -20,15 +37,29 @@ class PostType(DjangoObjectType):
     media_url = graphene.String()
     has_media = graphene.Boolean()
     
+    # Columns read by custom fields, used by the query planner
+    query_hints = {
+        'media_url': ('image', 'video'),
+        'has_media': ('image', 'video'),
+    }
+    
     class Meta:
         model = Post
-        fields = '__all__'
+        exclude = ('search_vector',)
+    
+    def resolve_author(self, info):
+        return load_related(info, self, 'author')
     
     def resolve_media_url(self, info):
         return self.get_media_url()
     
     def resolve_has_media(self, info):
         return self.has_media
+    
+    # Include pending shards of sharded counters (see social_media_backend.counters)
+    resolve_likes_count = counters.resolve_counter('likes_count')
+    resolve_comments_count = counters.resolve_counter('comments_count')
+    resolve_shares_count = counters.resolve_counter('shares_count')
 
 
 class CommentType(DjangoObjectType):
@@ -37,12 +68,41 @@ class CommentType(DjangoObjectType):
     """
     is_reply = graphene.Boolean()
     
+    query_hints = {
+        'is_reply': ('parent',),
+    }
+    
     class Meta:
         model = Comment
         fields = '__all__'
     
+    def resolve_author(self, info):
+        return load_related(info, self, 'author')
+    
+    def resolve_post(self, info):
+        return load_related(info, self, 'post')
+    
+    def resolve_parent(self, info):
+        return load_related(info, self, 'parent')
+    
     def resolve_is_reply(self, info):
-        return self.is_reply
+        return self.parent_id is not None
+
+
+class PostConnection(graphene.relay.Connection):
+    """
+    Relay connection of posts, paginated by (created_at, id) cursors
+    """
+    class Meta:
+        node = PostType
+
+
+class CommentConnection(graphene.relay.Connection):
+    """
+    Relay connection of comments, paginated by (created_at, id) cursors
+    """
+    class Meta:
+        node = CommentType
 
 
 class HashtagType(DjangoObjectType):
@@ -54,6 +114,15 @@ class HashtagType(DjangoObjectType):
         fields = '__all__'
 
 
+class HashtagSuggestionType(graphene.ObjectType):
+    """
+    Hashtag suggested while typing, served from the in-memory prefix index
+    """
+    id = graphene.ID()
+    name = graphene.String()
+    posts_count = graphene.Int()
+
+
 class PostHashtagType(DjangoObjectType):
     """
     GraphQL Type for PostHashtag model
@@ -74,19 +143,21 @@ class PostQuery(graphene.ObjectType):
     all_posts = graphene.List(
         PostType,
         first=graphene.Int(),
-        skip=graphene.Int(),
-        visibility=graphene.String()
+        skip=graphene.Int(deprecation_reason=OFFSET_DEPRECATION),
+        visibility=graphene.String(),
+        ordering=graphene.String(description="`recent` (default) or `ranked` by engagement score")
     )
     user_posts = graphene.List(
         PostType,
         user_id=graphene.ID(required=True),
         first=graphene.Int(),
-        skip=graphene.Int()
+        skip=graphene.Int(deprecation_reason=OFFSET_DEPRECATION)
     )
     feed = graphene.List(
         PostType,
         first=graphene.Int(),
-        skip=graphene.Int()
+        skip=graphene.Int(deprecation_reason=OFFSET_DEPRECATION),
+        ordering=graphene.String(description="`recent` (default) or `ranked` by engagement score")
     )
     
     # Comments
@@ -94,56 +165,117 @@ class PostQuery(graphene.ObjectType):
         CommentType,
         post_id=graphene.ID(required=True),
         first=graphene.Int(),
-        skip=graphene.Int()
+        skip=graphene.Int(deprecation_reason=OFFSET_DEPRECATION)
     )
     
     # Hashtags
     trending_hashtags = graphene.List(HashtagType, limit=graphene.Int())
+    autocomplete_hashtags = graphene.List(
+        HashtagSuggestionType,
+        prefix=graphene.String(required=True),
+        limit=graphene.Int()
+    )
     posts_by_hashtag = graphene.List(
         PostType,
         hashtag=graphene.String(required=True),
         first=graphene.Int(),
-        skip=graphene.Int()
+        skip=graphene.Int(deprecation_reason=OFFSET_DEPRECATION)
     )
     
+    # Cursor-paginated connections
+    all_posts_connection = graphene.Field(
+        PostConnection,
+        first=graphene.Int(),
+        after=graphene.String(),
+        visibility=graphene.String()
+    )
+    user_posts_connection = graphene.Field(
+        PostConnection,
+        user_id=graphene.ID(required=True),
+        first=graphene.Int(),
+        after=graphene.String()
+    )
+    feed_connection = graphene.Field(
+        PostConnection,
+        first=graphene.Int(),
+        after=graphene.String()
+    )
+    post_comments_connection = graphene.Field(
+        CommentConnection,
+        post_id=graphene.ID(required=True),
+        first=graphene.Int(),
+        after=graphene.String()
+    )
+    posts_by_hashtag_connection = graphene.Field(
+        PostConnection,
+        hashtag=graphene.String(required=True),
+        first=graphene.Int(),
+        after=graphene.String()
+    )
+    
+    # Full-text search over public posts, best match first
+    search_posts = graphene.Field(
+        PostConnection,
+        query=graphene.String(required=True),
+        first=graphene.Int(),
+        after=graphene.String(),
+        hashtag=graphene.String(),
+        author_id=graphene.ID()
+    )
+    
+    @concurrent_resolver
     def resolve_post(self, info, id):
-        try:
-            post = Post.objects.get(pk=id)
-            # Increment view count
-            post.views_count += 1
-            post.save(update_fields=['views_count'])
-            return post
-        except Post.DoesNotExist:
-            return None
+        post = get_loaders(info).posts.load(id)
+        if post is not None:
+            # Buffered and flushed in batches, see posts.view_counter
+            record_view(post.id, info.context)
+        return post
     
-    def resolve_all_posts(self, info, first=20, skip=0, visibility='public'):
-        posts = Post.objects.filter(visibility=visibility).order_by('-created_at')
-        return posts[skip:skip + first]
+    @concurrent_resolver
+    def resolve_all_posts(self, info, first=20, skip=0, visibility='public', ordering=RECENT):
+        posts = Post.objects.filter(visibility=visibility).order_by(*post_ordering(ordering))
+        return optimize_queryset(posts, info)[skip:skip + first]
     
     def resolve_user_posts(self, info, user_id, first=20, skip=0):
         posts = Post.objects.filter(author_id=user_id).order_by('-created_at')
-        return posts[skip:skip + first]
+        return optimize_queryset(posts, info)[skip:skip + first]
     
+    @concurrent_resolver
     @login_required
-    def resolve_feed(self, info, first=20, skip=0):
+    def resolve_feed(self, info, first=20, skip=0, ordering=RECENT):
         user = info.context.user
-        # Get posts from followed users + own posts
-        following_ids = user.following.values_list('following_id', flat=True)
-        posts = Post.objects.filter(
-            author_id__in=list(following_ids) + [user.id],
-            visibility__in=['public', 'followers']
-        ).order_by('-created_at')
-        return posts[skip:skip + first]
+        if post_ordering(ordering) == ORDERINGS[RANKED]:
+            # Rank the most recent window of the timeline by engagement score
+            candidate_ids = read_feed(user, offset=0, limit=RANKED_FEED_WINDOW)
+            posts = Post.objects.filter(
+                id__in=candidate_ids, visibility__in=FEED_VISIBILITIES
+            ).order_by(*ORDERINGS[RANKED])
+            return optimize_queryset(posts, info)[skip:skip + first]
+        
+        # Pushed timeline merged with followed celebrities' recent posts
+        post_ids = read_feed(user, offset=skip, limit=first)
+        posts = optimize_queryset(
+            Post.objects.filter(id__in=post_ids, visibility__in=FEED_VISIBILITIES),
+            info
+        )
+        posts_by_id = {post.id: post for post in posts}
+        return [posts_by_id[post_id] for post_id in post_ids if post_id in posts_by_id]
     
     def resolve_post_comments(self, info, post_id, first=20, skip=0):
         comments = Comment.objects.filter(
             post_id=post_id,
             parent__isnull=True
         ).order_by('created_at')
-        return comments[skip:skip + first]
+        return optimize_queryset(comments, info)[skip:skip + first]
     
     def resolve_trending_hashtags(self, info, limit=10):
-        return Hashtag.objects.order_by('-posts_count')[:limit]
+        return trending_hashtags(limit)
+    
+    def resolve_autocomplete_hashtags(self, info, prefix, limit=10):
+        return [
+            HashtagSuggestionType(id=hashtag_id, name=name, posts_count=posts_count)
+            for name, hashtag_id, posts_count in get_hashtag_index().suggest(prefix, limit)
+        ]
     
     def resolve_posts_by_hashtag(self, info, hashtag, first=20, skip=0):
         try:
@@ -155,9 +287,82 @@ class PostQuery(graphene.ObjectType):
                 id__in=post_ids,
                 visibility='public'
             ).order_by('-created_at')
-            return posts[skip:skip + first]
+            return optimize_queryset(posts, info)[skip:skip + first]
         except Hashtag.DoesNotExist:
             return []
+    
+    def resolve_all_posts_connection(self, info, first=None, after=None, visibility='public'):
+        posts = Post.objects.filter(visibility=visibility)
+        posts = optimize_connection_queryset(posts, info, PostConnection)
+        return connection_from_queryset(PostConnection, posts, first, after)
+    
+    def resolve_user_posts_connection(self, info, user_id, first=None, after=None):
+        posts = Post.objects.filter(author_id=user_id)
+        posts = optimize_connection_queryset(posts, info, PostConnection)
+        return connection_from_queryset(PostConnection, posts, first, after)
+    
+    @login_required
+    def resolve_feed_connection(self, info, first=None, after=None):
+        user = info.context.user
+        size = page_size(first)
+        before = None
+        if after:
+            created_at, post_id = decode_cursor(after)
+            before = (created_at.timestamp(), post_id)
+        entries = read_feed_entries(user, limit=size + 1, before=before)
+        has_next_page = len(entries) > size
+        entries = entries[:size]
+        
+        post_ids = [post_id for post_id, _ in entries]
+        posts = optimize_connection_queryset(
+            Post.objects.filter(id__in=post_ids, visibility__in=FEED_VISIBILITIES),
+            info, PostConnection
+        )
+        posts_by_id = {post.id: post for post in posts}
+        edges = [
+            PostConnection.Edge(
+                node=posts_by_id[post_id],
+                cursor=encode_timestamp_cursor(timestamp, post_id)
+            )
+            for post_id, timestamp in entries if post_id in posts_by_id
+        ]
+        return PostConnection(
+            edges=edges,
+            page_info=graphene.relay.PageInfo(
+                has_next_page=has_next_page,
+                has_previous_page=after is not None,
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None,
+            )
+        )
+    
+    def resolve_post_comments_connection(self, info, post_id, first=None, after=None):
+        comments = Comment.objects.filter(post_id=post_id, parent__isnull=True)
+        comments = optimize_connection_queryset(comments, info, CommentConnection)
+        # Comments read oldest first, like postComments
+        return connection_from_queryset(
+            CommentConnection, comments, first, after, descending=False
+        )
+    
+    def resolve_posts_by_hashtag_connection(self, info, hashtag, first=None, after=None):
+        posts = Post.objects.filter(
+            posthashtag__hashtag__name=hashtag,
+            visibility='public'
+        )
+        posts = optimize_connection_queryset(posts, info, PostConnection)
+        return connection_from_queryset(PostConnection, posts, first, after)
+    
+    def resolve_search_posts(self, info, query, first=None, after=None, hashtag=None, author_id=None):
+        def fetch_ids(offset, limit):
+            return search_posts(
+                query, offset=offset, limit=limit, hashtag=hashtag, author_id=author_id
+            )
+        
+        def load_nodes(ids):
+            posts = Post.objects.filter(id__in=ids, visibility='public')
+            return {post.id: post for post in optimize_connection_queryset(posts, info, PostConnection)}
+        
+        return connection_from_ranked_ids(PostConnection, fetch_ids, load_nodes, first, after)
 
 
 class CreatePost(graphene.Mutation):
@@ -184,24 +389,14 @@ class CreatePost(graphene.Mutation):
                     visibility=visibility
                 )
                 
-                # Handle hashtags
-                if hashtags:
-                    for hashtag_name in hashtags:
-                        hashtag_name = hashtag_name.strip().lower()
-                        if hashtag_name:
-                            hashtag, created = Hashtag.objects.get_or_create(
-                                name=hashtag_name
-                            )
-                            PostHashtag.objects.create(
-                                post=post,
-                                hashtag=hashtag
-                            )
-                            hashtag.posts_count += 1
-                            hashtag.save(update_fields=['posts_count'])
+                # Explicit and inline #tags, resolved in bulk
+                attach_hashtags(post, merge_hashtags(hashtags, content))
                 
                 # Update user posts count
-                user.posts_count += 1
-                user.save(update_fields=['posts_count'])
+                counters.increment(user, 'posts_count')
+                
+                enqueue_on_commit(tasks.fan_out_post, post.id)
+                index_post_on_commit(post.id)
                 
                 return CreatePost(post=post, success=True, errors=[])
         except Exception as e:
@@ -226,12 +421,22 @@ class UpdatePost(graphene.Mutation):
         try:
             user = info.context.user
             post = Post.objects.get(pk=post_id, author=user)
+            was_in_feeds = post.visibility in FEED_VISIBILITIES
             
             for field, value in kwargs.items():
                 if value is not None:
                     setattr(post, field, value)
             
             post.save()
+            
+            # Keep home timelines in sync with visibility changes
+            is_in_feeds = post.visibility in FEED_VISIBILITIES
+            if was_in_feeds and not is_in_feeds:
+                enqueue_on_commit(tasks.retract_post, post.id, user.id)
+            elif is_in_feeds and not was_in_feeds:
+                enqueue_on_commit(tasks.fan_out_post, post.id)
+            index_post_on_commit(post.id)
+            
             return UpdatePost(post=post, success=True, errors=[])
         except Post.DoesNotExist:
             return UpdatePost(post=None, success=False, errors=["Post not found or not authorized"])
@@ -256,9 +461,10 @@ class DeletePost(graphene.Mutation):
             post = Post.objects.get(pk=post_id, author=user)
             
             # Update user posts count
-            user.posts_count -= 1
-            user.save(update_fields=['posts_count'])
+            counters.decrement(user, 'posts_count')
             
+            enqueue_on_commit(tasks.retract_post, post.id, user.id)
+            unindex_post_on_commit(post.id)
             post.delete()
             return DeletePost(success=True, errors=[])
         except Post.DoesNotExist:
@@ -299,8 +505,7 @@ class CreateComment(graphene.Mutation):
                 )
                 
                 # Update post comments count
-                post.comments_count += 1
-                post.save(update_fields=['comments_count'])
+                counters.increment(post, 'comments_count')
                 
                 return CreateComment(comment=comment, success=True, errors=[])
         except Post.DoesNotExist:
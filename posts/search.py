@@ -0,0 +1,295 @@
+"""
+Full-text post search
+
+``searchPosts`` is served by a pluggable backend (``settings.POST_SEARCH``):
+
+- ``PostgresSearchBackend``: a ``search_vector`` tsvector column on ``Post``
+  (content weighted A, hashtag names weighted B) behind a GIN index, queried
+  with ``websearch_to_tsquery`` and ranked with ``ts_rank``.
+- ``InMemorySearchBackend``: a process-local inverted index ranked with BM25,
+  built lazily from the database, for SQLite/dev.
+
+When no backend is configured it is picked from the database vendor. Only
+public posts are searchable. The index is updated incrementally after the
+transaction that creates, updates or deletes a post commits
+(``index_post_on_commit`` / ``unindex_post_on_commit``), and can be rebuilt
+with ``manage.py rebuild_search_index``.
+"""
+
+import math
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.module_loading import import_string
+
+DEFAULTS = {
+    'BACKEND': None,
+    # Text search configuration of the tsvector (Postgres backend)
+    'CONFIG': 'english',
+}
+
+SEARCHABLE_VISIBILITY = 'public'
+
+
+def get_search_settings():
+    return {**DEFAULTS, **getattr(settings, 'POST_SEARCH', {})}
+
+
+class BaseSearchBackend:
+    """
+    Interface of a post search index.
+    """
+
+    def __init__(self, config='english', **options):
+        self.config = config
+
+    def index(self, post_ids):
+        """(Re)index the given posts, dropping those that no longer exist or are not public."""
+        raise NotImplementedError
+
+    def remove(self, post_ids):
+        raise NotImplementedError
+
+    def search(self, query, offset=0, limit=20, hashtag=None, author_id=None):
+        """Ids of the matching public posts, best match first."""
+        raise NotImplementedError
+
+    def filter_queryset(self, queryset, query):
+        """Restrict a Post queryset to matches (unranked, e.g. for the admin)."""
+        raise NotImplementedError
+
+    def rebuild(self):
+        raise NotImplementedError
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    Search vector stored on ``posts.search_vector`` with a GIN index.
+    """
+
+    def _vector(self):
+        from django.contrib.postgres.aggregates import StringAgg
+        from django.contrib.postgres.search import SearchVector
+        from django.db.models import OuterRef, Subquery, Value
+        from django.db.models.functions import Coalesce
+
+        from .models import PostHashtag
+
+        hashtag_names = (
+            PostHashtag.objects.filter(post=OuterRef('pk'))
+            .order_by()
+            .values('post')
+            .annotate(names=StringAgg('hashtag__name', delimiter=' '))
+            .values('names')
+        )
+        return (
+            SearchVector('content', weight='A', config=self.config) +
+            SearchVector(Coalesce(Subquery(hashtag_names), Value('')), weight='B', config=self.config)
+        )
+
+    def index(self, post_ids):
+        from .models import Post
+
+        Post.objects.filter(id__in=list(post_ids)).update(search_vector=self._vector())
+
+    def remove(self, post_ids):
+        # Deleted rows take their vector with them
+        pass
+
+    def _matches(self, queryset, query):
+        from django.contrib.postgres.search import SearchQuery
+
+        search_query = SearchQuery(query, search_type='websearch', config=self.config)
+        return queryset.filter(search_vector=search_query), search_query
+
+    def search(self, query, offset=0, limit=20, hashtag=None, author_id=None):
+        from django.contrib.postgres.search import SearchRank
+        from django.db.models import F
+
+        from .models import Post
+
+        posts = Post.objects.filter(visibility=SEARCHABLE_VISIBILITY)
+        if hashtag:
+            posts = posts.filter(posthashtag__hashtag__name=hashtag.lstrip('#').lower())
+        if author_id:
+            posts = posts.filter(author_id=author_id)
+        posts, search_query = self._matches(posts, query)
+        posts = posts.annotate(
+            rank=SearchRank(F('search_vector'), search_query)
+        ).order_by('-rank', '-id')
+        return list(posts.values_list('id', flat=True)[offset:offset + limit])
+
+    def filter_queryset(self, queryset, query):
+        return self._matches(queryset, query)[0]
+
+    def rebuild(self):
+        from .models import Post
+
+        return Post.objects.update(search_vector=self._vector())
+
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return [token.lower() for token in TOKEN_PATTERN.findall(text or '')]
+
+
+class InMemorySearchBackend(BaseSearchBackend):
+    """
+    Process-local inverted index (term -> {post_id: term frequency}) ranked
+    with BM25. Hashtag names are indexed as terms of the post.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self._lock = threading.RLock()
+        self._built = False
+        self._postings = defaultdict(dict)
+        self._documents = {}
+
+    def _ensure_built(self):
+        if not self._built:
+            self.rebuild()
+
+    def _load(self, posts):
+        """``{post_id: (author_id, hashtags, terms)}`` for public posts."""
+        from .models import PostHashtag
+
+        posts = list(posts.filter(visibility=SEARCHABLE_VISIBILITY).values_list('id', 'author_id', 'content'))
+        hashtags = defaultdict(set)
+        links = PostHashtag.objects.filter(post_id__in=[post_id for post_id, _, _ in posts])
+        for post_id, name in links.values_list('post_id', 'hashtag__name'):
+            hashtags[post_id].add(name)
+        return {
+            post_id: (author_id, hashtags[post_id], tokenize(content) + sorted(hashtags[post_id]))
+            for post_id, author_id, content in posts
+        }
+
+    def _add(self, post_id, document):
+        self._remove(post_id)
+        author_id, hashtags, terms = document
+        frequencies = defaultdict(int)
+        for term in terms:
+            frequencies[term] += 1
+        for term, frequency in frequencies.items():
+            self._postings[term][post_id] = frequency
+        self._documents[post_id] = (author_id, hashtags, frequencies, len(terms))
+
+    def _remove(self, post_id):
+        document = self._documents.pop(post_id, None)
+        if document is None:
+            return
+        for term in document[2]:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(post_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def index(self, post_ids):
+        from .models import Post
+
+        post_ids = set(post_ids)
+        with self._lock:
+            self._ensure_built()
+            documents = self._load(Post.objects.filter(id__in=post_ids))
+            for post_id in post_ids:
+                if post_id in documents:
+                    self._add(post_id, documents[post_id])
+                else:
+                    self._remove(post_id)
+
+    def remove(self, post_ids):
+        with self._lock:
+            for post_id in post_ids:
+                self._remove(post_id)
+
+    def _ranked(self, query, hashtag=None, author_id=None):
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        with self._lock:
+            self._ensure_built()
+            postings = [self._postings.get(term, {}) for term in terms]
+            if not all(postings):
+                return []
+            # Every term must match; start from the rarest one
+            candidates = set(min(postings, key=len))
+            for posting in postings:
+                candidates &= posting.keys()
+            total = len(self._documents)
+            average_length = sum(document[3] for document in self._documents.values()) / total
+            hashtag = hashtag.lstrip('#').lower() if hashtag else None
+            scores = []
+            for post_id in candidates:
+                document_author, document_hashtags, _, length = self._documents[post_id]
+                if author_id and str(document_author) != str(author_id):
+                    continue
+                if hashtag and hashtag not in document_hashtags:
+                    continue
+                score = 0.0
+                for posting in postings:
+                    frequency = posting[post_id]
+                    idf = math.log(1 + (total - len(posting) + 0.5) / (len(posting) + 0.5))
+                    score += idf * frequency * (self.K1 + 1) / (
+                        frequency + self.K1 * (1 - self.B + self.B * length / average_length)
+                    )
+                scores.append((score, post_id))
+        scores.sort(reverse=True)
+        return [post_id for _, post_id in scores]
+
+    def search(self, query, offset=0, limit=20, hashtag=None, author_id=None):
+        return self._ranked(query, hashtag, author_id)[offset:offset + limit]
+
+    def filter_queryset(self, queryset, query):
+        return queryset.filter(id__in=self._ranked(query))
+
+    def rebuild(self):
+        from .models import Post
+
+        with self._lock:
+            self._postings = defaultdict(dict)
+            self._documents = {}
+            for post_id, document in self._load(Post.objects.all()).items():
+                self._add(post_id, document)
+            self._built = True
+            return len(self._documents)
+
+
+_backend = None
+
+
+def get_search_backend():
+    """Return the configured search backend (one instance per process)."""
+    global _backend
+    if _backend is None:
+        config = get_search_settings()
+        backend_path = config['BACKEND']
+        if backend_path is None:
+            backend_path = (
+                'posts.search.PostgresSearchBackend' if connection.vendor == 'postgresql'
+                else 'posts.search.InMemorySearchBackend'
+            )
+        _backend = import_string(backend_path)(config=config['CONFIG'])
+    return _backend
+
+
+def search_posts(query, offset=0, limit=20, hashtag=None, author_id=None):
+    return get_search_backend().search(
+        query, offset=offset, limit=limit, hashtag=hashtag, author_id=author_id
+    )
+
+
+def index_post_on_commit(post_id):
+    transaction.on_commit(lambda: get_search_backend().index([post_id]))
+
+
+def unindex_post_on_commit(post_id):
+    transaction.on_commit(lambda: get_search_backend().remove([post_id]))
@@ -5,11 +5,11 @@ Background tasks for content processing, analytics, and maintenance
 
 from celery import shared_task
 from django.utils import timezone
-from django.db.models import Count, F
+from django.db.models import F
 from datetime import timedelta
 import logging
 
-from .models import Post, Hashtag, Comment
+from .models import Post, Comment
 from users.models import User
 
 logger = logging.getLogger(__name__)
@@ -44,26 +44,15 @@ def process_media_upload(post_id):
 @shared_task
 def update_trending_hashtags():
     """Update trending hashtags based on recent activity"""
+    from .trending import prune_buckets, refresh_trending
     try:
         logger.info("📈 Updating trending hashtags")
         
-        # Get hashtags from posts in the last 7 days
-        seven_days_ago = timezone.now() - timedelta(days=7)
-        
-        trending_hashtags = Hashtag.objects.filter(
-            posts__created_at__gte=seven_days_ago
-        ).annotate(
-            recent_posts_count=Count('posts')
-        ).order_by('-recent_posts_count')[:10]
-        
-        # Update hashtag trending status
-        Hashtag.objects.all().update(is_trending=False)
-        
-        for hashtag in trending_hashtags:
-            hashtag.is_trending = True
-            hashtag.save(update_fields=['is_trending'])
+        # Decayed sum over the hourly buckets of the sliding window
+        ranking = refresh_trending()
+        prune_buckets()
         
-        trending_count = trending_hashtags.count()
+        trending_count = len(ranking)
         logger.info(f"✅ Updated {trending_count} trending hashtags")
         return f"Updated {trending_count} trending hashtags"
         
@@ -136,31 +125,12 @@ def generate_content_analytics():
 @shared_task
 def update_post_engagement_scores():
     """Update engagement scores for posts to improve feed ranking"""
+    from .ranking import recompute_engagement_scores
     try:
         logger.info("🎯 Updating post engagement scores")
         
-        # Calculate engagement score based on likes, comments, shares, and views
-        posts = Post.objects.all()
-        updated_count = 0
-        
-        for post in posts:
-            # Simple engagement score calculation
-            engagement_score = (
-                post.likes_count * 3 +
-                post.comments_count * 5 +
-                post.shares_count * 7 +
-                post.views_count * 1
-            )
-            
-            # Apply time decay (newer posts get boost)
-            days_old = (timezone.now() - post.created_at).days
-            time_factor = max(0.1, 1 - (days_old * 0.1))
-            engagement_score *= time_factor
-            
-            # Update the post (you'd need to add engagement_score field to model)
-            # post.engagement_score = engagement_score
-            # post.save(update_fields=['engagement_score'])
-            updated_count += 1
+        # Only posts still decaying or whose counters changed since the last run
+        updated_count = recompute_engagement_scores()
         
         logger.info(f"✅ Updated engagement scores for {updated_count} posts")
         return f"Updated engagement scores for {updated_count} posts"
@@ -205,3 +175,93 @@ def send_content_digest_email():
     except Exception as e:
         logger.error(f"❌ Content digest error: {e}")
         return f"Error: {e}"
+
+@shared_task(bind=True, max_retries=3)
+def fan_out_post(self, post_id):
+    """Push a new post into the home timelines of its author and followers"""
+    from . import timelines
+    try:
+        post = Post.objects.get(id=post_id)
+        delivered = timelines.fan_out(post)
+        logger.info(f"📬 Post {post_id} fanned out to {delivered} timelines")
+        return f"Post {post_id} fanned out to {delivered} timelines"
+    except Post.DoesNotExist:
+        logger.warning(f"Post {post_id} deleted before fan-out")
+        return f"Post {post_id} not found"
+    except Exception as e:
+        logger.error(f"❌ Fan-out error for post {post_id}: {e}")
+        raise self.retry(exc=e)
+
+@shared_task(bind=True, max_retries=3)
+def retract_post(self, post_id, author_id):
+    """Remove a deleted or hidden post from its author's and followers' timelines"""
+    from . import timelines
+    try:
+        retracted = timelines.retract(post_id, author_id)
+        logger.info(f"🗑️ Post {post_id} retracted from {retracted} timelines")
+        return f"Post {post_id} retracted from {retracted} timelines"
+    except Exception as e:
+        logger.error(f"❌ Retract error for post {post_id}: {e}")
+        raise self.retry(exc=e)
+
+@shared_task
+def merge_author_into_timeline(user_id, author_id):
+    """Backfill a newly followed author's recent posts into a timeline"""
+    from . import timelines
+    try:
+        merged = timelines.merge_author(user_id, author_id)
+        return f"Merged {merged} posts of user {author_id} into timeline {user_id}"
+    except Exception as e:
+        logger.error(f"❌ Timeline merge error: {e}")
+        return f"Error: {e}"
+
+@shared_task
+def purge_author_from_timeline(user_id, author_id):
+    """Drop an unfollowed author's posts from a timeline"""
+    from . import timelines
+    try:
+        purged = timelines.purge_author(user_id, author_id)
+        return f"Purged {purged} posts of user {author_id} from timeline {user_id}"
+    except Exception as e:
+        logger.error(f"❌ Timeline purge error: {e}")
+        return f"Error: {e}"
+
+@shared_task
+def send_deferred_tasks(batch_size=500):
+    """Send the tasks that could not be enqueued, oldest first"""
+    from celery import current_app
+    from django.db import transaction
+    from .models import DeferredTask
+    
+    sent = 0
+    with transaction.atomic():
+        deferred = DeferredTask.objects.select_for_update(skip_locked=True).order_by('id')[:batch_size]
+        for pending in deferred:
+            try:
+                current_app.send_task(pending.task, args=pending.args, kwargs=pending.kwargs)
+            except Exception as e:
+                # Broker still unreachable: keep the rest, in order
+                logger.error(f"❌ Could not send deferred {pending.task}: {e}")
+                break
+            pending.delete()
+            sent += 1
+    if sent:
+        logger.info(f"📤 Sent {sent} deferred tasks")
+    return f"Sent {sent} deferred tasks"
+
+@shared_task
+def flush_view_counts():
+    """
+    Write buffered post views to the database in batched updates.
+
+    Only meaningful with ``RedisViewBuffer``: a ``LocalViewBuffer`` lives in
+    each web process and flushes itself, while this task would only flush the
+    worker's own, empty, buffer.
+    """
+    from .view_counter import get_view_buffer
+    try:
+        flushed = get_view_buffer().flush()
+        return f"Flushed views of {flushed} posts"
+    except Exception as e:
+        logger.error(f"❌ View count flush error: {e}")
+        return f"Error: {e}"
@@ -1,3 +1,840 @@
-from django.test import TestCase
+import base64
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from graphql import GraphQLError
+
+from social_media_backend import object_cache
+from social_media_backend.graphql_testing import QueryBudgetMixin, execute_operation
+from social_media_backend.pagination import (
+    connection_from_queryset, decode_cursor, encode_cursor, encode_timestamp_cursor,
+)
+from users.models import Follow, User
+
+from . import hashtag_autocomplete, ranking, search, tasks, timelines, trending, view_counter
+from .hashtags import attach_hashtags, extract_hashtags, merge_hashtags
+from .models import Comment, Hashtag, HashtagBucket, Post, PostHashtag, TimelineEntry
+from .schema import PostConnection
+from .view_counter import LocalViewBuffer
+
+
+def raw_cursor(value):
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+class KeysetCursorTests(TestCase):
+    def test_round_trip(self):
+        created_at = datetime(2024, 5, 17, 13, 45, 12, 123456, tzinfo=dt_timezone.utc)
+        self.assertEqual(decode_cursor(encode_cursor(created_at, 42)), (created_at, 42))
+
+    def test_round_trip_before_epoch(self):
+        created_at = datetime(1969, 12, 31, 23, 59, 59, 500000, tzinfo=dt_timezone.utc)
+        self.assertEqual(decode_cursor(encode_cursor(created_at, 7)), (created_at, 7))
+
+    def test_timestamp_cursor_matches_datetime_cursor(self):
+        created_at = datetime(2024, 5, 17, 13, 45, 12, 123456, tzinfo=dt_timezone.utc)
+        self.assertEqual(
+            encode_timestamp_cursor(created_at.timestamp(), 42),
+            encode_cursor(created_at, 42),
+        )
+
+    def test_invalid_cursors_are_rejected(self):
+        invalid = [
+            '',
+            'not base64!',
+            raw_cursor('1715953512123456'),
+            raw_cursor('1715953512123456:42:1'),
+            raw_cursor('yesterday:42'),
+            raw_cursor('1715953512123456:forty-two'),
+            raw_cursor(f'{10 ** 30}:42'),
+            base64.urlsafe_b64encode(b'\xff\xfe:1').decode(),
+        ]
+        for cursor in invalid:
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(GraphQLError) as context:
+                    decode_cursor(cursor)
+                self.assertEqual(context.exception.extensions['code'], 'INVALID_CURSOR')
+
+    def test_tampered_cursor_is_rejected(self):
+        cursor = encode_cursor(datetime(2024, 5, 17, tzinfo=dt_timezone.utc), 42)
+        for tampered in (cursor[:-4] + '!!!!', cursor[:-1], cursor + '.'):
+            with self.subTest(cursor=tampered):
+                with self.assertRaises(GraphQLError):
+                    decode_cursor(tampered)
+
+
+class KeysetPagingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='secret'
+        )
+        posts = Post.objects.bulk_create(
+            [Post(author=cls.author, content=f'post {i}') for i in range(7)]
+        )
+        # Three posts share each timestamp, so only the id breaks the ties
+        base = datetime(2024, 5, 17, 12, 0, tzinfo=dt_timezone.utc)
+        for i, post in enumerate(posts):
+            post.created_at = base + timedelta(minutes=i // 3)
+        Post.objects.bulk_update(posts, ['created_at'])
+        cls.expected = [
+            post.pk for post in sorted(posts, key=lambda post: (post.created_at, post.pk), reverse=True)
+        ]
+
+    def page(self, first, after=None, descending=True):
+        return connection_from_queryset(
+            PostConnection, Post.objects.all(), first, after, descending=descending
+        )
+
+    def walk(self, first, descending=True):
+        seen, after = [], None
+        while True:
+            connection = self.page(first, after, descending)
+            seen.extend(edge.node.pk for edge in connection.edges)
+            if not connection.page_info.has_next_page:
+                return seen
+            after = connection.page_info.end_cursor
+
+    def test_pages_through_ties_without_duplicates_or_gaps(self):
+        for first in (1, 2, 3, 4):
+            with self.subTest(first=first):
+                self.assertEqual(self.walk(first), self.expected)
+
+    def test_ascending_order(self):
+        self.assertEqual(self.walk(2, descending=False), self.expected[::-1])
+
+    def test_new_rows_do_not_shift_later_pages(self):
+        first_page = self.page(3)
+        Post.objects.create(author=self.author, content='newest')
+        second_page = self.page(3, first_page.page_info.end_cursor)
+        self.assertEqual([edge.node.pk for edge in second_page.edges], self.expected[3:6])
+
+    def test_page_info(self):
+        first_page = self.page(5)
+        self.assertTrue(first_page.page_info.has_next_page)
+        self.assertFalse(first_page.page_info.has_previous_page)
+        last_page = self.page(5, first_page.page_info.end_cursor)
+        self.assertFalse(last_page.page_info.has_next_page)
+        self.assertTrue(last_page.page_info.has_previous_page)
+        self.assertEqual(len(last_page.edges), 2)
+
+
+# Celebrities have at least 3 followers in these tests
+TEST_TIMELINES = {'CELEBRITY_FOLLOWER_THRESHOLD': 3}
+
+
+class TimelineTestMixin(QueryBudgetMixin):
+    backend_class = None
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = cls.create_user('reader')
+        cls.friend = cls.create_user('friend')
+        cls.celebrity = cls.create_user('celebrity')
+        cls.stranger = cls.create_user('stranger')
+        for author in (cls.friend, cls.celebrity):
+            Follow.objects.create(follower=cls.reader, following=author)
+        User.objects.filter(pk=cls.celebrity.pk).update(followers_count=5)
+        cls.celebrity.refresh_from_db()
+
+        base = datetime(2024, 5, 17, 12, 0, tzinfo=dt_timezone.utc)
+        authors = [cls.friend, cls.celebrity] * 4 + [cls.reader, cls.stranger]
+        posts = Post.objects.bulk_create(
+            [Post(author=author, content=f'post {i}') for i, author in enumerate(authors)]
+        )
+        for i, post in enumerate(posts):
+            # The last four posts (one per author) share a timestamp
+            post.created_at = base + timedelta(minutes=min(i, 6))
+        Post.objects.bulk_update(posts, ['created_at'])
+        cls.posts = posts
+        cls.hidden = Post.objects.create(author=cls.friend, content='private', visibility='private')
+
+    @staticmethod
+    def create_user(username):
+        return User.objects.create_user(
+            username=username, email=f'{username}@example.com', password='secret'
+        )
+
+    def setUp(self):
+        self.backend = self.backend_class(max_length=50)
+        patcher = mock.patch.object(timelines, '_backend', self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Materialized but empty: reads only see what fan_out pushes
+        for user in (self.reader, self.friend, self.celebrity, self.stranger):
+            self.backend.replace(user.pk, [])
+        for post in self.posts:
+            timelines.fan_out(post)
+
+    def expected_feed(self):
+        posts = [post for post in self.posts if post.author_id != self.stranger.pk]
+        posts.sort(key=lambda post: (post.created_at, post.pk), reverse=True)
+        return [post.pk for post in posts]
+
+    def test_merges_pushed_and_celebrity_entries(self):
+        self.assertEqual(timelines.read_feed(self.reader, limit=50), self.expected_feed())
+
+    def test_celebrity_posts_are_not_pushed(self):
+        pushed = self.backend.read(self.reader.pk, limit=50)
+        self.assertTrue(pushed)
+        self.assertFalse(
+            Post.objects.filter(pk__in=pushed, author=self.celebrity).exists()
+        )
+
+    def test_private_posts_are_not_fanned_out(self):
+        self.assertEqual(timelines.fan_out(self.hidden), 0)
+        self.assertNotIn(self.hidden.pk, timelines.read_feed(self.reader, limit=50))
+
+    def test_feed_query_merges_celebrity_posts(self):
+        result = self.assertQueryBudget(
+            '{ feed(first: 50) { id author { username } } }', 5, user=self.reader
+        )
+        self.assertEqual([int(post['id']) for post in result.data['feed']], self.expected_feed())
+
+    def test_followed_celebrity_is_pulled_without_backfill(self):
+        Follow.objects.create(follower=self.stranger, following=self.celebrity)
+        self.assertEqual(timelines.merge_author(self.stranger.pk, self.celebrity.pk), 0)
+        authors = {self.stranger.pk, self.celebrity.pk}
+        self.assertEqual(
+            timelines.read_feed(self.stranger, limit=50),
+            [post.pk for post in sorted(
+                (post for post in self.posts if post.author_id in authors),
+                key=lambda post: (post.created_at, post.pk), reverse=True,
+            )],
+        )
+
+    def test_author_over_the_threshold_is_no_longer_pushed(self):
+        User.objects.filter(pk=self.friend.pk).update(followers_count=5)
+        self.friend.refresh_from_db()
+        post = Post.objects.create(author=self.friend, content='famous now')
+        self.assertEqual(timelines.fan_out(post), 1)
+        self.assertNotIn(post.pk, self.backend.read(self.reader.pk, limit=50))
+        self.assertEqual(timelines.read_feed(self.reader, limit=1), [post.pk])
+
+    def test_post_pushed_and_pulled_is_read_once(self):
+        # Pushed before its author crossed the celebrity threshold
+        post = self.posts[1]
+        self.backend.add([self.reader.pk], [(post.pk, post.created_at.timestamp())])
+        feed = timelines.read_feed(self.reader, limit=50)
+        self.assertEqual(feed.count(post.pk), 1)
+        self.assertEqual(feed, self.expected_feed())
+
+    def test_offset_and_limit(self):
+        expected = self.expected_feed()
+        self.assertEqual(timelines.read_feed(self.reader, offset=2, limit=3), expected[2:5])
+
+    def test_before_cursor_pages_through_ties(self):
+        for size in (1, 2, 3):
+            with self.subTest(size=size):
+                seen, before = [], None
+                while True:
+                    entries = timelines.read_feed_entries(self.reader, limit=size, before=before)
+                    seen.extend(post_id for post_id, _ in entries)
+                    if len(entries) < size:
+                        break
+                    post_id, timestamp = entries[-1]
+                    before = (timestamp, post_id)
+                self.assertEqual(seen, self.expected_feed())
+
+    def test_retracted_post_leaves_the_timelines(self):
+        post = self.posts[0]
+        Post.objects.filter(pk=post.pk).update(visibility='private')
+        timelines.retract(post.pk, post.author_id)
+        self.assertNotIn(post.pk, timelines.read_feed(self.reader, limit=50))
+        self.assertNotIn(post.pk, self.backend.read(self.friend.pk, limit=50))
+
+    def test_empty_timeline_is_not_rebuilt(self):
+        self.backend.replace(self.reader.pk, [])
+        celebrity_posts = set(
+            Post.objects.filter(author=self.celebrity).values_list('pk', flat=True)
+        )
+        self.assertEqual(
+            timelines.read_feed(self.reader, limit=50),
+            [pk for pk in self.expected_feed() if pk in celebrity_posts],
+        )
+
+    def test_cold_timeline_is_rebuilt(self):
+        newcomer = self.create_user('newcomer')
+        Follow.objects.create(follower=newcomer, following=self.friend)
+        self.assertFalse(self.backend.exists(newcomer.pk))
+        friend_posts = {post.pk for post in self.posts if post.author_id == self.friend.pk}
+        self.assertEqual(
+            timelines.read_feed(newcomer, limit=50),
+            [pk for pk in self.expected_feed() if pk in friend_posts],
+        )
+        self.assertTrue(self.backend.exists(newcomer.pk))
+
+    def test_timelines_are_trimmed(self):
+        self.backend.max_length = 3
+        newcomer = self.create_user('newcomer')
+        entries = [(post.pk, post.created_at.timestamp()) for post in self.posts]
+        self.backend.add([newcomer.pk], entries)
+        newest = sorted(entries, key=lambda entry: (entry[1], entry[0]), reverse=True)[:3]
+        self.assertEqual(self.backend.read_entries(newcomer.pk, limit=50), newest)
+
+
+@override_settings(TIMELINES=TEST_TIMELINES)
+class InMemoryTimelineTests(TimelineTestMixin, TestCase):
+    backend_class = timelines.InMemoryTimelineBackend
+
+
+@override_settings(TIMELINES=TEST_TIMELINES)
+class DatabaseTimelineTests(TimelineTestMixin, TestCase):
+    backend_class = timelines.DatabaseTimelineBackend
+
+    def test_trimmed_rows_are_deleted(self):
+        self.backend.max_length = 2
+        timelines.fan_out(self.posts[0])
+        self.assertEqual(TimelineEntry.objects.filter(user=self.reader).count(), 2)
+
+
+def clear_caches():
+    """Empty the response and object caches, so budgets count cold reads."""
+    caches['default'].clear()
+    for cache in object_cache._object_caches.values():
+        cache.local.clear()
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(
+            username='reader', email='reader@example.com', password='secret'
+        )
+        cls.authors = [
+            User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@example.com', password='secret'
+            )
+            for i in range(4)
+        ]
+        for author in cls.authors:
+            Follow.objects.create(follower=cls.reader, following=author)
+            for i in range(3):
+                post = Post.objects.create(author=author, content=f'post {i}')
+                for commenter in cls.authors[:2]:
+                    Comment.objects.create(post=post, author=commenter, content='nice')
+        cls.post = Post.objects.first()
+
+    def setUp(self):
+        clear_caches()
+        for patcher in (
+            mock.patch.object(timelines, '_backend', timelines.DatabaseTimelineBackend()),
+            mock.patch.object(view_counter, '_buffer', LocalViewBuffer(flush_interval=0)),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        timelines.rebuild_timeline(self.reader)
+
+    def test_feed(self):
+        result = self.assertQueryBudget(
+            '{ feed(first: 10) { id content likesCount author { username } } }', 4, user=self.reader
+        )
+        self.assertEqual(len(result.data['feed']), 10)
+
+    def test_budget_does_not_grow_with_the_page(self):
+        for first in (2, 12):
+            with self.subTest(first=first):
+                clear_caches()
+                result = self.assertQueryBudget(
+                    """query($first: Int) { feed(first: $first) {
+                        id author { username } comments { author { username } }
+                    } }""",
+                    5, user=self.reader, variables={'first': first}
+                )
+                self.assertEqual(len(result.data['feed']), first)
+
+    def test_feed_connection(self):
+        result = self.assertQueryBudget(
+            """{ feedConnection(first: 10) {
+                edges { cursor node { id author { username } } }
+                pageInfo { hasNextPage endCursor }
+            } }""",
+            4, user=self.reader
+        )
+        self.assertTrue(result.data['feedConnection']['pageInfo']['hasNextPage'])
+
+    def test_all_posts(self):
+        result = self.assertQueryBudget(
+            '{ allPosts(first: 10) { id content commentsCount author { username avatarUrl } } }', 1
+        )
+        self.assertEqual(len(result.data['allPosts']), 10)
+
+    def test_nested_selection_is_joined_and_prefetched(self):
+        result = self.assertQueryBudget(
+            """{ allPosts(first: 12) {
+                id author { username } comments { content author { username } }
+            } }""",
+            2
+        )
+        self.assertEqual(
+            [len(post['comments']) for post in result.data['allPosts']], [2] * 12
+        )
+
+    def test_fragments_are_planned(self):
+        self.assertQueryBudget(
+            """{ allPosts(first: 10) { ...postFields } }
+            fragment postFields on PostType { id ... on PostType { author { username } } }""",
+            1
+        )
+
+    def planned_sql(self, query):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertQueryBudget(query, 1)
+        return queries[0]['sql']
+
+    def test_only_selected_columns_are_read(self):
+        sql = self.planned_sql('{ allPosts(first: 3) { id author { username } } }')
+        self.assertIn('"users"."username"', sql)
+        self.assertNotIn('"posts"."content"', sql)
+        self.assertNotIn('"users"."password"', sql)
+
+    def test_custom_fields_read_their_hinted_columns(self):
+        sql = self.planned_sql('{ allPosts(first: 3) { id hasMedia } }')
+        self.assertIn('"posts"."image"', sql)
+        self.assertIn('"posts"."video"', sql)
+        self.assertNotIn('"posts"."content"', sql)
+
+    def test_all_posts_connection(self):
+        result = self.assertQueryBudget(
+            """{ allPostsConnection(first: 10) {
+                edges { cursor node { id author { username } } }
+                pageInfo { hasNextPage endCursor }
+            } }""",
+            1
+        )
+        self.assertEqual(len(result.data['allPostsConnection']['edges']), 10)
+
+    def test_user_posts_connection(self):
+        self.assertQueryBudget(
+            """query($userId: ID!) { userPostsConnection(userId: $userId, first: 10) {
+                edges { node { id author { username } } }
+            } }""",
+            1, variables={'userId': self.authors[0].pk}
+        )
+
+    def test_post(self):
+        result = self.assertQueryBudget(
+            'query($id: ID!) { post(id: $id) { id content author { username } } }',
+            2, variables={'id': self.post.pk}
+        )
+        self.assertEqual(result.data['post']['author']['username'], self.post.author.username)
+
+    def test_post_comments_connection(self):
+        result = self.assertQueryBudget(
+            """query($id: ID!) { postCommentsConnection(postId: $id, first: 10) {
+                edges { node { id author { username } post { id } } }
+            } }""",
+            1, variables={'id': self.post.pk}
+        )
+        self.assertEqual(len(result.data['postCommentsConnection']['edges']), 2)
+
+
+class ViewBufferTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='secret'
+        )
+        cls.post = Post.objects.create(author=cls.author, content='hello')
+        cls.other_post = Post.objects.create(author=cls.author, content='again')
+
+    def views(self):
+        return dict(Post.objects.values_list('id', 'views_count'))
+
+    def test_flush_adds_buffered_views(self):
+        buffer = LocalViewBuffer(flush_interval=0)
+        for viewer in ('a', 'b', 'a'):
+            buffer.record(self.post.pk, viewer)
+        buffer.record(self.other_post.pk, 'a')
+        self.assertEqual(self.views(), {self.post.pk: 0, self.other_post.pk: 0})
+        with self.assertNumQueries(1):
+            self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(self.views(), {self.post.pk: 3, self.other_post.pk: 1})
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_unique_viewers_between_flushes(self):
+        buffer = LocalViewBuffer(unique_viewers=True, flush_interval=0)
+        for viewer in ('a', 'b', 'a'):
+            buffer.record(self.post.pk, viewer)
+        buffer.flush()
+        buffer.record(self.post.pk, 'a')
+        buffer.flush()
+        self.assertEqual(self.views()[self.post.pk], 3)
+
+    def test_full_buffer_flushes_early(self):
+        buffer = LocalViewBuffer(unique_viewers=True, flush_interval=0, max_pending=2)
+        buffer.record(self.post.pk, 'a')
+        self.assertEqual(self.views()[self.post.pk], 0)
+        buffer.record(self.post.pk, 'b')
+        self.assertEqual(self.views()[self.post.pk], 2)
+
+    def test_post_query_counts_a_view(self):
+        buffer = LocalViewBuffer(flush_interval=0)
+        with mock.patch.object(view_counter, '_buffer', buffer):
+            for _ in range(2):
+                self.assertQueryBudget(
+                    'query($id: ID!) { post(id: $id) { id } }', 2, variables={'id': self.post.pk}
+                )
+        # The reads themselves never write
+        self.assertEqual(self.views()[self.post.pk], 0)
+        buffer.flush()
+        self.assertEqual(self.views()[self.post.pk], 2)
+
+    def test_timer_thread_flushes(self):
+        buffer = LocalViewBuffer(flush_interval=0.01)
+        flushed = threading.Event()
+        with mock.patch.object(view_counter.atexit, 'register') as register, \
+                mock.patch.object(buffer, 'flush', side_effect=flushed.set):
+            buffer.record(self.post.pk)
+            self.assertTrue(flushed.wait(5))
+            register.assert_called_once_with(buffer.close)
+            buffer.close()
+        buffer._timer.join(5)
+        self.assertFalse(buffer._timer.is_alive())
+
+    def test_close_flushes_pending_views(self):
+        buffer = LocalViewBuffer(flush_interval=3600)
+        with mock.patch.object(view_counter.atexit, 'register'):
+            buffer.record(self.post.pk)
+        buffer.close()
+        self.assertEqual(self.views()[self.post.pk], 1)
+        buffer._timer.join(5)
+        self.assertFalse(buffer._timer.is_alive())
+
+
+class RankingTests(QueryBudgetMixin, TestCase):
+    now = datetime(2024, 5, 17, 12, 0, tzinfo=dt_timezone.utc)
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='secret'
+        )
+        rows = {
+            'fresh': (0, {'likes_count': 10}),
+            'week': (5, {'comments_count': 4}),
+            'old': (100, {'shares_count': 10}),
+            'quiet': (0, {}),
+        }
+        cls.posts = {}
+        for name, (age, counts) in rows.items():
+            post = Post.objects.create(author=author, content=name, **counts)
+            Post.objects.filter(pk=post.pk).update(created_at=cls.now - timedelta(days=age, hours=1))
+            cls.posts[name] = post
+
+    def scores(self):
+        return {
+            name: Post.objects.get(pk=post.pk).engagement_score for name, post in self.posts.items()
+        }
+
+    def test_python_fallback_matches_numpy(self):
+        counts = [[1, 2, 3, 4], [5, 0, 0, 100], [0, 0, 0, 0]]
+        ages = [0, 3, 40]
+        with mock.patch.object(ranking, 'np', None):
+            expected = ranking.compute_scores(counts, ages)
+        for score, fallback in zip(ranking.compute_scores(counts, ages), expected):
+            self.assertAlmostEqual(score, fallback)
+        self.assertAlmostEqual(expected[0], 3 + 10 + 21 + 4)
+        self.assertAlmostEqual(expected[1], (15 + 100) * 0.7)
+
+    def test_recompute_scores(self):
+        self.assertEqual(ranking.recompute_engagement_scores(now=self.now), 3)
+        scores = self.scores()
+        self.assertAlmostEqual(scores['fresh'], 30)
+        self.assertAlmostEqual(scores['week'], 10)
+        self.assertAlmostEqual(scores['old'], 7)
+        self.assertEqual(scores['quiet'], 0)
+        self.assertEqual(ranking.recompute_engagement_scores(now=self.now), 0)
+
+    def test_settled_posts_are_rescored_only_when_their_counters_change(self):
+        ranking.recompute_engagement_scores(now=self.now)
+        old = self.posts['old']
+        self.assertNotIn(old.pk, ranking.stale_posts(self.now).values_list('pk', flat=True))
+        Post.objects.filter(pk=old.pk).update(likes_count=1)
+        self.assertIn(old.pk, ranking.stale_posts(self.now).values_list('pk', flat=True))
+        ranking.recompute_engagement_scores(now=self.now, chunk_size=1)
+        self.assertAlmostEqual(self.scores()['old'], 7.3)
+
+    def test_ranked_ordering(self):
+        ranking.recompute_engagement_scores(now=self.now)
+        result = self.assertQueryBudget('{ allPosts(ordering: "ranked") { content } }', 1)
+        self.assertEqual(
+            [post['content'] for post in result.data['allPosts']], ['fresh', 'week', 'old', 'quiet']
+        )
+
+    def test_unknown_ordering_is_rejected(self):
+        result, _ = execute_operation('{ allPosts(ordering: "popular") { id } }')
+        self.assertEqual(result.errors[0].extensions['code'], 'VALIDATION_ERROR')
+
+
+class TrendingTests(QueryBudgetMixin, TestCase):
+    now = datetime(2024, 5, 17, 12, 30, tzinfo=dt_timezone.utc)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.steady, cls.rising, cls.stale = [
+            Hashtag.objects.create(name=name, posts_count=posts_count)
+            for name, posts_count in (('steady', 50), ('rising', 5), ('stale', 500))
+        ]
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def use(self, hashtag, hours_ago, times=1):
+        for _ in range(times):
+            trending.record_hashtag_uses([hashtag.pk], self.now - timedelta(hours=hours_ago))
+
+    def test_uses_are_counted_per_hour(self):
+        self.use(self.steady, 0, times=2)
+        trending.record_hashtag_uses([self.steady.pk, self.rising.pk], self.now)
+        self.use(self.steady, 1)
+        self.assertEqual(
+            sorted(HashtagBucket.objects.values_list('hashtag__name', 'hour', 'count')),
+            [
+                ('rising', trending.bucket_hour(self.now), 1),
+                ('steady', trending.bucket_hour(self.now - timedelta(hours=1)), 1),
+                ('steady', trending.bucket_hour(self.now), 3),
+            ],
+        )
+
+    def test_scores_decay_over_the_window(self):
+        self.use(self.steady, 48, times=10)
+        self.use(self.rising, 0, times=3)
+        # Outside the seven-day window
+        self.use(self.stale, 24 * 7, times=100)
+        ranking = trending.compute_trending(self.now)
+        self.assertEqual([hashtag_id for hashtag_id, _ in ranking], [self.rising.pk, self.steady.pk])
+        self.assertAlmostEqual(ranking[1][1], 2.5)
+
+    def test_query_reads_the_cached_ranking(self):
+        self.use(self.steady, 48, times=10)
+        self.use(self.rising, 0, times=3)
+        trending.refresh_trending(self.now)
+        result = self.assertQueryBudget('{ trendingHashtags(limit: 5) { name } }', 1)
+        self.assertEqual(
+            [hashtag['name'] for hashtag in result.data['trendingHashtags']], ['rising', 'steady']
+        )
+
+    def test_cold_ranking_falls_back_and_refreshes_once(self):
+        self.use(self.rising, 0)
+        with mock.patch.object(tasks.update_trending_hashtags, 'delay') as delay:
+            for _ in range(2):
+                self.assertEqual(
+                    [hashtag.name for hashtag in trending.trending_hashtags(2)], ['stale', 'steady']
+                )
+        delay.assert_called_once_with()
+
+    def test_buckets_outside_the_window_are_pruned(self):
+        self.use(self.stale, 24 * 7)
+        self.use(self.stale, 24 * 7 - 1)
+        self.assertEqual(trending.prune_buckets(self.now), 1)
+        self.assertEqual(HashtagBucket.objects.count(), 1)
+
+
+class HashtagExtractionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='secret'
+        )
+        Hashtag.objects.create(name='django', posts_count=4)
+
+    def test_inline_tags(self):
+        self.assertEqual(
+            extract_hashtags('Hello #World and #café, not a#b or ##b, #tag_1. #'),
+            ['World', 'café', 'tag_1'],
+        )
+        self.assertEqual(extract_hashtags(None), [])
+
+    def test_explicit_and_inline_tags_are_deduplicated(self):
+        self.assertEqual(
+            merge_hashtags(['#World', ' python ', '', 'x' * 101], 'Hi #world #Python #new'),
+            ['world', 'python', 'new'],
+        )
+
+    def create_post(self, content, hashtags):
+        result, _ = execute_operation(
+            """mutation($content: String!, $hashtags: [String]) {
+                createPost(content: $content, hashtags: $hashtags) { success post { id } }
+            }""",
+            variables={'content': content, 'hashtags': hashtags}, user=self.author,
+        )
+        self.assertIsNone(result.errors)
+        self.assertTrue(result.data['createPost']['success'])
+        return Post.objects.get(pk=result.data['createPost']['post']['id'])
+
+    def test_create_post_links_inline_tags(self):
+        post = self.create_post('Loving #Django and #GraphQL, #django again', ['django', 'orm'])
+        self.assertEqual(
+            sorted(PostHashtag.objects.filter(post=post).values_list('hashtag__name', flat=True)),
+            ['django', 'graphql', 'orm'],
+        )
+        self.assertEqual(
+            dict(Hashtag.objects.values_list('name', 'posts_count')),
+            {'django': 5, 'graphql': 1, 'orm': 1},
+        )
+
+    def test_query_count_does_not_depend_on_the_tag_count(self):
+        # Both runs then reuse one hashtag and its hourly bucket
+        attach_hashtags(Post.objects.create(author=self.author, content='warm up'), ['django'])
+        counts = []
+        for size in (2, 20):
+            post = Post.objects.create(author=self.author, content='tags')
+            names = ['django'] + [f'tag{size}_{i}' for i in range(size - 1)]
+            with CaptureQueriesContext(connection) as queries:
+                attach_hashtags(post, names)
+            counts.append(len(queries))
+            self.assertEqual(PostHashtag.objects.filter(post=post).count(), size)
+        self.assertEqual(counts[0], counts[1])
+
+
+class PostSearchTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob = [
+            User.objects.create_user(username=name, email=f'{name}@example.com', password='secret')
+            for name in ('alice', 'bob')
+        ]
+        cls.posts = {}
+        for name, author, content, tags in (
+            ('focused', cls.alice, 'Django tips: django signals', ['python']),
+            ('long', cls.bob, 'A long post that mentions django once among many other words', []),
+            ('tagged', cls.bob, 'Notes on signals', ['django']),
+            ('unrelated', cls.alice, 'Cooking pasta tonight', []),
+        ):
+            cls.posts[name] = Post.objects.create(author=author, content=content)
+            attach_hashtags(cls.posts[name], tags)
+        cls.hidden = Post.objects.create(author=cls.alice, content='django secrets', visibility='private')
+
+    def setUp(self):
+        self.backend = search.InMemorySearchBackend()
+        patcher = mock.patch.object(search, '_backend', self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def names(self, post_ids):
+        by_id = {post.pk: name for name, post in self.posts.items()}
+        return [by_id.get(post_id, post_id) for post_id in post_ids]
+
+    def test_ranking(self):
+        self.assertEqual(
+            self.names(search.search_posts('Django')), ['focused', 'tagged', 'long']
+        )
+        self.assertEqual(search.search_posts('django', offset=1, limit=1), [self.posts['tagged'].pk])
+
+    def test_every_term_must_match(self):
+        self.assertEqual(self.names(search.search_posts('django signals')), ['focused', 'tagged'])
+        self.assertEqual(search.search_posts('django pasta'), [])
+        self.assertEqual(search.search_posts('  !! '), [])
+
+    def test_filters(self):
+        self.assertEqual(self.names(search.search_posts('django', hashtag='#Django')), ['tagged'])
+        self.assertEqual(
+            self.names(search.search_posts('django', author_id=self.alice.pk)), ['focused']
+        )
+
+    def test_index_follows_post_changes(self):
+        search.search_posts('django')
+        post = self.posts['focused']
+        Post.objects.filter(pk=post.pk).update(visibility='private')
+        Post.objects.filter(pk=self.hidden.pk).update(visibility='public')
+        self.backend.index([post.pk, self.hidden.pk])
+        self.assertEqual(self.names(search.search_posts('django')), [self.hidden.pk, 'tagged', 'long'])
+        self.backend.remove([self.hidden.pk])
+        self.assertEqual(self.names(search.search_posts('django')), ['tagged', 'long'])
+
+    def test_new_posts_are_indexed_on_commit(self):
+        search.search_posts('django')
+        with self.captureOnCommitCallbacks(execute=True):
+            result, _ = execute_operation(
+                'mutation { createPost(content: "Fresh django release") { success } }',
+                user=self.bob,
+            )
+        self.assertTrue(result.data['createPost']['success'])
+        self.assertEqual(len(search.search_posts('django release')), 1)
+
+    def test_search_posts_query_pages_in_rank_order(self):
+        query = """query($after: String) { searchPosts(query: "django", first: 2, after: $after) {
+            edges { node { content author { username } } }
+            pageInfo { hasNextPage endCursor }
+        } }"""
+        self.backend.rebuild()
+        first_page = self.assertQueryBudget(query, 1).data['searchPosts']
+        self.assertTrue(first_page['pageInfo']['hasNextPage'])
+        second_page = self.assertQueryBudget(
+            query, 1, variables={'after': first_page['pageInfo']['endCursor']}
+        ).data['searchPosts']
+        self.assertFalse(second_page['pageInfo']['hasNextPage'])
+        self.assertEqual(
+            [edge['node']['content'] for edge in first_page['edges'] + second_page['edges']],
+            [self.posts[name].content for name in ('focused', 'tagged', 'long')],
+        )
+
+
+class HashtagAutocompleteTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='secret'
+        )
+        for name, posts_count in (
+            ('python', 40), ('pytest', 40), ('pygame', 3), ('pandas', 90), ('rust', 70),
+        ):
+            Hashtag.objects.create(name=name, posts_count=posts_count)
+
+    def setUp(self):
+        self.index = hashtag_autocomplete.HashtagPrefixIndex()
+        patcher = mock.patch.object(hashtag_autocomplete, '_index', self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def names(self, prefix, limit=10):
+        return [name for name, _, _ in self.index.suggest(prefix, limit)]
+
+    def test_most_used_first(self):
+        self.assertEqual(self.names('py'), ['pytest', 'python', 'pygame'])
+        self.assertEqual(self.names('p', limit=2), ['pandas', 'pytest'])
+        self.assertEqual(self.names(' #PyT'), ['pytest', 'python'])
+        self.assertEqual(self.names('java'), [])
+        self.assertEqual(self.names('#'), [])
+
+    def test_no_queries_once_built(self):
+        self.index.suggest('p')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names('pyth'), ['python'])
+            self.assertEqual(self.names('p', limit=1), ['pandas'])
+
+    def test_rebuilt_when_stale(self):
+        self.index.rebuild_interval = 0
+        self.index.suggest('p')
+        Hashtag.objects.create(name='pyramid', posts_count=500)
+        self.assertEqual(self.names('py', limit=1), ['pyramid'])
+
+    def test_new_post_tags_are_suggested_after_commit(self):
+        self.assertEqual(self.names('py'), ['pytest', 'python', 'pygame'])
+        with self.captureOnCommitCallbacks(execute=True):
+            result, _ = execute_operation(
+                'mutation { createPost(content: "#pygame #pyodide #python") { success } }',
+                user=self.author,
+            )
+        self.assertTrue(result.data['createPost']['success'])
+        # Memoized rankings of the touched prefixes are dropped
+        self.assertEqual(self.names('py'), ['python', 'pytest', 'pygame', 'pyodide'])
+        self.assertEqual(self.index.suggest('pyo'), [
+            ('pyodide', Hashtag.objects.get(name='pyodide').pk, 1)
+        ])
+
+    def test_autocomplete_hashtags_query(self):
+        self.index.rebuild()
+        result = self.assertQueryBudget(
+            '{ autocompleteHashtags(prefix: "py", limit: 2) { name postsCount } }', 0
+        )
+        self.assertEqual(
+            result.data['autocompleteHashtags'],
+            [{'name': 'pytest', 'postsCount': 40}, {'name': 'python', 'postsCount': 40}],
+        )
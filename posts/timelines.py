@@ -0,0 +1,483 @@
+"""
+Materialized home timelines (fan-out on write)
+
+``CreatePost`` pushes the new post id into the timeline of the author and of
+every follower through the ``posts.tasks.fan_out_post`` task; ``DeletePost``
+and visibility changes retract it. ``feed`` then reads a bounded, pre-sorted
+list of post ids instead of sorting every post of every followed account.
+
+The storage is pluggable through ``settings.TIMELINES['BACKEND']``:
+
+- ``RedisTimelineBackend``: one sorted set per user, trimmed to ``MAX_LENGTH``
+  and expired after ``TTL`` seconds of inactivity (rebuilt on next read).
+- ``DatabaseTimelineBackend``: rows in the ``timeline_entries`` table.
+- ``InMemoryTimelineBackend``: process-local dict, for tests.
+
+Authors with at least ``CELEBRITY_FOLLOWER_THRESHOLD`` followers are not fanned
+out (one post would mean millions of timeline writes). ``read_feed`` pulls their
+recent posts at read time and k-way merges them with the pushed timeline.
+"""
+
+import heapq
+import itertools
+import logging
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from social_media_backend.pubsub import author_channel, feed_channel, publish
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BACKEND': 'posts.timelines.DatabaseTimelineBackend',
+    'MAX_LENGTH': 800,
+    'TTL': 7 * 24 * 3600,
+    'REDIS_URL': None,
+    'FAN_OUT_BATCH_SIZE': 1000,
+    'CELEBRITY_FOLLOWER_THRESHOLD': 10000,
+}
+
+# Visibilities that reach followers' home timelines
+FEED_VISIBILITIES = ('public', 'followers')
+
+
+def get_timeline_settings():
+    return {**DEFAULTS, **getattr(settings, 'TIMELINES', {})}
+
+
+class BaseTimelineBackend:
+    """
+    Interface of a timeline store. Timelines hold ``(post_id, timestamp)``
+    entries and are always read newest first.
+    """
+
+    def __init__(self, max_length=800, **options):
+        self.max_length = max_length
+
+    def add(self, user_ids, entries):
+        """Insert ``entries`` into the timeline of every user in ``user_ids``."""
+        raise NotImplementedError
+
+    def remove(self, user_ids, post_ids):
+        """Remove ``post_ids`` from the timeline of every user in ``user_ids``."""
+        raise NotImplementedError
+
+    def read(self, user_id, offset=0, limit=20):
+        """Return up to ``limit`` post ids, newest first."""
+        return [post_id for post_id, _ in self.read_entries(user_id, offset, limit)]
+
+    def read_entries(self, user_id, offset=0, limit=20):
+        """Return up to ``limit`` ``(post_id, timestamp)`` entries, newest first."""
+        raise NotImplementedError
+
+    def exists(self, user_id):
+        """Whether the user's timeline is materialized."""
+        raise NotImplementedError
+
+    def replace(self, user_id, entries):
+        """Atomically replace the user's timeline with ``entries``."""
+        raise NotImplementedError
+
+
+class InMemoryTimelineBackend(BaseTimelineBackend):
+    """
+    Process-local timelines, for tests and single-process development.
+    """
+
+    def __init__(self, max_length=800, **options):
+        super().__init__(max_length)
+        self.timelines = {}
+
+    def _sorted(self, timeline):
+        entries = sorted(timeline.items(), key=lambda item: (item[1], item[0]), reverse=True)
+        return entries[:self.max_length]
+
+    def add(self, user_ids, entries):
+        for user_id in user_ids:
+            timeline = self.timelines.setdefault(user_id, {})
+            timeline.update(entries)
+            if len(timeline) > self.max_length:
+                self.timelines[user_id] = dict(self._sorted(timeline))
+
+    def remove(self, user_ids, post_ids):
+        for user_id in user_ids:
+            timeline = self.timelines.get(user_id)
+            if timeline:
+                for post_id in post_ids:
+                    timeline.pop(post_id, None)
+
+    def read_entries(self, user_id, offset=0, limit=20):
+        entries = self._sorted(self.timelines.get(user_id, {}))
+        return entries[offset:offset + limit]
+
+    def exists(self, user_id):
+        return user_id in self.timelines
+
+    def replace(self, user_id, entries):
+        self.timelines[user_id] = dict(entries)
+
+
+class DatabaseTimelineBackend(BaseTimelineBackend):
+    """
+    Timelines stored in the ``timeline_entries`` table, trimmed to the newest
+    ``max_length`` entries per user on write. A ``materialized_timelines`` row
+    marks a timeline as built, so an empty one is not rebuilt on every read.
+    """
+
+    def add(self, user_ids, entries):
+        from .models import TimelineEntry
+
+        user_ids = list(user_ids)
+        rows = [
+            TimelineEntry(
+                user_id=user_id,
+                post_id=post_id,
+                created_at=datetime.fromtimestamp(timestamp, tz=dt_timezone.utc),
+            )
+            for user_id in user_ids
+            for post_id, timestamp in entries
+        ]
+        TimelineEntry.objects.bulk_create(rows, ignore_conflicts=True, batch_size=1000)
+        self._trim(user_ids)
+
+    def _trim(self, user_ids):
+        """Delete the entries beyond the newest ``max_length`` of each user."""
+        from django.db.models import F, Window
+        from django.db.models.functions import RowNumber
+        from .models import TimelineEntry
+
+        overflow = list(
+            TimelineEntry.objects.filter(user_id__in=user_ids)
+            .annotate(rank=Window(
+                RowNumber(),
+                partition_by=F('user_id'),
+                order_by=(F('created_at').desc(), F('post_id').desc()),
+            ))
+            .filter(rank__gt=self.max_length)
+            .values_list('pk', flat=True)
+        )
+        if overflow:
+            TimelineEntry.objects.filter(pk__in=overflow).delete()
+
+    def remove(self, user_ids, post_ids):
+        from .models import TimelineEntry
+
+        TimelineEntry.objects.filter(user_id__in=list(user_ids), post_id__in=list(post_ids)).delete()
+
+    def read_entries(self, user_id, offset=0, limit=20):
+        from .models import TimelineEntry
+
+        end = min(offset + limit, self.max_length)
+        if offset >= end:
+            return []
+        rows = (
+            TimelineEntry.objects.filter(user_id=user_id)
+            .order_by('-created_at', '-post_id')
+            .values_list('post_id', 'created_at')[offset:end]
+        )
+        return [(post_id, created_at.timestamp()) for post_id, created_at in rows]
+
+    def exists(self, user_id):
+        from .models import MaterializedTimeline
+
+        return MaterializedTimeline.objects.filter(user_id=user_id).exists()
+
+    def replace(self, user_id, entries):
+        from django.db import transaction
+        from .models import MaterializedTimeline, TimelineEntry
+
+        with transaction.atomic():
+            TimelineEntry.objects.filter(user_id=user_id).delete()
+            self.add([user_id], entries)
+            MaterializedTimeline.objects.update_or_create(user_id=user_id)
+
+
+class RedisTimelineBackend(BaseTimelineBackend):
+    """
+    One sorted set per user (member: post id, score: creation timestamp).
+
+    Fan-out only writes to timelines that are still materialized: an expired
+    timeline would otherwise come back holding only the newest posts. It is
+    rebuilt from the database on the next read instead.
+    """
+
+    key_prefix = 'timeline:'
+
+    def __init__(self, max_length=800, redis_url=None, ttl=7 * 24 * 3600, **options):
+        super().__init__(max_length)
+        import redis
+
+        self.ttl = ttl
+        self.client = redis.Redis.from_url(redis_url or settings.REDIS_URL)
+
+    def _key(self, user_id):
+        return f'{self.key_prefix}{user_id}'
+
+    def add(self, user_ids, entries):
+        user_ids = list(user_ids)
+        mapping = {str(post_id): timestamp for post_id, timestamp in entries}
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.exists(self._key(user_id))
+        materialized = [uid for uid, found in zip(user_ids, pipe.execute()) if found]
+
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in materialized:
+            key = self._key(user_id)
+            pipe.zadd(key, mapping)
+            pipe.zremrangebyrank(key, 0, -self.max_length - 1)
+        pipe.execute()
+
+    def remove(self, user_ids, post_ids):
+        members = [str(post_id) for post_id in post_ids]
+        if not members:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.zrem(self._key(user_id), *members)
+        pipe.execute()
+
+    def read_entries(self, user_id, offset=0, limit=20):
+        key = self._key(user_id)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.zrevrange(key, offset, offset + limit - 1, withscores=True)
+        pipe.expire(key, self.ttl)
+        members, _ = pipe.execute()
+        return [(int(member), score) for member, score in members if member != b'0']
+
+    def exists(self, user_id):
+        return bool(self.client.exists(self._key(user_id)))
+
+    def replace(self, user_id, entries):
+        key = self._key(user_id)
+        # A sentinel keeps empty timelines materialized; it sorts last and
+        # is never returned because post ids are positive.
+        mapping = {'0': 0}
+        mapping.update((str(post_id), timestamp) for post_id, timestamp in entries)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(key)
+        pipe.zadd(key, mapping)
+        pipe.zremrangebyrank(key, 0, -self.max_length - 2)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+
+_backend = None
+
+
+def get_timeline_backend():
+    """Return the configured timeline backend (one instance per process)."""
+    global _backend
+    if _backend is None:
+        config = get_timeline_settings()
+        backend_class = import_string(config['BACKEND'])
+        _backend = backend_class(
+            max_length=config['MAX_LENGTH'],
+            redis_url=config['REDIS_URL'],
+            ttl=config['TTL'],
+        )
+    return _backend
+
+
+def _entry(post):
+    return (post.id, post.created_at.timestamp())
+
+
+def _follower_id_batches(author_id, batch_size):
+    from users.models import Follow
+
+    follower_ids = (
+        Follow.objects.filter(following_id=author_id)
+        .values_list('follower_id', flat=True)
+        .iterator(chunk_size=batch_size)
+    )
+    batch = []
+    for follower_id in follower_ids:
+        batch.append(follower_id)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def is_celebrity(user):
+    return user.followers_count >= get_timeline_settings()['CELEBRITY_FOLLOWER_THRESHOLD']
+
+
+def fan_out(post):
+    """
+    Push ``post`` to the timelines of its author and followers. Posts of
+    celebrity authors only reach the author's own timeline; followers pull
+    them at read time, and live feeds get them from the author's channel.
+    """
+    if post.visibility not in FEED_VISIBILITIES:
+        return 0
+    backend = get_timeline_backend()
+    entries = [_entry(post)]
+    backend.add([post.author_id], entries)
+    publish([feed_channel(post.author_id)], 'feedItemAdded', {'id': post.id})
+    delivered = 1
+    if is_celebrity(post.author):
+        publish([author_channel(post.author_id)], 'feedItemAdded', {'id': post.id})
+        return delivered
+    for batch in _follower_id_batches(post.author_id, get_timeline_settings()['FAN_OUT_BATCH_SIZE']):
+        backend.add(batch, entries)
+        # Live feeds of connected followers (see social_media_backend.subscriptions)
+        publish([feed_channel(user_id) for user_id in batch], 'feedItemAdded', {'id': post.id})
+        delivered += len(batch)
+    return delivered
+
+
+def retract(post_id, author_id):
+    """Remove a post from the timelines of its author and followers."""
+    backend = get_timeline_backend()
+    backend.remove([author_id], [post_id])
+    retracted = 1
+    for batch in _follower_id_batches(author_id, get_timeline_settings()['FAN_OUT_BATCH_SIZE']):
+        backend.remove(batch, [post_id])
+        retracted += len(batch)
+    return retracted
+
+
+def recent_feed_entries(author_ids, limit):
+    """``(post_id, timestamp)`` of the newest feed-visible posts of ``author_ids``."""
+    from .models import Post
+
+    rows = (
+        Post.objects.filter(author_id__in=author_ids, visibility__in=FEED_VISIBILITIES)
+        .order_by('-created_at')
+        .values_list('id', 'created_at')[:limit]
+    )
+    return [(post_id, created_at.timestamp()) for post_id, created_at in rows]
+
+
+def followed_author_ids(user, celebrities):
+    """Ids of the authors ``user`` follows, split on the celebrity threshold."""
+    threshold = get_timeline_settings()['CELEBRITY_FOLLOWER_THRESHOLD']
+    follows = user.following.all()
+    if celebrities:
+        follows = follows.filter(following__followers_count__gte=threshold)
+    else:
+        follows = follows.filter(following__followers_count__lt=threshold)
+    return list(follows.values_list('following_id', flat=True))
+
+
+def rebuild_timeline(user):
+    """Recompute a user's pushed timeline from the follow graph."""
+    backend = get_timeline_backend()
+    author_ids = followed_author_ids(user, celebrities=False) + [user.id]
+    entries = recent_feed_entries(author_ids, backend.max_length)
+    backend.replace(user.id, entries)
+    return len(entries)
+
+
+def merge_author(user_id, author_id):
+    """Backfill the recent posts of a newly followed (non-celebrity) author."""
+    from users.models import User
+
+    if is_celebrity(User.objects.only('followers_count').get(pk=author_id)):
+        return 0
+    backend = get_timeline_backend()
+    entries = recent_feed_entries([author_id], backend.max_length)
+    if entries:
+        backend.add([user_id], entries)
+    return len(entries)
+
+
+def purge_author(user_id, author_id):
+    """Drop an unfollowed author's posts from a timeline."""
+    from .models import Post
+
+    post_ids = list(Post.objects.filter(author_id=author_id).values_list('id', flat=True))
+    if post_ids:
+        get_timeline_backend().remove([user_id], post_ids)
+    return len(post_ids)
+
+
+def _timeline_stream(backend, user_id, chunk_size):
+    """Pushed timeline entries, newest first, read ``chunk_size`` at a time."""
+    offset = 0
+    while offset < backend.max_length:
+        entries = backend.read_entries(user_id, offset=offset, limit=chunk_size)
+        yield from entries
+        if len(entries) < chunk_size:
+            return
+        offset += chunk_size
+
+
+def _author_stream(author_id, chunk_size, before=None):
+    """
+    Feed-visible posts of one author, newest first, fetched by keyset chunks
+    over the ``(author, -created_at)`` index.
+    """
+    from django.db.models import Q
+    from .models import Post
+
+    posts = Post.objects.filter(author_id=author_id, visibility__in=FEED_VISIBILITIES)
+    chunk = posts
+    if before is not None:
+        timestamp, last_id = before
+        last_created_at = datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+        chunk = posts.filter(
+            Q(created_at__lt=last_created_at) | Q(created_at=last_created_at, id__lt=last_id)
+        )
+    while True:
+        rows = list(
+            chunk.order_by('-created_at', '-id').values_list('id', 'created_at')[:chunk_size]
+        )
+        for post_id, created_at in rows:
+            yield (post_id, created_at.timestamp())
+        if len(rows) < chunk_size:
+            return
+        last_id, last_created_at = rows[-1]
+        chunk = posts.filter(
+            Q(created_at__lt=last_created_at) | Q(created_at=last_created_at, id__lt=last_id)
+        )
+
+
+def read_feed_entries(user, limit=20, offset=0, before=None):
+    """
+    ``(post_id, timestamp)`` entries of the user's home feed, newest first:
+    the pushed timeline merged with the recent posts of followed celebrities.
+
+    Every source is a lazy, sorted stream and ``heapq.merge`` keeps one
+    pending entry per source, so memory stays bounded by ``offset + limit``
+    whatever the number of followees. ``before`` is a ``(timestamp, post_id)``
+    keyset bound: only strictly older entries are returned.
+    """
+    backend = get_timeline_backend()
+    if not backend.exists(user.id):
+        logger.info(f"Rebuilding cold timeline for user {user.id}")
+        rebuild_timeline(user)
+
+    wanted = offset + limit
+    pushed = _timeline_stream(backend, user.id, wanted)
+    if before is not None:
+        bound = (before[0], before[1])
+        pushed = itertools.dropwhile(lambda entry: (entry[1], entry[0]) >= bound, pushed)
+    streams = [pushed]
+    streams.extend(
+        _author_stream(author_id, wanted, before=before)
+        for author_id in followed_author_ids(user, celebrities=True)
+    )
+
+    entries = []
+    seen = set()
+    merged = heapq.merge(*streams, key=lambda entry: (entry[1], entry[0]), reverse=True)
+    for post_id, timestamp in merged:
+        # Posts pushed before their author crossed the threshold show up twice
+        if post_id in seen:
+            continue
+        seen.add(post_id)
+        entries.append((post_id, timestamp))
+        if len(entries) >= wanted:
+            break
+    return entries[offset:]
+
+
+def read_feed(user, offset=0, limit=20):
+    """Post ids of the user's home feed, newest first."""
+    return [post_id for post_id, _ in read_feed_entries(user, limit=limit, offset=offset)]
@@ -0,0 +1,121 @@
+"""
+Sliding-window trending hashtags
+
+Every hashtag use increments a per-hour ``HashtagBucket`` row when the post is
+created. Periodically (``posts.tasks.update_trending_hashtags``) the buckets of
+the last ``WINDOW_HOURS`` are read once, each hashtag gets an exponentially
+decayed score (a use loses half its weight every ``HALF_LIFE_HOURS``) and the
+top ``CACHED_RANKING_SIZE`` hashtags are cached as a ranked list. The
+``trendingHashtags`` query then only reads ``limit`` ids from the cache and
+fetches those rows by primary key. When the ranking is not cached it serves
+all-time usage and enqueues a single refresh.
+"""
+
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Hashtag, HashtagBucket
+
+logger = logging.getLogger(__name__)
+
+WINDOW_HOURS = 7 * 24
+HALF_LIFE_HOURS = 24
+CACHED_RANKING_SIZE = 100
+RANKING_CACHE_KEY = 'hashtags:trending'
+# Keep serving the last ranking for a while if the refresh task stops running
+RANKING_CACHE_TIMEOUT = 6 * 3600
+REFRESH_LOCK_KEY = 'hashtags:trending:refreshing'
+REFRESH_LOCK_TIMEOUT = 60
+
+
+def bucket_hour(when=None):
+    return (when or timezone.now()).replace(minute=0, second=0, microsecond=0)
+
+
+def record_hashtag_uses(hashtag_ids, when=None):
+    """Add one use of each hashtag to the bucket of the current hour."""
+    hour = bucket_hour(when)
+    pending = set(hashtag_ids)
+    while pending:
+        existing = set(
+            HashtagBucket.objects.filter(hashtag_id__in=pending, hour=hour)
+            .values_list('hashtag_id', flat=True)
+        )
+        if existing:
+            HashtagBucket.objects.filter(hashtag_id__in=existing, hour=hour).update(
+                count=F('count') + 1
+            )
+            pending -= existing
+        if not pending:
+            break
+        try:
+            with transaction.atomic():
+                HashtagBucket.objects.bulk_create([
+                    HashtagBucket(hashtag_id=hashtag_id, hour=hour, count=1)
+                    for hashtag_id in pending
+                ])
+            break
+        except IntegrityError:
+            # A concurrent post created some of these buckets, increment them instead
+            continue
+
+
+def compute_trending(now=None):
+    """``[(hashtag_id, score), ...]`` sorted by decreasing decayed score."""
+    now = bucket_hour(now)
+    scores = defaultdict(float)
+    buckets = HashtagBucket.objects.filter(
+        hour__gt=now - timedelta(hours=WINDOW_HOURS)
+    ).values_list('hashtag_id', 'hour', 'count')
+    for hashtag_id, hour, count in buckets.iterator():
+        age_hours = (now - hour).total_seconds() / 3600
+        scores[hashtag_id] += count * 0.5 ** (age_hours / HALF_LIFE_HOURS)
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+def refresh_trending(now=None):
+    """Recompute and cache the ranking."""
+    ranking = compute_trending(now or timezone.now())[:CACHED_RANKING_SIZE]
+    cache.set(RANKING_CACHE_KEY, ranking, RANKING_CACHE_TIMEOUT)
+    return ranking
+
+
+def prune_buckets(now=None):
+    """Drop the buckets outside the window (periodic task only)."""
+    return HashtagBucket.objects.filter(
+        hour__lte=bucket_hour(now) - timedelta(hours=WINDOW_HOURS)
+    ).delete()[0]
+
+
+def _schedule_refresh():
+    """Enqueue one ranking refresh, however many readers miss the cache."""
+    if not cache.add(REFRESH_LOCK_KEY, True, REFRESH_LOCK_TIMEOUT):
+        return
+    from .tasks import update_trending_hashtags
+
+    try:
+        update_trending_hashtags.delay()
+    except Exception as e:
+        # The hourly run of the task rebuilds the ranking
+        logger.error(f"Could not enqueue trending refresh: {e}")
+
+
+def trending_hashtags(limit=10):
+    """The ``limit`` top trending hashtags, most trending first."""
+    ranking = cache.get(RANKING_CACHE_KEY)
+    if ranking is None:
+        # Never scan the buckets on the read path
+        _schedule_refresh()
+        ranking = []
+    hashtag_ids = [hashtag_id for hashtag_id, _ in ranking[:limit]]
+    if not hashtag_ids:
+        # No ranking yet or nothing used during the window: fall back to all-time usage
+        return list(Hashtag.objects.order_by('-posts_count')[:limit])
+    hashtags = Hashtag.objects.in_bulk(hashtag_ids)
+    return [hashtags[hashtag_id] for hashtag_id in hashtag_ids if hashtag_id in hashtags]
@@ -0,0 +1,278 @@
+"""
+Write-behind view counter for posts
+
+``resolve_post`` used to do ``views_count += 1; save()`` on every read, turning
+the hottest read path into a row-locking write that also lost increments under
+concurrency. Views are now accumulated in a buffer and flushed periodically
+(``posts.tasks.flush_view_counts``) as one batched
+``UPDATE ... SET views_count = views_count + delta`` per chunk of posts.
+
+Backends, selected by ``settings.VIEW_COUNTER['BACKEND']``:
+
+- ``RedisViewBuffer``: a shared hash of pending deltas, safe with any number
+  of web workers.
+- ``LocalViewBuffer``: a process-local dict flushed by a timer thread of the
+  process itself every ``FLUSH_INTERVAL`` seconds and once more at exit, for
+  development and tests. The beat task can only flush the buffer of the Celery
+  worker it runs in, so it is only useful with ``RedisViewBuffer``.
+
+With ``UNIQUE_VIEWERS`` enabled, ``RedisViewBuffer`` keeps a shared HyperLogLog
+sketch of each post's viewers (``PFADD``), which survives restarts and is
+shared by every worker, and ``views_count`` is set to its cardinality
+estimate. ``LocalViewBuffer`` only skips repeated views of a viewer between
+two flushes of the process and still adds deltas.
+"""
+
+import atexit
+import logging
+import threading
+import uuid
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BACKEND': 'posts.view_counter.LocalViewBuffer',
+    'UNIQUE_VIEWERS': False,
+    'FLUSH_INTERVAL': 30,
+    'REDIS_URL': None,
+    'BATCH_SIZE': 500,
+}
+
+
+def get_view_counter_settings():
+    return {**DEFAULTS, **getattr(settings, 'VIEW_COUNTER', {})}
+
+
+def apply_view_deltas(deltas, batch_size=500):
+    """``UPDATE posts SET views_count = views_count + delta`` in batches."""
+    from .models import Post
+
+    items = list(deltas.items())
+    for start in range(0, len(items), batch_size):
+        chunk = items[start:start + batch_size]
+        Post.objects.filter(id__in=[post_id for post_id, _ in chunk]).update(
+            views_count=F('views_count') + Case(
+                *[When(id=post_id, then=Value(delta)) for post_id, delta in chunk],
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+        )
+    return len(items)
+
+
+def apply_view_totals(totals, batch_size=500):
+    """``UPDATE posts SET views_count = total`` in batches (unique-viewer mode)."""
+    from .models import Post
+
+    items = list(totals.items())
+    for start in range(0, len(items), batch_size):
+        chunk = items[start:start + batch_size]
+        Post.objects.filter(id__in=[post_id for post_id, _ in chunk]).update(
+            views_count=Case(
+                *[When(id=post_id, then=Value(total)) for post_id, total in chunk],
+                default=F('views_count'),
+                output_field=IntegerField(),
+            )
+        )
+    return len(items)
+
+
+class LocalViewBuffer:
+    """
+    Process-local buffer. The first recorded view starts a daemon thread that
+    flushes the pending views every ``flush_interval`` seconds, and registers
+    a last flush at interpreter exit so an idle or stopping process keeps the
+    views it counted. A ``flush_interval`` of 0 leaves flushing to the caller.
+
+    Process-local sketches would start empty in every worker and after every
+    restart, so in unique-viewer mode a view only counts when the viewer is new
+    to the post since the last flush of this process, and is added as a delta.
+    The viewers seen are dropped at each flush, and the buffer flushes early
+    once it holds ``max_pending`` of them.
+    """
+
+    def __init__(self, unique_viewers=False, flush_interval=30, batch_size=500,
+                 max_pending=100000, **options):
+        self.unique_viewers = unique_viewers
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._viewers = {}
+        self._viewer_count = 0
+        self._timer = None
+        self._stopped = threading.Event()
+
+    def _start_timer(self):
+        # Called with the lock held
+        if self._timer is not None or not self.flush_interval:
+            return
+        self._timer = threading.Thread(
+            target=self._run_timer, name='view-buffer-flush', daemon=True
+        )
+        self._timer.start()
+        atexit.register(self.close)
+
+    def _run_timer(self):
+        while not self._stopped.wait(self.flush_interval):
+            self._safe_flush()
+
+    def _safe_flush(self):
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"View count flush error: {e}")
+        finally:
+            # The timer thread has its own connections; don't keep them open
+            if threading.current_thread() is self._timer:
+                connections.close_all()
+
+    def close(self):
+        """Stop the timer thread and flush what is left."""
+        self._stopped.set()
+        self._safe_flush()
+
+    def record(self, post_id, viewer=None):
+        with self._lock:
+            self._start_timer()
+            if self.unique_viewers:
+                viewers = self._viewers.setdefault(post_id, set())
+                if viewer in viewers:
+                    return
+                viewers.add(viewer)
+                self._viewer_count += 1
+            self._pending[post_id] = self._pending.get(post_id, 0) + 1
+            due = self._viewer_count >= self.max_pending
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._viewers = {}
+            self._viewer_count = 0
+        if not pending:
+            return 0
+        return apply_view_deltas(pending, self.batch_size)
+
+
+class RedisViewBuffer:
+    """
+    Pending deltas live in the ``views:pending`` hash. A flush atomically
+    renames it so views recorded meanwhile go to a fresh hash, and puts the
+    deltas back if the database update fails.
+    """
+
+    pending_key = 'views:pending'
+    touched_key = 'views:touched'
+    sketch_prefix = 'views:hll:'
+
+    def __init__(self, unique_viewers=False, redis_url=None, batch_size=500, **options):
+        import redis
+
+        self.unique_viewers = unique_viewers
+        self.batch_size = batch_size
+        self.client = redis.Redis.from_url(redis_url or settings.REDIS_URL)
+
+    def record(self, post_id, viewer=None):
+        if self.unique_viewers:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.pfadd(f'{self.sketch_prefix}{post_id}', str(viewer))
+            pipe.sadd(self.touched_key, post_id)
+            pipe.execute()
+        else:
+            self.client.hincrby(self.pending_key, post_id, 1)
+
+    def _take(self, key):
+        """Atomically move ``key`` aside; returns the new name or None if empty."""
+        import redis
+
+        flushing_key = f'{key}:flushing:{uuid.uuid4().hex}'
+        try:
+            self.client.rename(key, flushing_key)
+        except redis.ResponseError:
+            # Nothing recorded since the last flush
+            return None
+        return flushing_key
+
+    def flush(self):
+        if self.unique_viewers:
+            return self._flush_unique()
+        flushing_key = self._take(self.pending_key)
+        if flushing_key is None:
+            return 0
+        deltas = {
+            int(post_id): int(delta)
+            for post_id, delta in self.client.hgetall(flushing_key).items()
+        }
+        try:
+            flushed = apply_view_deltas(deltas, self.batch_size)
+        except Exception:
+            pipe = self.client.pipeline(transaction=False)
+            for post_id, delta in deltas.items():
+                pipe.hincrby(self.pending_key, post_id, delta)
+            pipe.delete(flushing_key)
+            pipe.execute()
+            raise
+        self.client.delete(flushing_key)
+        return flushed
+
+    def _flush_unique(self):
+        flushing_key = self._take(self.touched_key)
+        if flushing_key is None:
+            return 0
+        post_ids = [int(post_id) for post_id in self.client.smembers(flushing_key)]
+        pipe = self.client.pipeline(transaction=False)
+        for post_id in post_ids:
+            pipe.pfcount(f'{self.sketch_prefix}{post_id}')
+        totals = dict(zip(post_ids, pipe.execute()))
+        try:
+            flushed = apply_view_totals(totals, self.batch_size)
+        except Exception:
+            if post_ids:
+                self.client.sadd(self.touched_key, *post_ids)
+            self.client.delete(flushing_key)
+            raise
+        self.client.delete(flushing_key)
+        return flushed
+
+
+_buffer = None
+
+
+def get_view_buffer():
+    """Return the configured view buffer (one instance per process)."""
+    global _buffer
+    if _buffer is None:
+        config = get_view_counter_settings()
+        buffer_class = import_string(config['BACKEND'])
+        _buffer = buffer_class(
+            unique_viewers=config['UNIQUE_VIEWERS'],
+            flush_interval=config['FLUSH_INTERVAL'],
+            redis_url=config['REDIS_URL'],
+            batch_size=config['BATCH_SIZE'],
+        )
+    return _buffer
+
+
+def viewer_key(request):
+    """Identify a viewer for unique-viewer counting."""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.id}'
+    return f"ip:{request.META.get('REMOTE_ADDR', 'unknown')}"
+
+
+def record_view(post_id, request):
+    """Count one view of ``post_id`` without touching the database."""
+    try:
+        get_view_buffer().record(post_id, viewer_key(request))
+    except Exception as e:
+        # Losing a view is better than failing the read
+        logger.warning(f"Could not record view of post {post_id}: {e}")
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+GraphQL throughput benchmark: WSGI vs ASGI
+
+Sends the same operation to a WSGI server (synchronous NexusGraphQLView) and
+an ASGI server (AsyncNexusGraphQLView) with the same number of concurrent
+clients, and prints requests per second and latency percentiles of each.
+
+    gunicorn social_media_backend.wsgi:application -b :8000 -w 4 --threads 8
+    ASYNC_GRAPHQL=true gunicorn social_media_backend.asgi:application -b :8001 -w 4 \\
+        -k uvicorn.workers.UvicornWorker
+    python scripts/utils/benchmark_graphql.py --token <JWT>
+
+Without a token only the public ``allPosts`` query is sent.
+"""
+
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+AUTHENTICATED_QUERY = """
+query Dashboard {
+  feed(first: 20) { id content author { username } }
+  allPosts(first: 20) { id content author { username } }
+  myNotifications { id message isRead }
+  unreadCount
+}
+"""
+
+ANONYMOUS_QUERY = """
+query PublicPosts {
+  allPosts(first: 20) { id content author { username } }
+}
+"""
+
+_local = threading.local()
+
+
+def _session():
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = _local.session = requests.Session()
+    return session
+
+
+def _send(url, payload, headers):
+    start = time.perf_counter()
+    response = _session().post(url, json=payload, headers=headers, timeout=30)
+    elapsed = time.perf_counter() - start
+    ok = response.status_code == 200 and 'errors' not in response.json()
+    return elapsed, ok
+
+
+def run(url, payload, headers, total, concurrency):
+    """Send ``total`` requests with ``concurrency`` clients, return the stats."""
+    # Warm up connections, caches and parsed documents
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda _: _send(url, payload, headers), range(concurrency)))
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: _send(url, payload, headers), range(total)))
+    duration = time.perf_counter() - start
+    latencies = sorted(elapsed for elapsed, _ in results)
+    return {
+        'rps': total / duration,
+        'errors': sum(1 for _, ok in results if not ok),
+        'p50': statistics.median(latencies) * 1000,
+        'p95': latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        'p99': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--wsgi-url', default='http://localhost:8000/graphql/')
+    parser.add_argument('--asgi-url', default='http://localhost:8001/graphql/')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--token', help='JWT of a user with a feed and notifications')
+    args = parser.parse_args()
+
+    headers = {}
+    query = ANONYMOUS_QUERY
+    if args.token:
+        headers['Authorization'] = f'JWT {args.token}'
+        query = AUTHENTICATED_QUERY
+    payload = {'query': query}
+
+    print(f"{args.requests} requests, {args.concurrency} concurrent clients")
+    stats = {}
+    for name, url in (('WSGI', args.wsgi_url), ('ASGI', args.asgi_url)):
+        stats[name] = run(url, payload, headers, args.requests, args.concurrency)
+        print(
+            f"{name}: {stats[name]['rps']:.1f} req/s, p50 {stats[name]['p50']:.1f} ms, "
+            f"p95 {stats[name]['p95']:.1f} ms, p99 {stats[name]['p99']:.1f} ms, "
+            f"{stats[name]['errors']} errors"
+        )
+    print(f"ASGI/WSGI throughput: {stats['ASGI']['rps'] / stats['WSGI']['rps']:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -17,6 +17,14 @@ class SocialMediaBackendConfig(AppConfig):
         """
         Initialize application when Django starts
         """
+        from . import object_cache, response_cache, subscriptions
+        
+        # Invalidate cached GraphQL responses when posts, hashtags or users change
+        response_cache.connect_signals()
+        # Invalidate cached User and Post rows when they change
+        object_cache.connect_signals()
+        # Push notification events to GraphQL subscriptions
+        subscriptions.connect_signals()
+        
         # Import Celery admin customizations
         # Temporarily disabled to fix startup issues
-        pass
@@ -0,0 +1,133 @@
+"""
+Asynchronous GraphQL endpoint for ASGI deployments
+
+Under ASGI the synchronous ``NexusGraphQLView`` blocks the thread it runs in
+on every database call. ``AsyncNexusGraphQLView`` is a native async view: it
+runs the request pipeline (persisted queries, validation, cost, rate limit,
+response cache) on a bounded pool of ``ASYNC_GRAPHQL['REQUEST_WORKERS']``
+threads, so the event loop only waits on it and the number of threads holding
+a database connection is capped.
+
+Root query fields whose resolver is marked with ``@concurrent_resolver``
+(``feed``, ``allPosts``, ``post``, ``myNotifications``, ``unreadCount``) are
+independent of each other, so ``ConcurrentExecutionContext`` resolves each of
+them, with its whole selection, on a second pool of ``RESOLVER_WORKERS``
+threads, while the other root fields are resolved in the request thread.
+An operation selecting ``feed`` and ``unreadCount`` costs the slower of the two
+instead of their sum. Mutations are always executed serially.
+
+The Django ORM is synchronous (its async API runs every query on a single
+thread), so resolvers stay synchronous and are offloaded rather than rewritten
+as coroutines. SQL run on resolver threads is not included in the per-operation
+tracing and N+1 statistics. ``scripts/utils/benchmark_graphql.py`` compares the
+throughput of both views.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from graphql import ExecutionContext, OperationType
+
+from .graphql_view import NexusGraphQLView
+
+DEFAULTS = {
+    # Serve /graphql/ with AsyncNexusGraphQLView (ASGI deployments)
+    'ENABLED': False,
+    # Threads running request pipelines
+    'REQUEST_WORKERS': 32,
+    # Threads resolving concurrent root fields
+    'RESOLVER_WORKERS': 16,
+}
+
+_executors = {}
+
+
+def get_async_graphql_settings():
+    return {**DEFAULTS, **getattr(settings, 'ASYNC_GRAPHQL', {})}
+
+
+def get_executor(name):
+    """Process-wide thread pool ``'REQUEST'`` or ``'RESOLVER'``."""
+    executor = _executors.get(name)
+    if executor is None:
+        executor = _executors[name] = ThreadPoolExecutor(
+            max_workers=get_async_graphql_settings()[f'{name}_WORKERS'],
+            thread_name_prefix=f'graphql-{name.lower()}',
+        )
+    return executor
+
+
+def concurrent_resolver(resolver):
+    """
+    Mark a root query resolver as safe to run concurrently with the other
+    root fields of its operation, on its own thread.
+    """
+    resolver.concurrent = True
+    return resolver
+
+
+def _in_worker(function, *args, **kwargs):
+    # Pool threads outlive requests: apply CONN_MAX_AGE like request_finished
+    close_old_connections()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_in_executor(name, function, *args, **kwargs):
+    """Await ``function(*args, **kwargs)`` run on the ``name`` thread pool."""
+    run = sync_to_async(_in_worker, thread_sensitive=False, executor=get_executor(name))
+    return await run(function, *args, **kwargs)
+
+
+class ConcurrentExecutionContext(ExecutionContext):
+    """
+    Execution context resolving the ``@concurrent_resolver`` root fields of
+    query operations in parallel on the resolver pool.
+    """
+
+    def _is_concurrent(self, parent_type, field_nodes):
+        field = parent_type.fields.get(field_nodes[0].name.value)
+        return field is not None and getattr(field.resolve, 'concurrent', False)
+
+    def execute_fields(self, parent_type, source_value, path, fields):
+        if path is not None or self.operation.operation != OperationType.QUERY:
+            return super().execute_fields(parent_type, source_value, path, fields)
+        concurrent = {
+            response_name: field_nodes for response_name, field_nodes in fields.items()
+            if self._is_concurrent(parent_type, field_nodes)
+        }
+        if not concurrent or len(fields) == 1:
+            return super().execute_fields(parent_type, source_value, path, fields)
+        execute_fields = super().execute_fields
+        executor = get_executor('RESOLVER')
+        futures = [
+            executor.submit(
+                _in_worker, execute_fields, parent_type, source_value, path,
+                {response_name: field_nodes}
+            )
+            for response_name, field_nodes in concurrent.items()
+        ]
+        results = execute_fields(
+            parent_type, source_value, path,
+            {name: nodes for name, nodes in fields.items() if name not in concurrent}
+        )
+        for future in futures:
+            results.update(future.result())
+        # Keep the order of the selection
+        return {name: results[name] for name in fields if name in results}
+
+
+class AsyncNexusGraphQLView(NexusGraphQLView):
+    """
+    Native async GraphQL view running the request pipeline on a thread pool.
+    """
+
+    view_is_async = True
+    execution_context_class = ConcurrentExecutionContext
+
+    async def dispatch(self, request, *args, **kwargs):
+        return await run_in_executor('REQUEST', super().dispatch, request, *args, **kwargs)
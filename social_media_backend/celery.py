@@ -22,3 +22,31 @@ app.autodiscover_tasks()
 @app.task(bind=True, ignore_result=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
+
+
+def enqueue_on_commit(task, *args, **kwargs):
+    """
+    Schedule ``task`` once the current transaction commits.
+
+    A broker outage does not fail the request that triggered the task: the
+    call is stored as a ``posts.DeferredTask`` row instead, and
+    ``posts.tasks.send_deferred_tasks`` sends it once the broker is back.
+    Arguments must be JSON serializable.
+    """
+    import logging
+    from django.db import transaction
+
+    def _send():
+        logger = logging.getLogger(__name__)
+        try:
+            task.delay(*args, **kwargs)
+        except Exception as e:
+            from posts.models import DeferredTask
+
+            logger.error(f"Could not enqueue {task.name}, deferring it: {e}")
+            try:
+                DeferredTask.objects.create(task=task.name, args=list(args), kwargs=kwargs)
+            except Exception as e:
+                logger.error(f"Could not defer {task.name}{args}: {e}")
+
+    transaction.on_commit(_send)
@@ -0,0 +1,193 @@
+"""
+Atomic engagement counters
+
+Denormalized counters (``likes_count``, ``followers_count``...) used to be
+updated with read-modify-write (``post.likes_count += 1; post.save()``), which
+loses increments under concurrency. Every change now goes through
+``increment``/``decrement``, a single ``UPDATE ... SET col = col + delta``
+clamped at zero.
+
+Counters listed in ``settings.COUNTERS['SHARDED_FIELDS']`` (``'app.Model.field'``)
+are written to one of ``SHARDS`` random ``CounterShard`` rows instead, so a
+viral post does not serialize every like on its own row. Their value is the
+base column plus the pending shards (``counter_value`` / ``resolve_counter``)
+until ``interactions.tasks.compact_counter_shards`` folds them back.
+"""
+
+import random
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum, Value
+from django.db.models.functions import Greatest
+
+from .object_cache import invalidate_objects
+
+DEFAULTS = {
+    'SHARDED_FIELDS': (),
+    'SHARDS': 8,
+    'COMPACT_BATCH_SIZE': 1000,
+}
+
+
+def get_counter_settings():
+    return {**DEFAULTS, **getattr(settings, 'COUNTERS', {})}
+
+
+def is_sharded(model, field):
+    return f'{model._meta.label}.{field}' in get_counter_settings()['SHARDED_FIELDS']
+
+
+def apply_delta(model, pk, field, delta):
+    """``UPDATE model SET field = GREATEST(field + delta, 0) WHERE pk = pk``."""
+    if delta > 0:
+        expression = F(field) + delta
+    else:
+        expression = Greatest(F(field) + delta, Value(0))
+    updated = model._default_manager.filter(pk=pk).update(**{field: expression})
+    invalidate_objects(model, [pk])
+    return updated
+
+
+def increment(instance, field, delta=1):
+    """
+    Atomically add ``delta`` to ``instance.<field>``.
+
+    The in-memory attribute is adjusted too so mutation payloads show the new
+    value without reloading the row.
+    """
+    if not delta:
+        return
+    model = type(instance)
+    if is_sharded(model, field):
+        _add_to_shard(model, instance.pk, field, delta)
+    else:
+        apply_delta(model, instance.pk, field, delta)
+    setattr(instance, field, max(getattr(instance, field) + delta, 0))
+
+
+def decrement(instance, field, delta=1):
+    increment(instance, field, -delta)
+
+
+def increment_many(model, pks, field, delta=1):
+    """Atomically add ``delta`` to ``field`` of several rows at once."""
+    pks = list(pks)
+    if not delta or not pks:
+        return
+    if is_sharded(model, field):
+        for pk in pks:
+            _add_to_shard(model, pk, field, delta)
+    elif delta > 0:
+        model._default_manager.filter(pk__in=pks).update(**{field: F(field) + delta})
+    else:
+        model._default_manager.filter(pk__in=pks).update(
+            **{field: Greatest(F(field) + delta, Value(0))}
+        )
+    if not is_sharded(model, field):
+        invalidate_objects(model, pks)
+
+
+def _add_to_shard(model, pk, field, delta):
+    from django.contrib.contenttypes.models import ContentType
+    from interactions.models import CounterShard
+
+    lookup = {
+        'content_type': ContentType.objects.get_for_model(model),
+        'object_id': pk,
+        'field': field,
+        'shard': random.randrange(get_counter_settings()['SHARDS']),
+    }
+    shards = CounterShard.objects.filter(**lookup)
+    if shards.update(delta=F('delta') + delta):
+        return
+    try:
+        with transaction.atomic():
+            CounterShard.objects.create(delta=delta, **lookup)
+    except IntegrityError:
+        # Another writer created the shard first
+        shards.update(delta=F('delta') + delta)
+
+
+def pending_deltas(model, field, pks):
+    """``{pk: sum of shard deltas}`` for the given objects, in one query."""
+    from django.contrib.contenttypes.models import ContentType
+    from interactions.models import CounterShard
+
+    rows = CounterShard.objects.filter(
+        content_type=ContentType.objects.get_for_model(model),
+        field=field,
+        object_id__in=list(pks),
+    ).values('object_id').annotate(total=Sum('delta'))
+    return {row['object_id']: row['total'] for row in rows}
+
+
+def counter_value(instance, field):
+    """Current value of a counter, pending shards included."""
+    value = getattr(instance, field)
+    if is_sharded(type(instance), field):
+        value += pending_deltas(type(instance), field, [instance.pk]).get(instance.pk, 0)
+    return max(value, 0)
+
+
+def resolve_counter(field):
+    """
+    Resolver for a counter field of a DjangoObjectType.
+
+    Unsharded counters are read from the column. For sharded ones, the shards
+    of every row the request loaders have seen (i.e. the whole page) are
+    summed in one query on first access.
+    """
+    def resolver(root, info):
+        value = getattr(root, field)
+        model = type(root)
+        if not is_sharded(model, field):
+            return value
+
+        from .dataloaders import get_loaders
+
+        loaders = get_loaders(info)
+        deltas = loaders.batches.setdefault(('counter', model, field), {})
+        if root.pk not in deltas:
+            pks = loaders.seen.get(model, set()) | {root.pk}
+            fetched = pending_deltas(model, field, pks - deltas.keys())
+            deltas.update({pk: fetched.get(pk, 0) for pk in pks})
+        return max(value + deltas[root.pk], 0)
+
+    return resolver
+
+
+def compact_shards(batch_size=None):
+    """
+    Fold pending shard deltas into the base columns.
+
+    Shard rows are locked while they are summed and deleted, so increments
+    racing with the compaction either land before the lock (and are folded)
+    or wait and are applied to a fresh shard row afterwards.
+    """
+    from django.contrib.contenttypes.models import ContentType
+    from interactions.models import CounterShard
+
+    batch_size = batch_size or get_counter_settings()['COMPACT_BATCH_SIZE']
+    compacted = 0
+    while True:
+        with transaction.atomic():
+            shards = list(
+                CounterShard.objects.select_for_update(skip_locked=True)
+                .order_by('id')[:batch_size]
+            )
+            if not shards:
+                break
+            totals = defaultdict(int)
+            for shard in shards:
+                totals[(shard.content_type_id, shard.object_id, shard.field)] += shard.delta
+            for (content_type_id, object_id, field), delta in totals.items():
+                model = ContentType.objects.get_for_id(content_type_id).model_class()
+                if delta and model is not None:
+                    apply_delta(model, object_id, field, delta)
+            CounterShard.objects.filter(id__in=[shard.id for shard in shards]).delete()
+            compacted += len(totals)
+        if len(shards) < batch_size:
+            break
+    return compacted
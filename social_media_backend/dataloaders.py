@@ -0,0 +1,202 @@
+"""
+Request-scoped DataLoaders for the GraphQL API
+
+Resolving a foreign key through the default DjangoObjectType resolver costs one
+query per row. The loaders below batch and dedupe User, Post and Comment lookups
+across a whole GraphQL execution: every list a resolver returns is scanned once
+by ``DataLoaderMiddleware`` and the foreign keys it references are queued, so the
+first ``author`` resolved on a page fetches every author of that page in a
+single ``IN`` query. Batches of users and posts are read through the
+process and shared object cache first (``social_media_backend.object_cache``).
+"""
+
+import threading
+
+import graphene
+from django.db import models
+from django.db.models.query import QuerySet
+
+from users.models import User
+from posts.models import Post, Comment
+
+from .object_cache import get_objects
+
+
+class ModelLoader:
+    """
+    Batching loader for one model, keyed by primary key.
+
+    Keys are queued with ``queue()`` and fetched together the first time one
+    of them is actually needed by ``load()``. Results (including misses) are
+    cached for the lifetime of the loader, i.e. one GraphQL request. Root
+    fields resolved concurrently share the loader, hence the lock.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._pk_field = model._meta.pk
+        self._cache = {}
+        self._queue = set()
+        self._lock = threading.RLock()
+
+    def get_queryset(self):
+        return self.model._default_manager.all()
+
+    def fetch(self, keys):
+        return self.get_queryset().in_bulk(list(keys))
+
+    def _key(self, key):
+        return self._pk_field.to_python(key)
+
+    def prime(self, obj):
+        """Store an already fetched instance so it is never queried again."""
+        with self._lock:
+            self._cache.setdefault(obj.pk, obj)
+            self._queue.discard(obj.pk)
+
+    def queue(self, key):
+        """Schedule a key for the next batch without fetching it yet."""
+        if key is None:
+            return
+        key = self._key(key)
+        with self._lock:
+            if key not in self._cache:
+                self._queue.add(key)
+
+    def load(self, key):
+        if key is None:
+            return None
+        key = self._key(key)
+        with self._lock:
+            if key not in self._cache:
+                self._queue.add(key)
+                self.dispatch()
+            return self._cache.get(key)
+
+    def load_many(self, keys):
+        keys = [self._key(key) for key in keys if key is not None]
+        with self._lock:
+            self._queue.update(key for key in keys if key not in self._cache)
+            self.dispatch()
+            return [self._cache.get(key) for key in keys]
+
+    def dispatch(self):
+        """Fetch every queued key in one query (or from the object cache)."""
+        with self._lock:
+            keys = self._queue
+            self._queue = set()
+            if not keys:
+                return
+            found = get_objects(self.model, keys, self.fetch)
+            for key in keys:
+                self._cache[key] = found.get(key)
+
+
+class Loaders:
+    """
+    Container holding one ``ModelLoader`` per batched model for a request.
+    """
+
+    def __init__(self):
+        self.users = ModelLoader(User)
+        self.posts = ModelLoader(Post)
+        self.comments = ModelLoader(Comment)
+        self._by_model = {
+            User: self.users,
+            Post: self.posts,
+            Comment: self.comments,
+        }
+        # Primary keys of every row resolved so far, by model
+        self.seen = {}
+        # Per-request caches of other batched lookups (e.g. counter shards)
+        self.batches = {}
+
+    def for_model(self, model):
+        return self._by_model.get(model)
+
+    def collect(self, objects):
+        """
+        Prime loaders with ``objects`` and queue every foreign key they
+        reference, unless the related row was already fetched (select_related).
+        Partially loaded rows (``.only()``) are not primed.
+        """
+        for obj in objects:
+            if not isinstance(obj, models.Model):
+                continue
+            loaded = obj.__dict__
+            self.seen.setdefault(type(obj), set()).add(obj.pk)
+            loader = self._by_model.get(type(obj))
+            if loader is not None and not obj.get_deferred_fields():
+                loader.prime(obj)
+            for field in _batched_foreign_keys(type(obj)):
+                # Reading a deferred key would cost a query per row.
+                if field.attname in loaded and not field.is_cached(obj):
+                    self._by_model[field.related_model].queue(
+                        getattr(obj, field.attname)
+                    )
+
+
+_FOREIGN_KEYS = {}
+
+
+def _batched_foreign_keys(model):
+    """Foreign keys of ``model`` pointing at a model with a loader."""
+    fields = _FOREIGN_KEYS.get(model)
+    if fields is None:
+        fields = _FOREIGN_KEYS[model] = [
+            field for field in model._meta.concrete_fields
+            if field.many_to_one and field.related_model in (User, Post, Comment)
+        ]
+    return fields
+
+
+def get_loaders(context):
+    """
+    Return the loaders attached to the request, creating them on first use.
+    Accepts either the request itself or a GraphQL ``info`` object.
+    """
+    context = getattr(context, 'context', context)
+    loaders = getattr(context, '_dataloaders', None)
+    if loaders is None:
+        loaders = Loaders()
+        context._dataloaders = loaders
+    return loaders
+
+
+def load_related(info, obj, field_name):
+    """
+    Resolve the foreign key ``field_name`` of ``obj`` through the request
+    loaders. Falls back to the cached instance when select_related already
+    fetched it.
+    """
+    field = obj._meta.get_field(field_name)
+    if field.is_cached(obj):
+        return getattr(obj, field_name)
+    loader = get_loaders(info).for_model(field.related_model)
+    key = getattr(obj, field.attname)
+    if loader is None:
+        return getattr(obj, field_name)
+    return loader.load(key)
+
+
+class DataLoaderMiddleware:
+    """
+    GraphQL middleware feeding resolved model instances to the request loaders.
+
+    QuerySets are evaluated here (they would be iterated right after anyway)
+    so that their foreign keys are queued before any child field resolves.
+    Relay connections are unwrapped to their edge nodes.
+    """
+
+    def resolve(self, next, root, info, **args):
+        result = next(root, info, **args)
+        if isinstance(result, QuerySet):
+            result = list(result)
+        if isinstance(result, list):
+            if result and isinstance(result[0], models.Model):
+                get_loaders(info).collect(result)
+        elif isinstance(result, models.Model):
+            get_loaders(info).collect((result,))
+        elif isinstance(result, graphene.relay.Connection):
+            get_loaders(info).collect([edge.node for edge in result.edges])
+        return result
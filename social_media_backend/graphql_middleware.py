@@ -14,6 +14,8 @@ from graphql.execution.middleware import MiddlewareManager
 from graphene_django.utils import GraphQLError as DjangoGraphQLError
 import json
 
+from .rate_limit import RateLimitExceeded, check_rate_limit
+
 # Configuration du logging
 logger = logging.getLogger('graphql')
 
@@ -31,21 +33,12 @@ class ErrorHandlingMiddleware:
         Résout les requêtes avec gestion d'erreurs complète
         """
         
-        operation_name = getattr(info.operation, 'name', {})
-        operation_name = operation_name.value if operation_name else 'Unknown'
         field_name = info.field_name
         
         try:
-            # Log de la requête
-            logger.info(f"GraphQL Request: {operation_name}.{field_name}")
-            
-            # Exécuter la résolution
-            result = next(root, info, **args)
-            
-            # Log du succès
-            logger.debug(f"GraphQL Success: {operation_name}.{field_name}")
-            
-            return result
+            # Pas de log par champ : les durées sont agrégées par
+            # social_media_backend.tracing
+            return next(root, info, **args)
             
         except ValidationError as e:
             self.error_count += 1
@@ -166,9 +159,13 @@ class LoggingMiddleware:
     
     def resolve(self, next, root, info, **args):
         """
-        Log toutes les opérations GraphQL
+        Log les champs racine des opérations GraphQL (une ligne par champ de
+        premier niveau, pas par champ résolu)
         """
         
+        if info.path.prev is not None:
+            return next(root, info, **args)
+        
         start_time = timezone.now()
         field_name = info.field_name
         user = getattr(info.context, 'user', None)
@@ -194,47 +191,24 @@ class LoggingMiddleware:
 class RateLimitingMiddleware:
     """
     Middleware pour limitation du taux de requêtes
-    """
     
-    def __init__(self):
-        self.request_counts = {}
-        self.window_start = timezone.now()
-        self.window_duration = 60  # 1 minute
-        self.max_requests = 100    # 100 requêtes par minute
+    Les compteurs sont partagés entre les workers via le cache Django et la
+    limite est appliquée une seule fois par opération (voir
+    social_media_backend.rate_limit). NexusGraphQLView l'applique déjà ;
+    ce middleware sert aux exécutions hors de la vue.
+    """
     
     def resolve(self, next, root, info, **args):
         """
-        Limite le taux de requêtes par utilisateur
+        Limite le taux d'opérations par utilisateur
         """
         
-        current_time = timezone.now()
-        user = getattr(info.context, 'user', None)
-        user_key = user.id if user and user.is_authenticated else info.context.META.get('REMOTE_ADDR', 'unknown')
-        
-        # Reset du compteur si la fenêtre est expirée
-        if (current_time - self.window_start).total_seconds() > self.window_duration:
-            self.request_counts = {}
-            self.window_start = current_time
-        
-        # Vérification du taux
-        current_count = self.request_counts.get(user_key, 0)
-        
-        if current_count >= self.max_requests:
-            logger.warning(f"Rate limit exceeded for user: {user_key}")
-            
-            raise GraphQLError(
-                message="Rate limit exceeded",
-                extensions={
-                    'code': 'RATE_LIMIT_EXCEEDED',
-                    'max_requests': self.max_requests,
-                    'window_duration': self.window_duration,
-                    'retry_after': self.window_duration,
-                    'timestamp': timezone.now().isoformat()
-                }
-            )
-        
-        # Incrémenter le compteur
-        self.request_counts[user_key] = current_count + 1
+        if info.path.prev is None:
+            try:
+                check_rate_limit(info.context, info.operation, info.fragments)
+            except RateLimitExceeded as e:
+                logger.warning(f"Rate limit exceeded: {e}")
+                raise e.as_graphql_error()
         
         return next(root, info, **args)
 
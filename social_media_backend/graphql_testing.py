@@ -0,0 +1,85 @@
+"""
+Test helpers for the GraphQL API
+
+``assert_query_budget`` runs an operation the way ``/graphql/`` does (same
+schema and middleware) with N+1 detection on, and fails when the operation
+runs more SQL queries than its budget or repeats a statement shape::
+
+    from social_media_backend.graphql_testing import QueryBudgetMixin
+
+    class FeedQueryTests(QueryBudgetMixin, TestCase):
+        def test_feed_query_count(self):
+            self.assertQueryBudget(FEED_QUERY, 6, user=self.user)
+"""
+
+from django.contrib.auth.models import AnonymousUser
+from django.test import RequestFactory, override_settings
+from graphene_django.settings import graphene_settings
+from graphene_django.views import instantiate_middleware
+
+from .n_plus_one import get_n_plus_one_settings
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def execute_operation(query, variables=None, user=None, operation_name=None, threshold=None):
+    """
+    Execute ``query`` as ``user`` with N+1 detection enabled.
+    Returns ``(result, report)``.
+    """
+    from .schema import schema
+
+    request = RequestFactory().post('/graphql/')
+    request.user = user or AnonymousUser()
+    config = {**get_n_plus_one_settings(), 'ENABLED': True}
+    if threshold is not None:
+        config['THRESHOLD'] = threshold
+    with override_settings(N_PLUS_ONE=config):
+        result = schema.execute(
+            query,
+            context_value=request,
+            variable_values=variables,
+            operation_name=operation_name,
+            middleware=list(instantiate_middleware(graphene_settings.MIDDLEWARE)),
+        )
+    return result, result.extensions['nPlusOne']
+
+
+def format_report(report):
+    lines = [f"{report['queries']} queries"]
+    for shape in report['repeated']:
+        fields = ', '.join(shape['fields']) or 'unknown fields'
+        lines.append(f"  {shape['count']}x ({shape['distinct']} distinct) from {fields}: {shape['sql']}")
+    return '\n'.join(lines)
+
+
+def assert_query_budget(query, max_queries, variables=None, user=None, operation_name=None,
+                        threshold=None, allow_repeated=False):
+    """
+    Execute ``query`` and fail if it errors, runs more than ``max_queries``
+    queries or, unless ``allow_repeated``, repeats a statement shape at least
+    ``threshold`` times. Returns the execution result.
+    """
+    result, report = execute_operation(
+        query, variables=variables, user=user, operation_name=operation_name, threshold=threshold
+    )
+    if result.errors:
+        raise QueryBudgetExceeded(f'Operation failed: {result.errors}')
+    if report['queries'] > max_queries:
+        raise QueryBudgetExceeded(
+            f"Query budget exceeded: {report['queries']} > {max_queries}\n{format_report(report)}"
+        )
+    if report['repeated'] and not allow_repeated:
+        raise QueryBudgetExceeded(f'Repeated queries (possible N+1):\n{format_report(report)}')
+    return result
+
+
+class QueryBudgetMixin:
+    """
+    ``TestCase`` mixin exposing ``assert_query_budget`` as an assertion.
+    """
+
+    def assertQueryBudget(self, query, max_queries, **kwargs):
+        return assert_query_budget(query, max_queries, **kwargs)
@@ -0,0 +1,266 @@
+"""
+GraphQL endpoint
+
+``NexusGraphQLView`` is graphene-django's ``GraphQLView`` with the request
+pipeline split into overridable steps (``parse_document``,
+``validate_document``, ``execute_document``) and traced per phase (see
+``social_media_backend.tracing``), with N+1 detection when the schema is
+instrumented (``social_media_backend.n_plus_one``). Validated operations are
+checked against the cost limits (``social_media_backend.query_cost``) and
+rate limited once each (``social_media_backend.rate_limit``). Persisted
+queries are resolved before execution and parsed documents are reused across
+requests (``social_media_backend.persisted_queries``), and the responses of
+anonymous public queries are shared through the cache
+(``social_media_backend.response_cache``). Response ``extensions`` collected
+during the request are included in the JSON body.
+"""
+
+from contextlib import nullcontext
+
+from django.db import connection, transaction
+from django.http import HttpResponseNotAllowed
+from django.http.response import HttpResponseBadRequest
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.utils.utils import set_rollback
+from graphene_django.views import GraphQLView, HttpError
+from graphql import ExecutionResult, GraphQLError, OperationType, execute, get_operation_ast, parse, validate_schema
+from graphql.validation import validate
+
+from .n_plus_one import instrument_execution
+from .persisted_queries import get_document_cache, get_persisted_query_settings, resolve_query
+from .query_cost import analyze_operation
+from .rate_limit import RateLimitExceeded, check_rate_limit, document_fragments
+from .response_cache import cached_response
+from .tracing import get_trace, get_tracing_settings, start_trace
+
+
+class NexusGraphQLView(GraphQLView):
+    """
+    Traced GraphQL view.
+    """
+
+    def parse_document(self, request, query):
+        documents = get_document_cache()
+        entry = documents.get(query)
+        if entry is None:
+            entry = documents.add(query, parse(query))
+        request._graphql_document = entry
+        return entry.document
+
+    def validate_document(self, request, schema, document):
+        entry = getattr(request, '_graphql_document', None)
+        if entry is not None and entry.document is not document:
+            entry = None
+        if entry is not None and entry.valid:
+            return []
+        errors = validate(
+            schema,
+            document,
+            self.validation_rules,
+            graphene_settings.MAX_VALIDATION_ERRORS,
+        )
+        if entry is not None and not errors:
+            entry.valid = True
+        return errors
+
+    def execute_document(self, request, schema, document, operation_ast, **execute_options):
+        if (
+            operation_ast is not None
+            and operation_ast.operation == OperationType.MUTATION
+            and (
+                graphene_settings.ATOMIC_MUTATIONS is True
+                or connection.settings_dict.get('ATOMIC_MUTATIONS', False) is True
+            )
+        ):
+            with transaction.atomic():
+                result = execute(schema, document, **execute_options)
+                if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                    transaction.set_rollback(True)
+            return result
+        return execute(schema, document, **execute_options)
+
+    def execute_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        if not query:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseBadRequest('Must provide query string.'))
+
+        trace = start_trace(request)
+        result = None
+        try:
+            result = self._execute_traced(
+                request, trace, query, variables, operation_name, show_graphiql
+            )
+            return result
+        finally:
+            if trace is not None:
+                trace.finish(errors=result.errors if result is not None else True)
+
+    def _execute_traced(self, request, trace, query, variables, operation_name, show_graphiql):
+        phase = trace.phase if trace is not None else (lambda name: nullcontext())
+        schema = self.schema.graphql_schema
+
+        schema_validation_errors = validate_schema(schema)
+        if schema_validation_errors:
+            return ExecutionResult(data=None, errors=schema_validation_errors)
+
+        with phase('parse'):
+            try:
+                document = self.parse_document(request, query)
+            except Exception as e:
+                return ExecutionResult(errors=[e])
+
+        operation_ast = get_operation_ast(document, operation_name)
+        if trace is not None and operation_ast is not None:
+            trace.operation_type = operation_ast.operation.value
+            trace.operation_name = operation_name or (operation_ast.name and operation_ast.name.value)
+
+        if (
+            request.method.lower() == 'get'
+            and operation_ast is not None
+            and operation_ast.operation != OperationType.QUERY
+        ):
+            if show_graphiql:
+                return None
+            raise HttpError(
+                HttpResponseNotAllowed(
+                    ['POST'],
+                    'Can only perform a {} operation from a POST request.'.format(
+                        operation_ast.operation.value
+                    ),
+                )
+            )
+
+        with phase('validate'):
+            validation_errors = self.validate_document(request, schema, document)
+        if validation_errors:
+            return ExecutionResult(data=None, errors=validation_errors)
+
+        if operation_ast is not None:
+            fragments = document_fragments(document)
+            query_cost = analyze_operation(schema, operation_ast, fragments, variables)
+            if query_cost is not None:
+                add_extension(request, 'cost', query_cost.as_extension())
+                cost_errors = query_cost.limit_errors()
+                if cost_errors:
+                    return ExecutionResult(data=None, errors=cost_errors)
+            try:
+                check_rate_limit(request, operation_ast, fragments)
+            except RateLimitExceeded as e:
+                raise HttpError(e.as_response(), message=str(e))
+
+            response_cache = cached_response(
+                request, schema, document, operation_ast, fragments, variables, operation_name
+            )
+            if response_cache is not None:
+                result = response_cache.get_or_execute(
+                    lambda: self._execute_operation(
+                        request, trace, schema, document, operation_ast, variables, operation_name
+                    )
+                )
+                add_extension(request, 'responseCache', response_cache.as_extension())
+                return result
+
+        return self._execute_operation(
+            request, trace, schema, document, operation_ast, variables, operation_name
+        )
+
+    def _execute_operation(self, request, trace, schema, document, operation_ast, variables, operation_name):
+        phase = trace.phase if trace is not None else (lambda name: nullcontext())
+        execute_options = {
+            'root_value': self.get_root_value(request),
+            'context_value': self.get_context(request),
+            'variable_values': variables,
+            'operation_name': operation_name,
+            'middleware': self.get_middleware(request),
+        }
+        if self.execution_context_class:
+            execute_options['execution_context_class'] = self.execution_context_class
+        with phase('execute'), instrument_execution(self.schema, execute_options) as recorder:
+            try:
+                with trace.capture_sql() if trace is not None else nullcontext():
+                    return self.execute_document(request, schema, document, operation_ast, **execute_options)
+            except Exception as e:
+                return ExecutionResult(errors=[e])
+            finally:
+                if recorder is not None:
+                    add_extension(request, 'nPlusOne', recorder.report())
+
+    def get_extensions(self, request):
+        """Response ``extensions`` of the current operation."""
+        extensions = dict(getattr(request, '_graphql_extensions', {}))
+        trace = get_trace(request)
+        if trace is not None and trace.sampled and get_tracing_settings()['EXTENSIONS']:
+            extensions['tracing'] = trace.as_extension()
+        return extensions
+
+    def dispatch(self, request, *args, **kwargs):
+        response = super().dispatch(request, *args, **kwargs)
+        cache_control = getattr(request, '_graphql_cache_control', None)
+        if cache_control is not None and response.status_code == 200:
+            patch_cache_control(response, **cache_control)
+            patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def get_response(self, request, data, show_graphiql=False):
+        query, variables, operation_name, id = self.get_graphql_params(request, data)
+
+        try:
+            query, persisted = resolve_query(request, data, query)
+        except GraphQLError as e:
+            execution_result = ExecutionResult(errors=[e])
+        else:
+            execution_result = self.execute_graphql_request(
+                request, data, query, variables, operation_name, show_graphiql
+            )
+            if persisted and request.method.lower() == 'get' and execution_result and not execution_result.errors:
+                request._graphql_cache_control = self.get_cache_control(request)
+
+        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+            set_rollback()
+
+        status_code = 200
+        if not execution_result:
+            return None, status_code
+
+        response = {}
+        if execution_result.errors:
+            set_rollback()
+            response['errors'] = [self.format_error(e) for e in execution_result.errors]
+
+        if execution_result.errors and any(
+            not getattr(e, 'path', None) for e in execution_result.errors
+        ):
+            status_code = 400
+        else:
+            response['data'] = execution_result.data
+
+        extensions = self.get_extensions(request)
+        if extensions:
+            response['extensions'] = extensions
+
+        if self.batch:
+            response['id'] = id
+            response['status'] = status_code
+
+        return self.json_encode(request, response, pretty=show_graphiql), status_code
+
+
+    def get_cache_control(self, request):
+        """``Cache-Control`` directives of a successful persisted GET."""
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return {'private': True, 'no_cache': True}
+        return {'public': True, 'max_age': get_persisted_query_settings()['GET_MAX_AGE']}
+
+
+def add_extension(request, key, value):
+    """Add a top-level ``extensions`` entry to the response of ``request``."""
+    extensions = getattr(request, '_graphql_extensions', None)
+    if extensions is None:
+        extensions = request._graphql_extensions = {}
+    extensions[key] = value
@@ -0,0 +1,200 @@
+"""
+N+1 query detection for GraphQL operations
+
+An opt-in instrumentation mode (``N_PLUS_ONE['ENABLED']``, meant for tests and
+staging) that records every SQL statement run while an operation executes,
+groups the statements by normalized shape (literals, parameters and ``IN``
+lists collapsed) and flags the shapes repeated at least ``THRESHOLD`` times:
+the signature of a resolver querying once per row.
+
+Instrumentation is applied by the schema itself (``InstrumentedSchema``), so no
+resolver is involved. The report is returned under ``extensions.nPlusOne`` and
+flagged shapes are logged with the GraphQL field that was resolving when they
+ran. ``social_media_backend.graphql_testing.assert_query_budget`` builds on it.
+"""
+
+import logging
+import re
+import time
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+
+import graphene
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    # Executions of one statement shape from which it is reported
+    'THRESHOLD': 5,
+    # Statements kept per shape in the report
+    'EXAMPLES': 1,
+}
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'(?<![\w"])-?\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN\s*\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)', re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+
+
+def get_n_plus_one_settings():
+    return {**DEFAULTS, **getattr(settings, 'N_PLUS_ONE', {})}
+
+
+def normalize_sql(sql):
+    """Shape of a statement: literals become ``?`` and ``IN`` lists ``IN (...)``."""
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+class StatementShape:
+    """
+    Executions of one normalized statement.
+    """
+
+    __slots__ = ('sql', 'count', 'duration', 'fields', 'statements', 'examples')
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.count = 0
+        self.duration = 0.0
+        self.fields = OrderedDict()
+        # Distinct (statement, parameters), to tell cache misses from N+1
+        self.statements = set()
+        self.examples = []
+
+
+class QueryRecorder:
+    """
+    Records the statements run through the default connection, grouped by
+    shape, and the GraphQL field being resolved when each of them ran.
+    """
+
+    def __init__(self, threshold=5, examples=1):
+        self.threshold = threshold
+        self.max_examples = examples
+        self.shapes = OrderedDict()
+        self.total = 0
+        self.current_field = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self._record(sql, params, time.perf_counter() - start)
+
+    def _record(self, sql, params, duration):
+        shape_sql = normalize_sql(sql)
+        shape = self.shapes.get(shape_sql)
+        if shape is None:
+            shape = self.shapes[shape_sql] = StatementShape(shape_sql)
+        shape.count += 1
+        shape.duration += duration
+        self.total += 1
+        if self.current_field is not None:
+            shape.fields[self.current_field] = shape.fields.get(self.current_field, 0) + 1
+        shape.statements.add((sql, repr(params)))
+        if len(shape.examples) < self.max_examples:
+            shape.examples.append(f'{sql} -- {params!r}' if params else sql)
+
+    def resolve(self, next, root, info, **args):
+        """GraphQL middleware tracking the field being resolved."""
+        self.current_field = f'{info.parent_type.name}.{info.field_name}'
+        return next(root, info, **args)
+
+    @contextmanager
+    def capture(self):
+        with connection.execute_wrapper(self):
+            yield self
+
+    def repeated(self):
+        return [shape for shape in self.shapes.values() if shape.count >= self.threshold]
+
+    def report(self):
+        return {
+            'queries': self.total,
+            'threshold': self.threshold,
+            'repeated': [
+                {
+                    'sql': shape.sql,
+                    'count': shape.count,
+                    'distinct': len(shape.statements),
+                    'duration': round(shape.duration * 1000, 3),
+                    'fields': list(shape.fields),
+                    'examples': shape.examples,
+                }
+                for shape in sorted(self.repeated(), key=lambda shape: -shape.count)
+            ],
+        }
+
+
+def _with_middleware(middleware, recorder):
+    # Innermost, so that the current field is set right before each resolver
+    if middleware is None:
+        return [recorder]
+    if isinstance(middleware, (list, tuple)):
+        return [*middleware, recorder]
+    # A MiddlewareManager cannot be extended: queries are not attributed
+    return middleware
+
+
+@contextmanager
+def detect_n_plus_one(threshold=None, force=False):
+    """
+    Record the statements of the enclosed execution when detection is enabled
+    (or ``force``), yielding the ``QueryRecorder`` or ``None``.
+    """
+    config = get_n_plus_one_settings()
+    if not (force or config['ENABLED']):
+        yield None
+        return
+    recorder = QueryRecorder(
+        threshold=threshold or config['THRESHOLD'],
+        examples=config['EXAMPLES'],
+    )
+    with recorder.capture():
+        yield recorder
+    for shape in recorder.repeated():
+        logger.warning(
+            'Possible N+1: %d executions of "%s" while resolving %s',
+            shape.count, shape.sql, ', '.join(shape.fields) or 'unknown fields'
+        )
+
+
+class InstrumentedSchema(graphene.Schema):
+    """
+    Schema running operations under the N+1 detector when it is enabled.
+    """
+
+    @contextmanager
+    def instrument(self, execute_options):
+        """
+        Detect N+1 queries in the execution using ``execute_options`` (the
+        keyword arguments of ``execute``), adding the detector middleware.
+        Yields the recorder, or ``None`` when detection is disabled.
+        """
+        with detect_n_plus_one() as recorder:
+            if recorder is not None:
+                execute_options['middleware'] = _with_middleware(
+                    execute_options.get('middleware'), recorder
+                )
+            yield recorder
+
+    def execute(self, *args, **kwargs):
+        with self.instrument(kwargs) as recorder:
+            result = super().execute(*args, **kwargs)
+        if recorder is not None:
+            result.extensions = {**(result.extensions or {}), 'nPlusOne': recorder.report()}
+        return result
+
+
+def instrument_execution(schema, execute_options):
+    """``schema.instrument`` for instrumented schemas, a no-op otherwise."""
+    if isinstance(schema, InstrumentedSchema):
+        return schema.instrument(execute_options)
+    return nullcontext()
@@ -0,0 +1,292 @@
+"""
+Read-through cache of hot model rows
+
+``User`` and ``Post`` rows are read far more often than they change, so their
+lookups by primary key go through two tiers: a bounded LRU per process
+(``LOCAL_SIZE`` rows per model, trusted for ``LOCAL_TIMEOUT`` seconds) in front
+of the shared Django cache (``TIMEOUT`` seconds), then the database. The
+request DataLoaders (``social_media_backend.dataloaders``) and the single-row
+resolvers use it through ``get_object`` / ``get_objects`` / ``get_object_by``.
+
+Every row has a version in the shared cache, and its entries are keyed by that
+version. Saving or deleting a row bumps the version once the transaction
+commits, and so do the counter updates of ``social_media_backend.counters``:
+an entry computed from a row read before the change is stored under the old
+version and is never read again, even if it is written after the bump. Other
+processes may serve their local copy for up to ``LOCAL_TIMEOUT`` seconds.
+Columns updated in bulk by periodic jobs (view counts, engagement scores,
+counter reconciliation) are refreshed when entries expire.
+
+Columns listed in ``EXCLUDED_FIELDS`` (the password hash of users) are never
+stored: cached instances have them deferred, and reading one loads it from
+the database.
+"""
+
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from .metrics import REGISTRY
+
+DEFAULTS = {
+    'ENABLED': True,
+    'CACHE': 'default',
+    # Cached models, as 'app_label.ModelName'
+    'MODELS': ('users.User', 'posts.Post'),
+    # Seconds rows are kept in the shared cache
+    'TIMEOUT': 300,
+    # Rows kept per model and process, and seconds they are trusted
+    'LOCAL_SIZE': 1000,
+    'LOCAL_TIMEOUT': 5,
+    # Columns never stored in the cache, by model
+    'EXCLUDED_FIELDS': {'users.User': ('password',)},
+}
+
+CACHE_PREFIX = 'obj'
+
+OBJECT_CACHE_LOOKUPS = REGISTRY.counter(
+    'object_cache_lookups_total', 'Object cache lookups by tier (local, shared or database).',
+    ('model', 'tier')
+)
+
+
+def get_object_cache_settings():
+    return {**DEFAULTS, **getattr(settings, 'OBJECT_CACHE', {})}
+
+
+def _initial_version():
+    # Never restart from a version that may still key live entries
+    return int(time.time() * 1000)
+
+
+class LocalCache:
+    """
+    Thread-safe LRU of ``pk -> (version, data, expires)``.
+
+    Invalidations leave a tombstone with the new version, so a reader that
+    fetched the row before the invalidation cannot store it afterwards.
+    """
+
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, pk):
+        with self._lock:
+            entry = self._entries.get(pk)
+            if entry is None or entry[1] is None:
+                return None
+            if entry[2] < time.monotonic():
+                del self._entries[pk]
+                return None
+            self._entries.move_to_end(pk)
+            return entry[1]
+
+    def set(self, pk, version, data):
+        with self._lock:
+            current = self._entries.get(pk)
+            if current is not None and current[0] > version:
+                return
+            self._entries[pk] = (version, data, time.monotonic() + self.timeout)
+            self._entries.move_to_end(pk)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, pk, version):
+        self.set(pk, version, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ObjectCache:
+    """
+    Two-tier cache of the rows of one model, keyed by primary key.
+    """
+
+    def __init__(self, model, config):
+        self.model = model
+        self.label = model._meta.label
+        self.config = config
+        self.cache = caches[config['CACHE']]
+        self.local = LocalCache(config['LOCAL_SIZE'], config['LOCAL_TIMEOUT'])
+        self._pk_field = model._meta.pk
+        self.excluded = [
+            model._meta.get_field(name).attname
+            for name in config['EXCLUDED_FIELDS'].get(self.label, ())
+        ]
+
+    def _version_key(self, pk):
+        return f'{CACHE_PREFIX}:{self.label}:{pk}'
+
+    def _key(self, pk, version):
+        return f'{CACHE_PREFIX}:{self.label}:{pk}:{version}'
+
+    def _alias_key(self, field, value):
+        return f'{CACHE_PREFIX}:{self.label}:{field}:{value}'
+
+    def _versions(self, pks):
+        keys = {self._version_key(pk): pk for pk in pks}
+        versions = self.cache.get_many(list(keys))
+        missing = [key for key in keys if key not in versions]
+        if missing:
+            for key in missing:
+                self.cache.add(key, _initial_version(), timeout=None)
+            versions.update(self.cache.get_many(missing))
+        return {pk: versions.get(key) for key, pk in keys.items()}
+
+    def fetch(self, pks):
+        return self.model._default_manager.defer(*self.excluded).in_bulk(list(pks))
+
+    def _dumps(self, obj):
+        # Also when ``fetch`` loaded them: a column missing from __dict__ is deferred
+        for attname in self.excluded:
+            obj.__dict__.pop(attname, None)
+        return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+    def get_many(self, pks, fetch=None):
+        """
+        ``{pk: instance}`` of the rows of ``pks`` that exist, read from the
+        local tier, then the shared cache, then ``fetch(pks)`` (``in_bulk``
+        by default). Every call returns fresh instances.
+        """
+        pks = {self._pk_field.to_python(pk) for pk in pks if pk is not None}
+        found = {}
+        missing = []
+        for pk in pks:
+            data = self.local.get(pk)
+            if data is None:
+                missing.append(pk)
+            else:
+                found[pk] = data
+        OBJECT_CACHE_LOOKUPS.inc(len(found), model=self.label, tier='local')
+        if missing:
+            versions = self._versions(missing)
+            keys = {self._key(pk, version): pk for pk, version in versions.items()}
+            shared = self.cache.get_many(list(keys))
+            for key, data in shared.items():
+                pk = keys[key]
+                found[pk] = data
+                self.local.set(pk, versions[pk], data)
+            OBJECT_CACHE_LOOKUPS.inc(len(shared), model=self.label, tier='shared')
+            missing = [pk for pk in missing if pk not in found]
+            if missing:
+                fetched = (fetch or self.fetch)(missing)
+                OBJECT_CACHE_LOOKUPS.inc(len(missing), model=self.label, tier='database')
+                entries = {}
+                for pk, obj in fetched.items():
+                    data = found[pk] = self._dumps(obj)
+                    entries[self._key(pk, versions[pk])] = data
+                    self.local.set(pk, versions[pk], data)
+                self.cache.set_many(entries, self.config['TIMEOUT'])
+        return {pk: pickle.loads(data) for pk, data in found.items()}
+
+    def get(self, pk):
+        if pk is None:
+            return None
+        return self.get_many([pk]).get(self._pk_field.to_python(pk))
+
+    def get_by(self, field, value):
+        """
+        Row whose unique ``field`` equals ``value``. The pk is remembered in
+        the shared cache and the row is checked against ``value``, so renamed
+        rows are looked up again.
+        """
+        alias = self._alias_key(field, value)
+        pk = self.cache.get(alias)
+        if pk is not None:
+            obj = self.get(pk)
+            if obj is not None and getattr(obj, field) == value:
+                return obj
+        obj = self.model._default_manager.filter(**{field: value}).first()
+        if obj is not None:
+            self.cache.set(alias, obj.pk, self.config['TIMEOUT'])
+        return obj
+
+    def invalidate_many(self, pks):
+        """Bump the versions of ``pks``, orphaning their cached entries."""
+        for pk in pks:
+            key = self._version_key(pk)
+            try:
+                version = self.cache.incr(key)
+            except ValueError:
+                version = _initial_version()
+                if not self.cache.add(key, version, timeout=None):
+                    version = self.cache.incr(key)
+            self.local.invalidate(pk, version)
+
+    def invalidate(self, pk):
+        self.invalidate_many([pk])
+
+
+_object_caches = {}
+
+
+def get_object_cache(model):
+    """Process-wide ``ObjectCache`` of ``model``, ``None`` if it is not cached."""
+    config = get_object_cache_settings()
+    if not config['ENABLED'] or model._meta.label not in config['MODELS']:
+        return None
+    object_cache = _object_caches.get(model)
+    if object_cache is None:
+        object_cache = _object_caches[model] = ObjectCache(model, config)
+    return object_cache
+
+
+def get_objects(model, pks, fetch=None):
+    """``{pk: instance}`` of ``pks``, through the object cache when enabled."""
+    object_cache = get_object_cache(model)
+    if object_cache is not None:
+        return object_cache.get_many(pks, fetch)
+    if fetch is not None:
+        return fetch(pks)
+    return model._default_manager.in_bulk(list(pks))
+
+
+def get_object(model, pk):
+    """Row ``pk`` of ``model`` or ``None``, through the object cache when enabled."""
+    object_cache = get_object_cache(model)
+    if object_cache is not None:
+        return object_cache.get(pk)
+    return model._default_manager.filter(pk=pk).first()
+
+
+def get_object_by(model, field, value):
+    """Row of ``model`` whose unique ``field`` is ``value``, or ``None``."""
+    object_cache = get_object_cache(model)
+    if object_cache is not None:
+        return object_cache.get_by(field, value)
+    return model._default_manager.filter(**{field: value}).first()
+
+
+def invalidate_objects(model, pks):
+    """Invalidate cached rows of ``model`` once the current transaction commits."""
+    object_cache = get_object_cache(model)
+    if object_cache is not None:
+        pks = list(pks)
+        transaction.on_commit(lambda: object_cache.invalidate_many(pks))
+
+
+def _invalidate_instance(sender, instance, **kwargs):
+    invalidate_objects(sender, [instance.pk])
+
+
+def connect_signals():
+    """Invalidate the rows of the cached models on their saves and deletes."""
+    for label in get_object_cache_settings()['MODELS']:
+        model = apps.get_model(label)
+        post_save.connect(_invalidate_instance, sender=model, dispatch_uid=f'object_cache_save_{label}')
+        post_delete.connect(_invalidate_instance, sender=model, dispatch_uid=f'object_cache_delete_{label}')
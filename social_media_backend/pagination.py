@@ -0,0 +1,195 @@
+"""
+Keyset (cursor) pagination for GraphQL list fields
+
+Offset slicing (``queryset[skip:skip + first]``) makes deep pages O(offset) and
+returns duplicates or skips rows when new items arrive between two requests.
+Connections page on ``(created_at, id)`` instead: the opaque cursor of an edge
+encodes both values and the next page is a range scan starting right after
+it, served by the ``(author, -created_at)`` / ``(recipient, -created_at)``
+style indexes.
+"""
+
+import base64
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import graphene
+from django.db.models import Q
+from graphql import GraphQLError
+from graphql_relay import cursor_to_offset, offset_to_cursor
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+OFFSET_DEPRECATION = "Offset pagination is deprecated, use the matching *Connection field with `after` cursors"
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+_ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+def encode_cursor(created_at, pk):
+    """Opaque cursor for the row ``(created_at, pk)``."""
+    micros = (created_at - _EPOCH) // _ONE_MICROSECOND
+    return base64.urlsafe_b64encode(f'{micros}:{pk}'.encode()).decode()
+
+
+def encode_timestamp_cursor(timestamp, pk):
+    """Cursor for an entry whose sort key is a POSIX timestamp (timelines)."""
+    return encode_cursor(_EPOCH + timedelta(microseconds=round(timestamp * 1_000_000)), pk)
+
+
+def decode_cursor(cursor):
+    """Return ``(created_at, pk)`` or raise a GraphQLError for invalid input."""
+    try:
+        # validate: characters outside the alphabet are an error, not skipped
+        decoded = base64.b64decode(cursor.encode(), altchars=b'-_', validate=True)
+        micros, pk = decoded.decode().split(':')
+        return _EPOCH + timedelta(microseconds=int(micros)), int(pk)
+    except (ValueError, UnicodeError, OverflowError):
+        raise GraphQLError(
+            message=f"Invalid cursor: {cursor}",
+            extensions={'code': 'INVALID_CURSOR'}
+        )
+
+
+def page_size(first):
+    if first is None:
+        return DEFAULT_PAGE_SIZE
+    if first < 0:
+        raise GraphQLError(
+            message="`first` must be a positive integer",
+            extensions={'code': 'VALIDATION_ERROR'}
+        )
+    return min(first, MAX_PAGE_SIZE)
+
+
+def keyset_filter(queryset, after, descending=True, field='created_at', prefix=''):
+    """
+    Order ``queryset`` on ``(field, id)`` and keep the rows after the cursor.
+    """
+    created, pk = f'{prefix}{field}', f'{prefix}id'
+    if descending:
+        queryset = queryset.order_by(f'-{created}', f'-{pk}')
+    else:
+        queryset = queryset.order_by(created, pk)
+    if after:
+        created_at, last_pk = decode_cursor(after)
+        op = 'lt' if descending else 'gt'
+        queryset = queryset.filter(
+            Q(**{f'{created}__{op}': created_at}) |
+            Q(**{created: created_at, f'{pk}__{op}': last_pk})
+        )
+    return queryset
+
+
+def connection_from_queryset(connection_type, queryset, first=None, after=None,
+                             descending=True, node=None, cursor_source=None):
+    """
+    Build a Relay connection for one keyset page of ``queryset``.
+
+    ``node`` maps a row to the edge node (e.g. a Follow row to the follower)
+    and ``cursor_source`` to the object carrying ``created_at``/``id`` when it
+    is not the row itself.
+    """
+    size = page_size(first)
+    rows = list(keyset_filter(queryset, after, descending)[:size + 1])
+    has_next_page = len(rows) > size
+    rows = rows[:size]
+
+    edges = []
+    for row in rows:
+        source = cursor_source(row) if cursor_source else row
+        edges.append(connection_type.Edge(
+            node=node(row) if node else row,
+            cursor=encode_cursor(source.created_at, source.pk),
+        ))
+    return connection_type(
+        edges=edges,
+        page_info=graphene.relay.PageInfo(
+            has_next_page=has_next_page,
+            has_previous_page=after is not None,
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+        ),
+    )
+
+
+def connection_from_ranked_ids(connection_type, fetch_ids, load_nodes, first=None, after=None):
+    """
+    Build a Relay connection over a ranked result list (e.g. search hits)
+    that has no stable sort key and is paged by offset behind opaque cursors.
+
+    ``fetch_ids(offset, limit)`` returns the ranked ids of one page and
+    ``load_nodes(ids)`` the matching objects as ``{id: node}``.
+    """
+    size = page_size(first)
+    offset = 0
+    if after:
+        after_offset = cursor_to_offset(after)
+        if after_offset is None:
+            raise GraphQLError(
+                message=f"Invalid cursor: {after}",
+                extensions={'code': 'INVALID_CURSOR'}
+            )
+        offset = after_offset + 1
+    ids = fetch_ids(offset, size + 1)
+    has_next_page = len(ids) > size
+    ids = ids[:size]
+    nodes = load_nodes(ids)
+
+    edges = [
+        connection_type.Edge(node=nodes[pk], cursor=offset_to_cursor(offset + position))
+        for position, pk in enumerate(ids)
+        if pk in nodes
+    ]
+    return connection_type(
+        edges=edges,
+        page_info=graphene.relay.PageInfo(
+            has_next_page=has_next_page,
+            has_previous_page=offset > 0,
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+        ),
+    )
+
+
+def connection_node_selection(info):
+    """
+    Field nodes of ``edges { node { ... } }`` in the current selection, so the
+    query planner can optimize the rows behind a connection.
+    """
+    nodes = []
+    for field_node in info.field_nodes:
+        for edges in _subfields(info, field_node, 'edges'):
+            nodes.extend(_subfields(info, edges, 'node'))
+    return nodes
+
+
+def _subfields(info, node, name):
+    from graphql.language import FieldNode, FragmentSpreadNode, InlineFragmentNode
+
+    found = []
+    pending = [node.selection_set] if node.selection_set else []
+    while pending:
+        selection_set = pending.pop()
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                if selection.name.value == name:
+                    found.append(selection)
+            elif isinstance(selection, InlineFragmentNode):
+                pending.append(selection.selection_set)
+            elif isinstance(selection, FragmentSpreadNode):
+                fragment = info.fragments.get(selection.name.value)
+                if fragment is not None:
+                    pending.append(fragment.selection_set)
+    return found
+
+
+def optimize_connection_queryset(queryset, info, connection_type):
+    """Run the query planner on the ``node`` selection of a connection."""
+    from .query_planner import optimize_for_type
+
+    node_type = info.schema.get_type(connection_type._meta.node._meta.name)
+    return optimize_for_type(
+        queryset, info, node_type, connection_node_selection(info),
+        extra_fields=('created_at',)
+    )
@@ -0,0 +1,181 @@
+"""
+Persisted queries and parsed document cache for ``/graphql/``
+
+Automatic persisted queries follow the Apollo protocol: a client sends
+``extensions.persistedQuery.sha256Hash`` instead of the query text. An unknown
+hash is answered with ``PERSISTED_QUERY_NOT_FOUND`` and the client retries with
+the text, which is stored in the Django cache under its hash for every worker.
+Persisted queries can be sent with GET (``?extensions=...&variables=...``) so
+that responses are cacheable over HTTP.
+
+With ``PERSISTED_QUERIES['ALLOW_LIST']`` only the operations of the
+``MANIFEST`` file (``{"<sha256>": "<query>"}``, generated with the clients) are
+executed, whether they are sent by hash or in full, and nothing is registered.
+
+Independently, parsed ``DocumentNode``s are kept in a process-wide LRU keyed by
+query text, along with whether they passed validation, so repeated operations
+skip both parsing and validation.
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.http.response import HttpResponseBadRequest
+from graphene_django.views import HttpError
+from graphql import GraphQLError
+
+from .metrics import REGISTRY
+
+DEFAULTS = {
+    'ENABLED': True,
+    'CACHE': 'default',
+    # Registered queries expire after this many seconds (None: never)
+    'TIMEOUT': 7 * 24 * 3600,
+    # Only execute the queries of MANIFEST
+    'ALLOW_LIST': False,
+    'MANIFEST': None,
+    # Parsed documents kept per process
+    'DOCUMENT_CACHE_SIZE': 500,
+    # Cache-Control max-age of anonymous persisted GET responses
+    'GET_MAX_AGE': 60,
+}
+
+CACHE_PREFIX = 'apq'
+
+DOCUMENT_CACHE_LOOKUPS = REGISTRY.counter(
+    'graphql_document_cache_lookups_total', 'Parsed document cache lookups.', ('result',)
+)
+
+_manifests = {}
+
+
+def get_persisted_query_settings():
+    return {**DEFAULTS, **getattr(settings, 'PERSISTED_QUERIES', {})}
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+def load_manifest(path):
+    """``{sha256: query}`` of an allow-list manifest, read once per process."""
+    manifest = _manifests.get(path)
+    if manifest is None:
+        with open(path, encoding='utf-8') as manifest_file:
+            manifest = _manifests[path] = json.load(manifest_file)
+    return manifest
+
+
+def _error(code, message):
+    return GraphQLError(message=message, extensions={'code': code})
+
+
+def _request_extensions(request, data):
+    extensions = request.GET.get('extensions') or data.get('extensions')
+    if isinstance(extensions, str):
+        try:
+            extensions = json.loads(extensions)
+        except ValueError:
+            raise HttpError(HttpResponseBadRequest('Extensions are invalid JSON.'))
+    return extensions if isinstance(extensions, dict) else {}
+
+
+def requested_hash(request, data):
+    persisted = _request_extensions(request, data).get('persistedQuery')
+    if not isinstance(persisted, dict):
+        return None
+    if persisted.get('version', 1) != 1:
+        raise _error('PERSISTED_QUERY_NOT_SUPPORTED', 'Unsupported persisted query version')
+    return persisted.get('sha256Hash')
+
+
+def resolve_query(request, data, query):
+    """
+    Query text of the request, resolving and registering persisted queries.
+    Returns ``(query, persisted)`` and raises ``GraphQLError`` when the query
+    cannot be resolved or is not allowed.
+    """
+    config = get_persisted_query_settings()
+    if not config['ENABLED']:
+        return query, False
+    sha256 = requested_hash(request, data)
+    if config['ALLOW_LIST']:
+        if not config['MANIFEST']:
+            raise ImproperlyConfigured("PERSISTED_QUERIES['ALLOW_LIST'] requires a MANIFEST")
+        manifest = load_manifest(config['MANIFEST'])
+        if query:
+            sha256 = query_hash(query)
+        if sha256 not in manifest:
+            raise _error('PERSISTED_QUERY_NOT_ALLOWED', 'Only persisted queries are allowed')
+        return manifest[sha256], True
+    if sha256 is None:
+        return query, False
+    cache = caches[config['CACHE']]
+    if query:
+        if query_hash(query) != sha256:
+            raise _error('PERSISTED_QUERY_HASH_MISMATCH', 'Provided sha256Hash does not match query')
+        cache.set(f'{CACHE_PREFIX}:{sha256}', query, config['TIMEOUT'])
+        return query, True
+    query = cache.get(f'{CACHE_PREFIX}:{sha256}')
+    if query is None:
+        raise _error('PERSISTED_QUERY_NOT_FOUND', 'PersistedQueryNotFound')
+    return query, True
+
+
+class CachedDocument:
+    __slots__ = ('document', 'valid')
+
+    def __init__(self, document):
+        self.document = document
+        self.valid = False
+
+
+class DocumentCache:
+    """
+    Thread-safe LRU of parsed documents keyed by query text.
+    """
+
+    def __init__(self, maxsize=500):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, query):
+        with self._lock:
+            entry = self._entries.get(query)
+            if entry is not None:
+                self._entries.move_to_end(query)
+        DOCUMENT_CACHE_LOOKUPS.inc(result='miss' if entry is None else 'hit')
+        return entry
+
+    def add(self, query, document):
+        entry = CachedDocument(document)
+        with self._lock:
+            self._entries[query] = entry
+            self._entries.move_to_end(query)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_document_cache = None
+
+
+def get_document_cache():
+    """Return the process-wide parsed document cache."""
+    global _document_cache
+    if _document_cache is None:
+        _document_cache = DocumentCache(get_persisted_query_settings()['DOCUMENT_CACHE_SIZE'])
+    return _document_cache
@@ -0,0 +1,235 @@
+"""
+Publish/subscribe of real-time events
+
+Mutations and tasks publish events (``publish`` / ``publish_on_commit``) on
+per-user channels, and GraphQL subscriptions (``social_media_backend.
+subscriptions``) consume them. The transport is pluggable through
+``settings.SUBSCRIPTIONS['BACKEND']``:
+
+- ``RedisPubSub``: Redis ``PUBLISH``, so events reach the websockets held by
+  every ASGI process. Each process keeps a single Redis subscription, shared
+  by all its websockets.
+- ``InMemoryPubSub``: process-local, for tests and single-process setups.
+
+Events are delivered at most once. Each subscriber buffers up to
+``QUEUE_SIZE`` events; events for a subscriber that falls further behind are
+dropped and counted.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BACKEND': 'social_media_backend.pubsub.InMemoryPubSub',
+    'REDIS_URL': None,
+    # Events buffered per subscriber before new ones are dropped
+    'QUEUE_SIZE': 100,
+}
+
+EVENTS_PUBLISHED = REGISTRY.counter(
+    'pubsub_events_published_total', 'Events published, by event.', ('event',)
+)
+EVENTS_DROPPED = REGISTRY.counter(
+    'pubsub_events_dropped_total', 'Events dropped because a subscriber queue was full.'
+)
+
+
+def get_pubsub_settings():
+    return {**DEFAULTS, **getattr(settings, 'SUBSCRIPTIONS', {})}
+
+
+def notifications_channel(user_id):
+    return f'notifications:{user_id}'
+
+
+def feed_channel(user_id):
+    return f'feed:{user_id}'
+
+
+def author_channel(user_id):
+    """New posts of a celebrity author, whose posts are not fanned out."""
+    return f'author:{user_id}'
+
+
+class Subscriber:
+    """
+    Bounded event queue of one subscription, fed from any thread.
+    """
+
+    def __init__(self, loop, maxsize):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+
+    def _put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            EVENTS_DROPPED.inc()
+
+    def deliver(self, message):
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # The loop of a closed connection
+            pass
+
+
+class InMemoryPubSub:
+    """
+    Process-local pub/sub.
+    """
+
+    def __init__(self, queue_size=100, **options):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def publish_many(self, channels, message):
+        """Deliver ``message`` to the subscribers of every channel."""
+        self._deliver(channels, message)
+
+    def publish(self, channel, message):
+        self.publish_many([channel], message)
+
+    def _deliver(self, channels, message):
+        with self._lock:
+            targets = [
+                subscriber for channel in channels
+                for subscriber in self._subscribers.get(channel, ())
+            ]
+        for subscriber in targets:
+            subscriber.deliver(message)
+
+    def _add(self, channels, subscriber):
+        with self._lock:
+            for channel in channels:
+                self._subscribers[channel].add(subscriber)
+
+    def _remove(self, channels, subscriber):
+        """Unregister ``subscriber``, returning the channels left without subscribers."""
+        emptied = []
+        with self._lock:
+            for channel in channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[channel]
+                    emptied.append(channel)
+        return emptied
+
+    async def subscribe(self, channels):
+        """Async iterator of the messages published on ``channels``."""
+        channels = list(channels)
+        subscriber = Subscriber(asyncio.get_running_loop(), self.queue_size)
+        self._add(channels, subscriber)
+        try:
+            await self._listen(channels)
+            while True:
+                yield await subscriber.queue.get()
+        finally:
+            await self._unlisten(self._remove(channels, subscriber))
+
+    async def _listen(self, channels):
+        pass
+
+    async def _unlisten(self, channels):
+        pass
+
+
+class RedisPubSub(InMemoryPubSub):
+    """
+    Pub/sub over Redis channels, dispatched locally to the subscribers of the
+    process.
+    """
+
+    def __init__(self, redis_url=None, queue_size=100, **options):
+        super().__init__(queue_size)
+        import redis
+
+        self.redis_url = redis_url or settings.REDIS_URL
+        self.client = redis.Redis.from_url(self.redis_url)
+        self._pubsub = None
+        self._reader = None
+
+    def publish_many(self, channels, message):
+        data = json.dumps(message)
+        pipe = self.client.pipeline(transaction=False)
+        for channel in channels:
+            pipe.publish(channel, data)
+        pipe.execute()
+
+    async def _listen(self, channels):
+        if self._pubsub is None:
+            import redis.asyncio
+
+            self._pubsub = redis.asyncio.Redis.from_url(self.redis_url).pubsub()
+        await self._pubsub.subscribe(*channels)
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.get_running_loop().create_task(self._read())
+
+    async def _unlisten(self, channels):
+        if channels and self._pubsub is not None:
+            await self._pubsub.unsubscribe(*channels)
+
+    async def _read(self):
+        while True:
+            try:
+                raw = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except Exception:
+                logger.exception('Redis pub/sub connection failed')
+                await asyncio.sleep(1)
+                continue
+            if raw is None or raw['type'] != 'message':
+                continue
+            channel = raw['channel']
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            self._deliver([channel], json.loads(raw['data']))
+
+
+_backend = None
+
+
+def get_pubsub():
+    """Return the configured pub/sub backend (one instance per process)."""
+    global _backend
+    if _backend is None:
+        config = get_pubsub_settings()
+        backend_class = import_string(config['BACKEND'])
+        _backend = backend_class(redis_url=config['REDIS_URL'], queue_size=config['QUEUE_SIZE'])
+    return _backend
+
+
+def publish(channels, event, payload):
+    """Publish ``event`` with ``payload`` on ``channels``."""
+    channels = list(channels)
+    if not channels:
+        return
+    message = {'event': event, 'payload': payload, 'published_at': time.time()}
+    try:
+        get_pubsub().publish_many(channels, message)
+    except Exception:
+        # Real-time delivery is best effort: never fail the write path
+        logger.exception('Failed to publish %s', event)
+        return
+    EVENTS_PUBLISHED.inc(len(channels), event=event)
+
+
+def publish_on_commit(channels, event, payload):
+    """``publish`` once the current transaction commits."""
+    channels = list(channels)
+    transaction.on_commit(lambda: publish(channels, event, payload))
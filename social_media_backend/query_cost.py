@@ -0,0 +1,196 @@
+"""
+Static cost analysis of GraphQL operations
+
+``NexusGraphQLView`` analyzes every validated operation before executing it
+and rejects the operations exceeding ``QUERY_COST['MAX_DEPTH']``,
+``['MAX_COST']`` or ``['MAX_ALIASES']``, so pathological nesting of reverse
+relations never reaches the database.
+
+The cost of a selection is the sum of its fields. A composite field costs
+``OBJECT_COST`` plus its own selection, a leaf ``LEAF_COST`` (both overridable
+per ``Type.field`` in ``FIELD_COSTS``), times the number of items it may
+return: its ``first``/``last``/``limit`` argument, its ``LIST_SIZES`` entry or
+``DEFAULT_LIST_SIZE`` for lists and connections, 1 otherwise. The edges of a
+connection are counted by the connection field. Introspection fields are not
+counted. The result is returned under ``extensions.cost``.
+"""
+
+from django.conf import settings
+from graphql import (
+    FieldNode,
+    FragmentSpreadNode,
+    GraphQLError,
+    InlineFragmentNode,
+    IntValueNode,
+    OperationType,
+    VariableNode,
+    get_named_type,
+    get_nullable_type,
+    is_leaf_type,
+    is_list_type,
+)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MAX_DEPTH': 10,
+    'MAX_COST': 10000,
+    'MAX_ALIASES': 30,
+    # Assumed size of lists and connections without a size argument
+    'DEFAULT_LIST_SIZE': 20,
+    'OBJECT_COST': 1,
+    'LEAF_COST': 0,
+    # Cost of specific fields, e.g. {'Query.searchPosts': 10}
+    'FIELD_COSTS': {},
+    # Assumed size of specific unbounded lists, e.g. {'Query.allUsers': 500}
+    'LIST_SIZES': {},
+}
+
+SIZE_ARGUMENTS = ('first', 'last', 'limit')
+
+
+def get_query_cost_settings():
+    return {**DEFAULTS, **getattr(settings, 'QUERY_COST', {})}
+
+
+def _is_connection(graphql_type):
+    fields = getattr(graphql_type, 'fields', None) or {}
+    return 'edges' in fields and 'pageInfo' in fields
+
+
+class QueryCost:
+    """
+    Cost, depth and alias count of one operation.
+    """
+
+    def __init__(self, cost, depth, aliases, config):
+        self.cost = cost
+        self.depth = depth
+        self.aliases = aliases
+        self.config = config
+
+    def as_extension(self):
+        return {
+            'requested': self.cost,
+            'maximum': self.config['MAX_COST'],
+            'depth': self.depth,
+            'aliases': self.aliases,
+        }
+
+    def limit_errors(self):
+        checks = (
+            ('QUERY_TOO_DEEP', 'depth', self.depth, self.config['MAX_DEPTH']),
+            ('QUERY_TOO_COMPLEX', 'cost', self.cost, self.config['MAX_COST']),
+            ('TOO_MANY_ALIASES', 'aliases', self.aliases, self.config['MAX_ALIASES']),
+        )
+        return [
+            GraphQLError(
+                message=f'Query {name} {value} exceeds the maximum of {maximum}',
+                extensions={'code': code, name: value, 'maximum': maximum}
+            )
+            for code, name, value, maximum in checks
+            if maximum is not None and value > maximum
+        ]
+
+
+class CostAnalyzer:
+    """
+    Walks an operation along the schema types, through fragments.
+    """
+
+    def __init__(self, schema, fragments, variables, variable_defaults, config):
+        self.schema = schema
+        self.fragments = fragments
+        self.variables = variables if isinstance(variables, dict) else {}
+        self.variable_defaults = variable_defaults
+        self.config = config
+        self.depth = 0
+        self.aliases = 0
+
+    def analyze(self, operation):
+        root_type = {
+            OperationType.QUERY: self.schema.query_type,
+            OperationType.MUTATION: self.schema.mutation_type,
+            OperationType.SUBSCRIPTION: self.schema.subscription_type,
+        }[operation.operation]
+        cost = self._selection_set_cost(root_type, operation.selection_set, 1)
+        return QueryCost(cost, self.depth, self.aliases, self.config)
+
+    def _argument_value(self, node):
+        if isinstance(node, IntValueNode):
+            return int(node.value)
+        if isinstance(node, VariableNode):
+            name = node.name.value
+            value = self.variables.get(name, self.variable_defaults.get(name))
+            return value if isinstance(value, int) else None
+        return None
+
+    def _list_size(self, field_node, field_key, field_type):
+        for argument in field_node.arguments:
+            if argument.name.value in SIZE_ARGUMENTS:
+                size = self._argument_value(argument.value)
+                if size is not None:
+                    return max(size, 0)
+        if field_key in self.config['LIST_SIZES']:
+            return self.config['LIST_SIZES'][field_key]
+        if is_list_type(get_nullable_type(field_type)) or _is_connection(get_named_type(field_type)):
+            return self.config['DEFAULT_LIST_SIZE']
+        return 1
+
+    def _selection_set_cost(self, parent_type, selection_set, depth, visited=()):
+        cost = 0
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                cost += self._field_cost(parent_type, selection, depth)
+            elif isinstance(selection, InlineFragmentNode):
+                fragment_type = (
+                    self.schema.get_type(selection.type_condition.name.value)
+                    if selection.type_condition else parent_type
+                )
+                cost += self._selection_set_cost(fragment_type, selection.selection_set, depth, visited)
+            elif isinstance(selection, FragmentSpreadNode):
+                name = selection.name.value
+                fragment = self.fragments.get(name)
+                if fragment is None or name in visited:
+                    continue
+                fragment_type = self.schema.get_type(fragment.type_condition.name.value)
+                cost += self._selection_set_cost(
+                    fragment_type, fragment.selection_set, depth, (*visited, name)
+                )
+        return cost
+
+    def _field_cost(self, parent_type, node, depth):
+        name = node.name.value
+        if name.startswith('__'):
+            return 0
+        field = getattr(parent_type, 'fields', {}).get(name)
+        if field is None:
+            return 0
+        if node.alias is not None:
+            self.aliases += 1
+        self.depth = max(self.depth, depth)
+        field_key = f'{parent_type.name}.{name}'
+        named_type = get_named_type(field.type)
+        if is_leaf_type(named_type):
+            return self.config['FIELD_COSTS'].get(field_key, self.config['LEAF_COST'])
+        if name == 'edges' and _is_connection(parent_type):
+            # Already multiplied by the size of the connection
+            size = 1
+        else:
+            size = self._list_size(node, field_key, field.type)
+        own_cost = self.config['FIELD_COSTS'].get(field_key, self.config['OBJECT_COST'])
+        children = self._selection_set_cost(named_type, node.selection_set, depth + 1) if node.selection_set else 0
+        return size * (own_cost + children)
+
+
+def analyze_operation(schema, operation, fragments, variables=None):
+    """``QueryCost`` of ``operation``, or ``None`` when analysis is disabled."""
+    config = get_query_cost_settings()
+    if not config['ENABLED']:
+        return None
+    variable_defaults = {
+        definition.variable.name.value: int(definition.default_value.value)
+        for definition in operation.variable_definitions or ()
+        if isinstance(definition.default_value, IntValueNode)
+    }
+    analyzer = CostAnalyzer(schema, fragments, variables, variable_defaults, config)
+    return analyzer.analyze(operation)
@@ -0,0 +1,209 @@
+"""
+Selection-set-aware query planner for GraphQL list resolvers
+
+``optimize_queryset`` walks the fields a client selected (``info.field_nodes``,
+fragments included) and rewrites the queryset with ``select_related`` for
+forward relations, ``prefetch_related`` for reverse relations and ``.only()``
+for exactly the columns the selection needs, recursively.
+
+Custom fields that are not model fields declare the columns they read through a
+``query_hints`` mapping on their DjangoObjectType. When a selected field cannot
+be mapped to columns, the planner stops restricting columns for that level
+instead of guessing, so a missing hint costs performance, never correctness.
+"""
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from graphene.utils.str_converters import to_snake_case
+from graphql import get_named_type
+from graphql.language import FieldNode, FragmentSpreadNode, InlineFragmentNode
+
+
+def optimize_queryset(queryset, info, extra_fields=()):
+    """
+    Apply select_related/prefetch_related/only to ``queryset`` for the
+    selection of the field currently being resolved.
+
+    ``extra_fields`` lists model fields the resolver itself needs on top of
+    the selection (for instance ordering keys used to build cursors).
+    """
+    graphql_type = get_named_type(info.return_type)
+    selections = _collect_fields(info, info.field_nodes)
+    plan = _plan(queryset.model, graphql_type, selections, info)
+    plan.columns.update(extra_fields)
+    return plan.apply(queryset)
+
+
+def optimize_for_type(queryset, info, graphql_type, field_nodes, extra_fields=()):
+    """
+    Same as ``optimize_queryset`` for a selection that does not belong to the
+    field being resolved, e.g. the ``node`` of a connection edge.
+    """
+    selections = _collect_fields(info, field_nodes)
+    plan = _plan(queryset.model, get_named_type(graphql_type), selections, info)
+    plan.columns.update(extra_fields)
+    return plan.apply(queryset)
+
+
+class QueryPlan:
+    """
+    Columns, joins and prefetches required by one selection set.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.columns = {model._meta.pk.name}
+        self.restrict_columns = True
+        self.related = {}
+        self.prefetches = {}
+
+    def only_fields(self, prefix=''):
+        if self.restrict_columns:
+            columns = self.columns
+        else:
+            columns = {field.name for field in self.model._meta.concrete_fields}
+        fields = [prefix + name for name in sorted(columns)]
+        for name, plan in self.related.items():
+            fields.extend(plan.only_fields(f'{prefix}{name}__'))
+        return fields
+
+    def select_related_paths(self, prefix=''):
+        paths = []
+        for name, plan in self.related.items():
+            path = prefix + name
+            paths.append(path)
+            paths.extend(plan.select_related_paths(f'{path}__'))
+        return paths
+
+    def apply(self, queryset):
+        select_paths = self.select_related_paths()
+        if select_paths:
+            queryset = queryset.select_related(*select_paths)
+        prefetches = self.collect_prefetches()
+        if prefetches:
+            queryset = queryset.prefetch_related(*prefetches)
+        return queryset.only(*self.only_fields())
+
+    def collect_prefetches(self, prefix=''):
+        lookups = []
+        for accessor, (plan, related_model) in self.prefetches.items():
+            nested_qs = plan.apply(related_model._default_manager.all())
+            lookups.append(Prefetch(prefix + accessor, queryset=nested_qs))
+        for name, plan in self.related.items():
+            lookups.extend(plan.collect_prefetches(f'{prefix}{name}__'))
+        return lookups
+
+
+def _plan(model, graphql_type, selections, info):
+    plan = QueryPlan(model)
+    graphene_type = getattr(graphql_type, 'graphene_type', None)
+    hints = getattr(graphene_type, 'query_hints', {})
+    fields_by_name = _model_fields(model)
+
+    for name, nodes in selections.items():
+        if name.startswith('__'):
+            continue
+        python_name = to_snake_case(name)
+        if python_name in hints:
+            plan.columns.update(_hint_columns(model, hints[python_name]))
+            continue
+
+        field = fields_by_name.get(python_name)
+        if field is None:
+            # Unknown custom field: it may read any column.
+            plan.restrict_columns = False
+            continue
+
+        child_type = graphql_type.fields[name].type if name in graphql_type.fields else None
+        child_selections = _collect_fields(info, nodes)
+
+        if field.concrete and (field.many_to_one or field.one_to_one):
+            plan.columns.add(field.name)
+            if child_selections and child_type is not None:
+                child_plan = _plan(
+                    field.related_model, get_named_type(child_type), child_selections, info
+                )
+                existing = plan.related.get(field.name)
+                if existing is not None:
+                    _merge(existing, child_plan)
+                else:
+                    plan.related[field.name] = child_plan
+        elif field.one_to_many or field.many_to_many:
+            if child_type is None:
+                continue
+            child_plan = _plan(
+                field.related_model, get_named_type(child_type), child_selections, info
+            )
+            if field.one_to_many and not field.concrete:
+                # Prefetching matches rows through the reverse foreign key.
+                child_plan.columns.add(field.field.name)
+            accessor = field.get_accessor_name() if not field.concrete else field.name
+            plan.prefetches[accessor] = (child_plan, field.related_model)
+        elif not field.is_relation:
+            plan.columns.add(field.name)
+    return plan
+
+
+def _merge(target, other):
+    target.columns.update(other.columns)
+    target.restrict_columns = target.restrict_columns and other.restrict_columns
+    for name, plan in other.related.items():
+        if name in target.related:
+            _merge(target.related[name], plan)
+        else:
+            target.related[name] = plan
+    target.prefetches.update(other.prefetches)
+
+
+def _hint_columns(model, columns):
+    resolved = []
+    for column in columns:
+        try:
+            model._meta.get_field(column)
+        except FieldDoesNotExist:
+            continue
+        resolved.append(column)
+    return resolved
+
+
+_MODEL_FIELDS = {}
+
+
+def _model_fields(model):
+    """Map GraphQL-visible names (including reverse accessors) to model fields."""
+    fields = _MODEL_FIELDS.get(model)
+    if fields is None:
+        fields = {}
+        for field in model._meta.get_fields():
+            if field.auto_created and not field.concrete:
+                fields[field.get_accessor_name()] = field
+            else:
+                fields[field.name] = field
+        _MODEL_FIELDS[model] = fields
+    return fields
+
+
+def _collect_fields(info, nodes):
+    """
+    Group the sub-selections of ``nodes`` by field name, expanding fragments.
+    Returns ``{field_name: [FieldNode, ...]}``.
+    """
+    fields = {}
+    for node in nodes:
+        selection_set = getattr(node, 'selection_set', None)
+        if selection_set is None:
+            continue
+        _collect_selection_set(info, selection_set, fields)
+    return fields
+
+
+def _collect_selection_set(info, selection_set, fields):
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            fields.setdefault(selection.name.value, []).append(selection)
+        elif isinstance(selection, InlineFragmentNode):
+            _collect_selection_set(info, selection.selection_set, fields)
+        elif isinstance(selection, FragmentSpreadNode):
+            fragment = info.fragments.get(selection.name.value)
+            if fragment is not None:
+                _collect_selection_set(info, fragment.selection_set, fields)
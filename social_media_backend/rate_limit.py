@@ -0,0 +1,270 @@
+"""
+Shared GraphQL rate limiting
+
+Limits are enforced once per GraphQL operation (not per resolved field) by
+``NexusGraphQLView``, against counters kept in the configured Django cache
+(Redis in production), so every worker process shares the same quota.
+
+Each limit is a sliding window counter: the count of the current fixed window
+plus the count of the previous one weighted by how much of it still overlaps
+the sliding window. It needs two cache keys per client and limit, updated with
+atomic ``incr``, and approximates a sliding log without storing timestamps.
+
+Every operation counts against the limit of the user tier
+(``RATE_LIMITS['TIERS']``); root fields listed in ``RATE_LIMITS['OPERATIONS']``
+also count against their own limits, once per selection (three aliased
+``createPost`` fields are three hits). A rejected operation is not counted and
+gets an HTTP 429 with the number of seconds until it would be accepted in
+``Retry-After``.
+"""
+
+import math
+import re
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.core.cache import caches
+from django.http import HttpResponse
+from graphql import FieldNode, FragmentDefinitionNode, FragmentSpreadNode, GraphQLError, InlineFragmentNode
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.utils import get_http_authorization
+
+DEFAULTS = {
+    'ENABLED': True,
+    'CACHE': 'default',
+    # Operations per window for each user tier, None for no limit
+    'TIERS': {
+        'anonymous': '60/m',
+        'user': '300/m',
+        'verified': '600/m',
+        'staff': None,
+    },
+    # Additional limits of root fields, by tier ('default' for the others)
+    'OPERATIONS': {},
+}
+
+CACHE_PREFIX = 'ratelimit'
+RATE_PATTERN = re.compile(r'^\s*(\d+)\s*/\s*(\d*)\s*([smhd])\w*\s*$')
+UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+_rates = {}
+
+
+def get_rate_limit_settings():
+    return {**DEFAULTS, **getattr(settings, 'RATE_LIMITS', {})}
+
+
+def parse_rate(rate):
+    """``'100/m'`` or ``'10/30s'`` -> ``(limit, window_seconds)``, ``None`` for no limit."""
+    if rate is None:
+        return None
+    parsed = _rates.get(rate)
+    if parsed is None:
+        match = RATE_PATTERN.match(rate)
+        if match is None:
+            raise ValueError(f"Invalid rate '{rate}', expected e.g. '100/m' or '10/30s'")
+        limit, multiplier, unit = match.groups()
+        parsed = _rates[rate] = (int(limit), int(multiplier or 1) * UNITS[unit])
+    return parsed
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, scope, limit, window, retry_after):
+        self.scope = scope
+        self.limit = limit
+        self.window = window
+        self.retry_after = retry_after
+        super().__init__(
+            f'Rate limit exceeded for {scope} ({limit} per {window}s), retry in {retry_after}s'
+        )
+
+    def as_response(self):
+        response = HttpResponse(status=429, content_type='application/json')
+        response['Retry-After'] = str(self.retry_after)
+        return response
+
+    def as_graphql_error(self):
+        return GraphQLError(
+            message='Rate limit exceeded',
+            extensions={
+                'code': 'RATE_LIMIT_EXCEEDED',
+                'scope': self.scope,
+                'max_requests': self.limit,
+                'window_duration': self.window,
+                'retry_after': self.retry_after,
+            }
+        )
+
+
+def sliding_window_wait(previous, current, limit, window, elapsed, cost=1):
+    """
+    Seconds until ``cost`` more hits fit in the sliding window, given the hit
+    counts of the previous and current fixed windows and the time ``elapsed``
+    since the current window started (0 when they fit now).
+    """
+    if cost > limit:
+        # Never fits
+        return float(window)
+    weight = 1 - elapsed / window
+    if previous * weight + current + cost <= limit:
+        return 0.0
+    if current + cost <= limit:
+        # Wait for enough of the previous window to slide out
+        return window * (1 - (limit - current - cost) / previous) - elapsed
+    # Wait for the next window, where the current one becomes the previous
+    return window - elapsed + window * max(0.0, 1 - (limit - cost) / current)
+
+
+class SlidingWindowLimiter:
+    """
+    Sliding window counters stored in a Django cache.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def _keys(self, name, window, now):
+        index = int(now // window)
+        return (
+            f'{CACHE_PREFIX}:{name}:{window}:{index - 1}',
+            f'{CACHE_PREFIX}:{name}:{window}:{index}',
+            now - index * window,
+        )
+
+    def _incr(self, key, window, cost):
+        self.cache.add(key, 0, timeout=2 * window)
+        try:
+            return self.cache.incr(key, cost)
+        except ValueError:
+            # Expired between add() and incr()
+            self.cache.set(key, cost, timeout=2 * window)
+            return cost
+
+    def hit(self, limits, now=None):
+        """
+        Count ``cost`` hits against every ``(name, limit, window, cost)`` of
+        ``limits``. If one of them is exceeded, nothing is counted and
+        ``RateLimitExceeded`` is raised for the longest wait.
+        """
+        now = time.time() if now is None else now
+        keys = [self._keys(name, window, now) for name, _, window, _ in limits]
+        previous_counts = self.cache.get_many([previous for previous, _, _ in keys])
+        counted = []
+        exceeded = None
+        for (name, limit, window, cost), (previous, current, elapsed) in zip(limits, keys):
+            count = self._incr(current, window, cost)
+            counted.append((current, cost))
+            wait = sliding_window_wait(
+                previous_counts.get(previous, 0), count - cost, limit, window, elapsed, cost
+            )
+            if wait > 0 and (exceeded is None or wait > exceeded[3]):
+                exceeded = (name, limit, window, wait)
+        if exceeded is not None:
+            for key, cost in counted:
+                try:
+                    self.cache.decr(key, cost)
+                except ValueError:
+                    pass
+            name, limit, window, wait = exceeded
+            # Rounded first so float error (20.000000000000004) does not add a second
+            retry_after = max(1, math.ceil(round(wait, 6)))
+            raise RateLimitExceeded(name.split(':')[0], limit, window, retry_after)
+
+
+def request_user(request):
+    """
+    User of the request. The JWT is normally authenticated by the GraphQL
+    middleware during execution, i.e. after the limit is checked, so it is
+    authenticated here instead (invalid tokens are left to the middleware).
+    """
+    user = getattr(request, 'user', None)
+    if (user is None or user.is_anonymous) and get_http_authorization(request) is not None:
+        try:
+            authenticated = authenticate(request=request)
+        except JSONWebTokenError:
+            return user
+        if authenticated is not None:
+            request.user = user = authenticated
+    return user
+
+
+def user_tier(user):
+    if user is None or not user.is_authenticated:
+        return 'anonymous'
+    if user.is_staff:
+        return 'staff'
+    if getattr(user, 'is_verified', False):
+        return 'verified'
+    return 'user'
+
+
+def client_identity(request, user):
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    return f"ip:{request.META.get('REMOTE_ADDR', 'unknown')}"
+
+
+def document_fragments(document):
+    return {
+        definition.name.value: definition for definition in document.definitions
+        if isinstance(definition, FragmentDefinitionNode)
+    }
+
+
+def root_field_names(operation, fragments):
+    """Names of the root fields selected by an operation, through fragments."""
+    names = []
+    pending = list(operation.selection_set.selections)
+    visited = set()
+    while pending:
+        selection = pending.pop()
+        if isinstance(selection, FieldNode):
+            names.append(selection.name.value)
+        elif isinstance(selection, InlineFragmentNode):
+            pending.extend(selection.selection_set.selections)
+        elif isinstance(selection, FragmentSpreadNode) and selection.name.value not in visited:
+            visited.add(selection.name.value)
+            fragment = fragments.get(selection.name.value)
+            if fragment is not None:
+                pending.extend(fragment.selection_set.selections)
+    return names
+
+
+def operation_limits(request, field_names):
+    """
+    ``[(name, limit, window, cost), ...]`` applying to an operation of
+    ``request`` selecting the root fields ``field_names`` (with repeats).
+    """
+    config = get_rate_limit_settings()
+    user = request_user(request)
+    tier = user_tier(user)
+    identity = client_identity(request, user)
+    limits = []
+    rate = parse_rate(config['TIERS'].get(tier))
+    if rate is not None:
+        limits.append((f'operations:{identity}', *rate, 1))
+    for field_name, occurrences in sorted(Counter(field_names).items()):
+        field_rates = config['OPERATIONS'].get(field_name)
+        if not field_rates:
+            continue
+        rate = parse_rate(field_rates.get(tier, field_rates.get('default')))
+        if rate is not None:
+            limits.append((f'{field_name}:{identity}', *rate, occurrences))
+    return limits
+
+
+def check_rate_limit(request, operation, fragments):
+    """
+    Count ``operation`` (using the ``fragments`` of its document by name)
+    against the limits of ``request``, once per operation. Raises
+    ``RateLimitExceeded`` when a limit is reached.
+    """
+    config = get_rate_limit_settings()
+    if not config['ENABLED'] or getattr(request, '_rate_limited_operation', None) is operation:
+        return
+    request._rate_limited_operation = operation
+    limits = operation_limits(request, root_field_names(operation, fragments))
+    if limits:
+        SlidingWindowLimiter(caches[config['CACHE']]).hit(limits)
@@ -0,0 +1,310 @@
+"""
+Response cache of public GraphQL queries
+
+Anonymous callers get the same response from public queries such as
+``allPosts(visibility: "public")``, ``trendingHashtags`` or ``user``, so
+``NexusGraphQLView`` stores these responses in the configured Django cache and
+serves them to every worker. An operation is cached when the caller is
+anonymous, it is a query, all its root fields are listed in
+``RESPONSE_CACHE['ROOT_FIELDS']`` (with the argument values they require) and
+every object type it selects has an entry in ``RESPONSE_CACHE['TYPES']``.
+
+Responses are keyed by the normalized document (``print_ast``), operation
+name, variables and auth scope. Each type gives a TTL hint, the response lives
+as long as the shortest hint of its types, and invalidation tags: the current
+version of each tag is part of the key, and saving or deleting a ``Post``,
+``Hashtag`` or ``User`` bumps the version of its tag once the transaction
+commits, so the responses that may contain it are never read again.
+
+A miss is recomputed by a single worker holding a lock in the cache while the
+others wait for its result (up to ``WAIT_TIMEOUT``), so an invalidation does
+not send every concurrent request to the database.
+"""
+
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from graphql import (
+    ExecutionResult,
+    FieldNode,
+    FragmentSpreadNode,
+    InlineFragmentNode,
+    OperationType,
+    get_named_type,
+    is_leaf_type,
+    print_ast,
+)
+from graphql.utilities import value_from_ast_untyped
+
+from .metrics import REGISTRY
+from .rate_limit import request_user
+
+DEFAULTS = {
+    'ENABLED': True,
+    'CACHE': 'default',
+    # Cacheable root fields, with the argument values they require
+    'ROOT_FIELDS': {
+        'allPosts': {'visibility': 'public'},
+        'allPostsConnection': {'visibility': 'public'},
+        'trendingHashtags': {},
+        'postsByHashtag': {},
+        'postsByHashtagConnection': {},
+        'user': {},
+        'userByUsername': {},
+    },
+    # TTL hint (seconds) and invalidation tags of the cacheable object types
+    'TYPES': {
+        'PostType': {'ttl': 30, 'tags': ('Post',)},
+        'UserType': {'ttl': 60, 'tags': ('User',)},
+        'HashtagType': {'ttl': 60, 'tags': ('Hashtag',)},
+        'PostHashtagType': {'ttl': 60, 'tags': ('Post', 'Hashtag')},
+        'PostConnection': {},
+        'PostEdge': {},
+        'PageInfo': {},
+    },
+    # TTL of responses whose types give no hint
+    'DEFAULT_TTL': 60,
+    # Seconds a recomputation may hold its lock
+    'LOCK_TIMEOUT': 10,
+    # Seconds other requests wait for a recomputation, and polling interval
+    'WAIT_TIMEOUT': 2,
+    'WAIT_INTERVAL': 0.05,
+}
+
+# Models whose saves invalidate a tag, as 'app_label.ModelName'
+TAGGED_MODELS = {
+    'posts.Post': 'Post',
+    'posts.Hashtag': 'Hashtag',
+    'users.User': 'User',
+}
+
+CACHE_PREFIX = 'gqlresponse'
+
+RESPONSE_CACHE_LOOKUPS = REGISTRY.counter(
+    'graphql_response_cache_lookups_total',
+    'Response cache lookups of cacheable operations (hit, coalesced or miss).',
+    ('result',)
+)
+RESPONSE_CACHE_HIT_RATIO = REGISTRY.gauge(
+    'graphql_response_cache_hit_ratio',
+    'Share of cacheable operations served from the response cache by this process.'
+)
+RESPONSE_CACHE_INVALIDATIONS = REGISTRY.counter(
+    'graphql_response_cache_invalidations_total', 'Response cache tag invalidations.', ('tag',)
+)
+
+
+def get_response_cache_settings():
+    return {**DEFAULTS, **getattr(settings, 'RESPONSE_CACHE', {})}
+
+
+def _tag_key(tag):
+    return f'{CACHE_PREFIX}:tag:{tag}'
+
+
+def _initial_version():
+    # Never restart from a version that may still key live responses
+    return int(time.time() * 1000)
+
+
+def tag_versions(cache, tags):
+    """Current ``{tag: version}`` of ``tags``, creating the missing ones."""
+    keys = {_tag_key(tag): tag for tag in tags}
+    versions = cache.get_many(list(keys))
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, _initial_version(), timeout=None)
+        versions.update(cache.get_many(missing))
+    return {tag: versions.get(key) for key, tag in keys.items()}
+
+
+def invalidate_tags(*tags):
+    """Bump the versions of ``tags``, orphaning the responses keyed by them."""
+    cache = caches[get_response_cache_settings()['CACHE']]
+    for tag in tags:
+        try:
+            cache.incr(_tag_key(tag))
+        except ValueError:
+            cache.add(_tag_key(tag), _initial_version(), timeout=None)
+        RESPONSE_CACHE_INVALIDATIONS.inc(tag=tag)
+
+
+def _invalidate_instance(sender, **kwargs):
+    tag = TAGGED_MODELS.get(sender._meta.label)
+    if tag is not None:
+        transaction.on_commit(lambda: invalidate_tags(tag))
+
+
+def connect_signals():
+    """Invalidate the tags of ``TAGGED_MODELS`` on their saves and deletes."""
+    post_save.connect(_invalidate_instance, dispatch_uid='response_cache_post_save')
+    post_delete.connect(_invalidate_instance, dispatch_uid='response_cache_post_delete')
+
+
+def _record_lookup(result):
+    RESPONSE_CACHE_LOOKUPS.inc(result=result)
+    hits = RESPONSE_CACHE_LOOKUPS.value(result='hit') + RESPONSE_CACHE_LOOKUPS.value(result='coalesced')
+    RESPONSE_CACHE_HIT_RATIO.set(hits / (hits + RESPONSE_CACHE_LOOKUPS.value(result='miss')))
+
+
+class SelectionPolicy:
+    """
+    Walks an operation to find whether it is cacheable, and if so the TTL and
+    tags of its response.
+    """
+
+    def __init__(self, schema, fragments, variables, config):
+        self.schema = schema
+        self.fragments = fragments
+        self.variables = variables
+        self.config = config
+        self.ttl = None
+        self.tags = set()
+
+    def allows(self, operation):
+        if operation.operation != OperationType.QUERY:
+            return False
+        root_type = self.schema.query_type
+        for field_node in self._fields(root_type, operation.selection_set):
+            name = field_node.name.value
+            if name == '__typename':
+                continue
+            required = self.config['ROOT_FIELDS'].get(name)
+            if required is None or not self._arguments_match(field_node, required):
+                return False
+            if not self._field_allowed(root_type, field_node):
+                return False
+        return True
+
+    def _arguments_match(self, field_node, required):
+        arguments = {
+            argument.name.value: value_from_ast_untyped(argument.value, self.variables)
+            for argument in field_node.arguments
+        }
+        return all(
+            arguments.get(name, value) == value for name, value in required.items()
+        )
+
+    def _fields(self, parent_type, selection_set, visited=()):
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                yield selection
+            elif isinstance(selection, InlineFragmentNode):
+                yield from self._fields(parent_type, selection.selection_set, visited)
+            elif isinstance(selection, FragmentSpreadNode):
+                name = selection.name.value
+                fragment = self.fragments.get(name)
+                if fragment is not None and name not in visited:
+                    yield from self._fields(parent_type, fragment.selection_set, (*visited, name))
+
+    def _field_allowed(self, parent_type, field_node):
+        field = getattr(parent_type, 'fields', {}).get(field_node.name.value)
+        if field is None:
+            return False
+        named_type = get_named_type(field.type)
+        if is_leaf_type(named_type):
+            return True
+        hints = self.config['TYPES'].get(named_type.name)
+        if hints is None:
+            return False
+        if hints.get('ttl') is not None:
+            self.ttl = hints['ttl'] if self.ttl is None else min(self.ttl, hints['ttl'])
+        self.tags.update(hints.get('tags', ()))
+        return all(
+            child.name.value.startswith('__') or self._field_allowed(named_type, child)
+            for child in self._fields(named_type, field_node.selection_set)
+        )
+
+
+class CachedResponse:
+    """
+    Cache entry of one cacheable operation, recomputed single-flight.
+    """
+
+    def __init__(self, cache, key, ttl, config):
+        self.cache = cache
+        self.key = key
+        self.ttl = ttl
+        self.config = config
+        self.status = None
+
+    def _hit(self, data, result):
+        _record_lookup(result)
+        self.status = 'HIT'
+        return ExecutionResult(data=data)
+
+    def get_or_execute(self, execute):
+        """Cached result of the operation, or the result of ``execute()``."""
+        data = self.cache.get(self.key)
+        if data is not None:
+            return self._hit(data, 'hit')
+        lock = f'{self.key}:lock'
+        if not self.cache.add(lock, 1, timeout=self.config['LOCK_TIMEOUT']):
+            deadline = time.monotonic() + self.config['WAIT_TIMEOUT']
+            while time.monotonic() < deadline:
+                time.sleep(self.config['WAIT_INTERVAL'])
+                data = self.cache.get(self.key)
+                if data is not None:
+                    return self._hit(data, 'coalesced')
+            # The recomputation is too slow or failed: compute without the lock
+            lock = None
+        _record_lookup('miss')
+        self.status = 'MISS'
+        try:
+            result = execute()
+            if result is not None and not result.errors and result.data is not None:
+                self.cache.set(self.key, result.data, self.ttl)
+            return result
+        finally:
+            if lock is not None:
+                self.cache.delete(lock)
+
+    def as_extension(self):
+        return {'status': self.status, 'maxAge': self.ttl}
+
+
+def _variables_with_defaults(operation, variables):
+    values = {
+        definition.variable.name.value: value_from_ast_untyped(definition.default_value)
+        for definition in operation.variable_definitions or ()
+        if definition.default_value is not None
+    }
+    if isinstance(variables, dict):
+        values.update(variables)
+    return values
+
+
+def cached_response(request, schema, document, operation, fragments, variables, operation_name):
+    """
+    ``CachedResponse`` of ``operation`` for ``request``, or ``None`` when the
+    operation is not cacheable.
+    """
+    config = get_response_cache_settings()
+    if not config['ENABLED'] or operation is None:
+        return None
+    user = request_user(request)
+    if user is not None and user.is_authenticated:
+        return None
+    values = _variables_with_defaults(operation, variables)
+    policy = SelectionPolicy(schema, fragments, values, config)
+    if not policy.allows(operation):
+        return None
+    cache = caches[config['CACHE']]
+    key_parts = {
+        'document': hashlib.sha256(print_ast(document).encode('utf-8')).hexdigest(),
+        'operation': operation_name,
+        'variables': values,
+        'scope': 'anonymous',
+        'tags': tag_versions(cache, sorted(policy.tags)),
+    }
+    digest = hashlib.sha256(
+        json.dumps(key_parts, sort_keys=True, default=str).encode('utf-8')
+    ).hexdigest()
+    ttl = policy.ttl if policy.ttl is not None else config['DEFAULT_TTL']
+    return CachedResponse(cache, f'{CACHE_PREFIX}:{digest}', ttl, config)
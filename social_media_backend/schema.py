@@ -4,11 +4,20 @@ Main GraphQL Schema for Social Media Backend
 
 import graphene
 import graphql_jwt
+from graphql_jwt.decorators import login_required
 
 # Import all app schemas
 from users.schema import UserQuery, UserMutation
-from posts.schema import PostQuery, PostMutation
-from interactions.schema import InteractionQuery, InteractionMutation
+from posts.models import Post
+from posts.schema import PostQuery, PostMutation, PostType
+from posts.timelines import followed_author_ids
+from interactions.models import Notification
+from interactions.schema import InteractionQuery, InteractionMutation, NotificationType
+
+from .n_plus_one import InstrumentedSchema
+from .object_cache import get_object
+from .pubsub import author_channel, feed_channel, notifications_channel
+from .subscriptions import event_stream
 
 
 class Query(
@@ -42,5 +51,45 @@ class Mutation(
     refresh_token = graphql_jwt.Refresh.Field()
 
 
-# Create the schema
-schema = graphene.Schema(query=Query, mutation=Mutation)
+class Subscription(graphene.ObjectType):
+    """
+    Root Subscription, served over websockets (see social_media_backend.subscriptions)
+    """
+    notification_created = graphene.Field(NotificationType)
+    unread_count_changed = graphene.Int()
+    feed_item_added = graphene.Field(PostType)
+    
+    @login_required
+    def subscribe_notification_created(root, info):
+        return event_stream([notifications_channel(info.context.user.pk)], ('notificationCreated',))
+    
+    def resolve_notification_created(event, info):
+        return Notification.objects.filter(pk=event['payload']['id']).first()
+    
+    @login_required
+    def subscribe_unread_count_changed(root, info):
+        return event_stream(
+            [notifications_channel(info.context.user.pk)],
+            ('notificationCreated', 'unreadCountChanged')
+        )
+    
+    def resolve_unread_count_changed(event, info):
+        return Notification.objects.filter(recipient=info.context.user, is_read=False).count()
+    
+    @login_required
+    def subscribe_feed_item_added(root, info):
+        user = info.context.user
+        
+        def channels():
+            # Posts of followed celebrities are published on their own channel
+            celebrity_ids = followed_author_ids(user, celebrities=True)
+            return [feed_channel(user.pk)] + [author_channel(author_id) for author_id in celebrity_ids]
+        
+        return event_stream(channels, ('feedItemAdded',))
+    
+    def resolve_feed_item_added(event, info):
+        return get_object(Post, event['payload']['id'])
+
+
+# Create the schema (N+1 detection is opt-in, see settings.N_PLUS_ONE)
+schema = InstrumentedSchema(query=Query, mutation=Mutation, subscription=Subscription)
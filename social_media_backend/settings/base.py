@@ -164,6 +164,8 @@ GRAPHENE = {
     'SCHEMA': 'social_media_backend.schema.schema',
     'MIDDLEWARE': [
         'graphql_jwt.middleware.JSONWebTokenMiddleware',
+        'social_media_backend.tracing.TracingMiddleware',
+        'social_media_backend.dataloaders.DataLoaderMiddleware',
     ],
 }
 
@@ -428,3 +430,143 @@ CELERY_WORKER_DISABLE_RATE_LIMITS = False
 # Celery Logging
 CELERY_WORKER_HIJACK_ROOT_LOGGER = False
 CELERY_WORKER_LOG_COLOR = True
+
+# ============================================================================
+# FEED CONFIGURATION
+# ============================================================================
+
+# Materialized home timelines (see posts/timelines.py)
+TIMELINES = {
+    'BACKEND': config('TIMELINE_BACKEND', default='posts.timelines.DatabaseTimelineBackend'),
+    'MAX_LENGTH': 800,
+    'TTL': 7 * 24 * 3600,  # Redis timelines expire after a week without reads
+    'REDIS_URL': config('TIMELINE_REDIS_URL', default='redis://localhost:6379/2'),
+    'FAN_OUT_BATCH_SIZE': 1000,
+    # Authors above this many followers are pulled at read time, not fanned out
+    'CELEBRITY_FOLLOWER_THRESHOLD': config('CELEBRITY_FOLLOWER_THRESHOLD', default=10000, cast=int),
+}
+
+VIEW_COUNTER = {
+    # LocalViewBuffer flushes each process's own views on a timer thread; use
+    # RedisViewBuffer with several workers, posts.tasks.flush_view_counts only
+    # reaches a shared buffer
+    'BACKEND': config('VIEW_COUNTER_BACKEND', default='posts.view_counter.LocalViewBuffer'),
+    # Count distinct viewers (HyperLogLog estimate) instead of raw hits
+    'UNIQUE_VIEWERS': config('VIEW_COUNTER_UNIQUE_VIEWERS', default=False, cast=bool),
+    'FLUSH_INTERVAL': 30,
+    'REDIS_URL': config('VIEW_COUNTER_REDIS_URL', default='redis://localhost:6379/2'),
+    'BATCH_SIZE': 500,
+}
+
+COUNTERS = {
+    # Hot counters spread over CounterShard rows, e.g. 'posts.Post.likes_count'
+    'SHARDED_FIELDS': (),
+    'SHARDS': 8,
+    'COMPACT_BATCH_SIZE': 1000,
+}
+
+TRACING = {
+    # Fraction of GraphQL operations traced per resolver and SQL query
+    'SAMPLE_RATE': config('TRACING_SAMPLE_RATE', default=0.1, cast=float),
+    'EXTENSIONS': DEBUG,
+    'METRICS_TOKEN': config('METRICS_TOKEN', default=''),
+}
+
+N_PLUS_ONE = {
+    # Report repeated SQL shapes per GraphQL operation (tests and staging)
+    'ENABLED': config('N_PLUS_ONE_DETECTION', default=False, cast=bool),
+    'THRESHOLD': 5,
+}
+
+RATE_LIMITS = {
+    # Operations per window by user tier (counters live in the default cache)
+    'TIERS': {
+        'anonymous': config('RATE_LIMIT_ANONYMOUS', default='60/m'),
+        'user': config('RATE_LIMIT_USER', default='300/m'),
+        'verified': config('RATE_LIMIT_VERIFIED', default='600/m'),
+        'staff': None,
+    },
+    # Stricter limits on expensive or abusable root fields
+    'OPERATIONS': {
+        'tokenAuth': {'default': '10/m'},
+        'createUser': {'default': '5/h'},
+        'createPost': {'default': '30/m', 'verified': '60/m'},
+        'createComment': {'default': '60/m'},
+        'createReport': {'default': '10/h'},
+    },
+}
+
+QUERY_COST = {
+    'MAX_DEPTH': 10,
+    'MAX_COST': config('QUERY_MAX_COST', default=10000, cast=int),
+    'MAX_ALIASES': 30,
+    'DEFAULT_LIST_SIZE': 20,
+    # Lists returned without pagination
+    'LIST_SIZES': {
+        'Query.allUsers': 500,
+        'Query.allReports': 500,
+    },
+    'FIELD_COSTS': {
+        'Query.searchPosts': 10,
+        'Query.searchUsers': 10,
+        'Query.searchUsersConnection': 10,
+    },
+}
+
+PERSISTED_QUERIES = {
+    # Only run the operations listed in MANIFEST ({sha256: query})
+    'ALLOW_LIST': config('PERSISTED_QUERIES_ALLOW_LIST', default=False, cast=bool),
+    'MANIFEST': config('PERSISTED_QUERIES_MANIFEST', default=None),
+    'DOCUMENT_CACHE_SIZE': 500,
+    'GET_MAX_AGE': 60,
+}
+
+RESPONSE_CACHE = {
+    'ENABLED': config('RESPONSE_CACHE_ENABLED', default=True, cast=bool),
+    # Seconds other requests wait for the recomputation of a missing response
+    'WAIT_TIMEOUT': 2,
+}
+
+OBJECT_CACHE = {
+    'ENABLED': config('OBJECT_CACHE_ENABLED', default=True, cast=bool),
+    'MODELS': ('users.User', 'posts.Post'),
+    'TIMEOUT': 300,
+    # Per-process tier: rows per model, seconds before re-reading the shared cache
+    'LOCAL_SIZE': 1000,
+    'LOCAL_TIMEOUT': 5,
+    # Never cached (loaded from the database when read)
+    'EXCLUDED_FIELDS': {'users.User': ('password',)},
+}
+
+ASYNC_GRAPHQL = {
+    # Serve /graphql/ with the async view when running under ASGI
+    'ENABLED': config('ASYNC_GRAPHQL', default=False, cast=bool),
+    'REQUEST_WORKERS': config('GRAPHQL_REQUEST_WORKERS', default=32, cast=int),
+    'RESOLVER_WORKERS': config('GRAPHQL_RESOLVER_WORKERS', default=16, cast=int),
+}
+
+SUBSCRIPTIONS = {
+    # RedisPubSub reaches the websockets of every ASGI process
+    'BACKEND': config('SUBSCRIPTIONS_BACKEND', default='social_media_backend.pubsub.InMemoryPubSub'),
+    'REDIS_URL': config('SUBSCRIPTIONS_REDIS_URL', default='redis://localhost:6379/3'),
+    'PATH': '/graphql/',
+    'QUEUE_SIZE': 100,
+}
+
+NOTIFICATIONS = {
+    # Likes and shares of one post coalesce into "alice and 12 others ..."
+    'GROUPED_TYPES': ('like', 'share'),
+    'GROUP_WINDOW': config('NOTIFICATION_GROUP_WINDOW', default=24 * 3600, cast=int),
+    'RECENT_ACTORS': 5,
+}
+
+NOTIFICATION_QUEUE = {
+    # RedisNotificationQueue is drained by the Celery workers
+    'BACKEND': config('NOTIFICATION_QUEUE_BACKEND', default='interactions.notification_queue.LocalNotificationQueue'),
+    'REDIS_URL': config('NOTIFICATION_QUEUE_REDIS_URL', default='redis://localhost:6379/2'),
+    'BATCH_SIZE': 500,
+    'BATCH_DELAY': 1,
+    'MAX_BATCHES': 20,
+    'MAX_ATTEMPTS': 5,
+    'VISIBILITY_TIMEOUT': 300,
+}
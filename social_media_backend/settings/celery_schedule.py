@@ -39,12 +39,38 @@ CELERY_BEAT_SCHEDULE = {
         'options': {'queue': 'analytics'}
     },
     
+    # Redis view buffer; a LocalViewBuffer flushes itself in each web process
+    'flush-post-view-counts': {
+        'task': 'posts.tasks.flush_view_counts',
+        'schedule': 30.0,  # Every 30 seconds
+        'options': {'queue': 'analytics'}
+    },
+    
+    # Timeline fan-outs and retractions deferred during a broker outage
+    'send-deferred-tasks': {
+        'task': 'posts.tasks.send_deferred_tasks',
+        'schedule': 60.0,  # Every minute
+    },
+    
+    # Incremental: only posts still decaying or whose counters changed
     'update-post-engagement-scores': {
         'task': 'posts.tasks.update_post_engagement_scores',
-        'schedule': crontab(hour=5, minute=0),  # Daily at 5:00 AM
+        'schedule': crontab(minute='*/5'),  # Every 5 minutes
         'options': {'queue': 'analytics'}
     },
     
+    'compact-counter-shards': {
+        'task': 'interactions.tasks.compact_counter_shards',
+        'schedule': 60.0,  # Every minute
+        'options': {'queue': 'analytics'}
+    },
+    
+    # Catches notification events whose delivery task was lost
+    'deliver-notifications': {
+        'task': 'interactions.tasks.deliver_notifications',
+        'schedule': 30.0,  # Every 30 seconds
+    },
+    
     # Communication Tasks
     'send-content-digest-email': {
         'task': 'posts.tasks.send_content_digest_email',
@@ -171,6 +171,8 @@ GRAPHENE = {
     'SCHEMA': 'social_media_backend.schema.schema',
     'MIDDLEWARE': [
         'graphql_jwt.middleware.JSONWebTokenMiddleware',
+        'social_media_backend.tracing.TracingMiddleware',
+        'social_media_backend.dataloaders.DataLoaderMiddleware',
     ],
 }
 
@@ -231,6 +233,150 @@ else:
         }
     }
 
+# Materialized home timelines: Redis sorted sets when Redis is available
+TIMELINES = {
+    'BACKEND': (
+        'posts.timelines.RedisTimelineBackend' if redis_url
+        else 'posts.timelines.DatabaseTimelineBackend'
+    ),
+    'MAX_LENGTH': 800,
+    'TTL': 7 * 24 * 3600,
+    'REDIS_URL': redis_url,
+    'FAN_OUT_BATCH_SIZE': 1000,
+    # Authors above this many followers are pulled at read time, not fanned out
+    'CELEBRITY_FOLLOWER_THRESHOLD': config('CELEBRITY_FOLLOWER_THRESHOLD', default=10000, cast=int),
+}
+
+VIEW_COUNTER = {
+    'BACKEND': (
+        'posts.view_counter.RedisViewBuffer' if redis_url
+        else 'posts.view_counter.LocalViewBuffer'
+    ),
+    'UNIQUE_VIEWERS': config('VIEW_COUNTER_UNIQUE_VIEWERS', default=False, cast=bool),
+    'FLUSH_INTERVAL': 30,
+    'REDIS_URL': redis_url,
+    'BATCH_SIZE': 500,
+}
+
+COUNTERS = {
+    # Hot counters spread over CounterShard rows, e.g. 'posts.Post.likes_count'
+    'SHARDED_FIELDS': (),
+    'SHARDS': 8,
+    'COMPACT_BATCH_SIZE': 1000,
+}
+
+TRACING = {
+    # Fraction of GraphQL operations traced per resolver and SQL query
+    'SAMPLE_RATE': config('TRACING_SAMPLE_RATE', default=0.01, cast=float),
+    'EXTENSIONS': False,
+    # Required to scrape /metrics/ from outside the host
+    'METRICS_TOKEN': config('METRICS_TOKEN', default=''),
+}
+
+N_PLUS_ONE = {
+    # Report repeated SQL shapes per GraphQL operation (tests and staging)
+    'ENABLED': config('N_PLUS_ONE_DETECTION', default=False, cast=bool),
+    'THRESHOLD': 5,
+}
+
+RATE_LIMITS = {
+    # Operations per window by user tier (counters live in the default cache)
+    'TIERS': {
+        'anonymous': config('RATE_LIMIT_ANONYMOUS', default='60/m'),
+        'user': config('RATE_LIMIT_USER', default='300/m'),
+        'verified': config('RATE_LIMIT_VERIFIED', default='600/m'),
+        'staff': None,
+    },
+    # Stricter limits on expensive or abusable root fields
+    'OPERATIONS': {
+        'tokenAuth': {'default': '10/m'},
+        'createUser': {'default': '5/h'},
+        'createPost': {'default': '30/m', 'verified': '60/m'},
+        'createComment': {'default': '60/m'},
+        'createReport': {'default': '10/h'},
+    },
+}
+
+QUERY_COST = {
+    'MAX_DEPTH': 10,
+    'MAX_COST': config('QUERY_MAX_COST', default=10000, cast=int),
+    'MAX_ALIASES': 30,
+    'DEFAULT_LIST_SIZE': 20,
+    # Lists returned without pagination
+    'LIST_SIZES': {
+        'Query.allUsers': 500,
+        'Query.allReports': 500,
+    },
+    'FIELD_COSTS': {
+        'Query.searchPosts': 10,
+        'Query.searchUsers': 10,
+        'Query.searchUsersConnection': 10,
+    },
+}
+
+PERSISTED_QUERIES = {
+    # Only run the operations listed in MANIFEST ({sha256: query})
+    'ALLOW_LIST': config('PERSISTED_QUERIES_ALLOW_LIST', default=False, cast=bool),
+    'MANIFEST': config('PERSISTED_QUERIES_MANIFEST', default=None),
+    'DOCUMENT_CACHE_SIZE': 500,
+    'GET_MAX_AGE': 60,
+}
+
+RESPONSE_CACHE = {
+    'ENABLED': config('RESPONSE_CACHE_ENABLED', default=True, cast=bool),
+    # Seconds other requests wait for the recomputation of a missing response
+    'WAIT_TIMEOUT': 2,
+}
+
+OBJECT_CACHE = {
+    'ENABLED': config('OBJECT_CACHE_ENABLED', default=True, cast=bool),
+    'MODELS': ('users.User', 'posts.Post'),
+    'TIMEOUT': 300,
+    # Per-process tier: rows per model, seconds before re-reading the shared cache
+    'LOCAL_SIZE': 1000,
+    'LOCAL_TIMEOUT': 5,
+    # Never cached (loaded from the database when read)
+    'EXCLUDED_FIELDS': {'users.User': ('password',)},
+}
+
+ASYNC_GRAPHQL = {
+    # Serve /graphql/ with the async view when running under ASGI
+    'ENABLED': config('ASYNC_GRAPHQL', default=False, cast=bool),
+    'REQUEST_WORKERS': config('GRAPHQL_REQUEST_WORKERS', default=32, cast=int),
+    'RESOLVER_WORKERS': config('GRAPHQL_RESOLVER_WORKERS', default=16, cast=int),
+}
+
+SUBSCRIPTIONS = {
+    # Events published by Celery workers must reach the ASGI processes
+    'BACKEND': (
+        'social_media_backend.pubsub.RedisPubSub' if redis_url
+        else 'social_media_backend.pubsub.InMemoryPubSub'
+    ),
+    'REDIS_URL': redis_url,
+    'PATH': '/graphql/',
+    'QUEUE_SIZE': 100,
+}
+
+NOTIFICATIONS = {
+    # Likes and shares of one post coalesce into "alice and 12 others ..."
+    'GROUPED_TYPES': ('like', 'share'),
+    'GROUP_WINDOW': config('NOTIFICATION_GROUP_WINDOW', default=24 * 3600, cast=int),
+    'RECENT_ACTORS': 5,
+}
+
+NOTIFICATION_QUEUE = {
+    'BACKEND': (
+        'interactions.notification_queue.RedisNotificationQueue' if redis_url
+        else 'interactions.notification_queue.LocalNotificationQueue'
+    ),
+    'REDIS_URL': redis_url,
+    'BATCH_SIZE': 500,
+    'BATCH_DELAY': 1,
+    'MAX_BATCHES': 20,
+    'MAX_ATTEMPTS': 5,
+    'VISIBILITY_TIMEOUT': 300,
+}
+
 # Email configuration (optional)
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = config('EMAIL_HOST', default='smtp.gmail.com')
@@ -289,6 +435,8 @@ GRAPHENE = {
     'MIDDLEWARE': [
         'social_media_backend.middleware.graphql_middleware.GraphQLAuthMiddleware',
         'social_media_backend.middleware.graphql_middleware.GraphQLErrorMiddleware',
+        'social_media_backend.tracing.TracingMiddleware',
+        'social_media_backend.dataloaders.DataLoaderMiddleware',
     ],
 }
 
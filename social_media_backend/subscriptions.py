@@ -0,0 +1,363 @@
+"""
+GraphQL subscriptions over websockets
+
+Clients subscribe to ``notificationCreated``, ``unreadCountChanged`` and
+``feedItemAdded`` instead of polling ``myNotifications`` and ``unreadCount``.
+``GraphQLWebSocketApp`` is the ASGI application of the websocket endpoint
+(``SUBSCRIPTIONS['PATH']``, see ``social_media_backend.asgi``) and speaks the
+``graphql-transport-ws`` protocol. The JWT is sent in the ``connection_init``
+payload (``{"authorization": "JWT <token>"}``) or in the handshake headers.
+
+Events come from the pub/sub layer (``social_media_backend.pubsub``):
+notifications are published when they are saved (``connect_signals``) and
+feed items by the timeline fan-out. Posts of celebrity authors are not fanned
+out, so they are published on the author's channel and ``feedItemAdded`` also
+listens on the channels of the celebrities followed when it subscribed. Each event is executed against the
+subscription's selection on the resolver thread pool
+(``social_media_backend.async_graphql``), so resolvers use the ORM as usual.
+
+Open connections, active subscriptions, delivered events and the fan-out
+latency (from publication to the websocket) are exported with the other
+metrics.
+"""
+
+import asyncio
+import json
+import logging
+import time
+
+from django.apps import apps
+from django.contrib.auth.models import AnonymousUser
+from django.db.models.signals import post_save
+from graphene_django.settings import graphene_settings
+from graphene_django.views import instantiate_middleware
+from graphql import (
+    ExecutionResult,
+    GraphQLError,
+    OperationType,
+    create_source_event_stream,
+    execute,
+    get_operation_ast,
+    parse,
+    validate,
+)
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.settings import jwt_settings
+from graphql_jwt.utils import get_payload, get_user_by_payload
+
+from .async_graphql import run_in_executor
+from .metrics import REGISTRY
+from .pubsub import get_pubsub, get_pubsub_settings, notifications_channel, publish_on_commit
+from .query_cost import analyze_operation
+from .rate_limit import document_fragments, root_field_names
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL = 'graphql-transport-ws'
+
+DEFAULTS = {
+    'PATH': '/graphql/',
+    # Seconds a client has to send connection_init
+    'CONNECTION_INIT_TIMEOUT': 10,
+}
+
+WEBSOCKET_CONNECTIONS = REGISTRY.gauge(
+    'graphql_websocket_connections', 'Open GraphQL websocket connections.'
+)
+ACTIVE_SUBSCRIPTIONS = REGISTRY.gauge(
+    'graphql_subscriptions_active', 'Active GraphQL subscriptions, by root field.', ('field',)
+)
+SUBSCRIPTION_EVENTS = REGISTRY.counter(
+    'graphql_subscription_events_total', 'Events sent to subscribers, by root field.', ('field',)
+)
+FAN_OUT_LATENCY = REGISTRY.histogram(
+    'graphql_subscription_fan_out_seconds',
+    'Delay between the publication of an event and its delivery to a subscriber.',
+    ('field',)
+)
+
+
+def get_subscription_settings():
+    return {**DEFAULTS, **get_pubsub_settings()}
+
+
+async def event_stream(channels, events):
+    """
+    Messages of ``channels`` whose event is in ``events``. ``channels`` can be
+    a function returning them, run on the resolver pool so it can use the ORM.
+    """
+    if callable(channels):
+        channels = await run_in_executor('RESOLVER', channels)
+    messages = get_pubsub().subscribe(channels)
+    try:
+        async for message in messages:
+            if message['event'] in events:
+                yield message
+    finally:
+        await messages.aclose()
+
+
+def _publish_notification(sender, instance, created, **kwargs):
+    event = 'notificationCreated' if created else 'unreadCountChanged'
+    payload = {'id': instance.pk} if created else {}
+    publish_on_commit([notifications_channel(instance.recipient_id)], event, payload)
+
+
+def connect_signals():
+    """Publish notification events when notifications are saved."""
+    post_save.connect(
+        _publish_notification,
+        sender=apps.get_model('interactions', 'Notification'),
+        dispatch_uid='subscriptions_notification_saved',
+    )
+
+
+class SubscriptionContext:
+    """
+    Request-like ``info.context`` of the operations of one websocket.
+    """
+
+    def __init__(self, scope, user):
+        self.scope = scope
+        self.user = user
+        self.method = 'WEBSOCKET'
+        self.META = {}
+        self.COOKIES = {}
+        self.GET = {}
+
+    def for_event(self):
+        """Fresh context per event, so request-scoped caches do not go stale."""
+        return SubscriptionContext(self.scope, self.user)
+
+
+def _authenticate(token):
+    try:
+        return get_user_by_payload(get_payload(token))
+    except JSONWebTokenError:
+        return None
+
+
+class GraphQLWebSocketConnection:
+    """
+    One ``graphql-transport-ws`` connection.
+    """
+
+    def __init__(self, schema, scope, receive, send):
+        self.schema = schema
+        self.graphql_schema = schema.graphql_schema
+        self.scope = scope
+        self.receive = receive
+        self._send = send
+        self._send_lock = asyncio.Lock()
+        self.context = None
+        self.operations = {}
+        self.closed = False
+
+    async def send(self, message):
+        async with self._send_lock:
+            if not self.closed:
+                await self._send({'type': 'websocket.send', 'text': json.dumps(message)})
+
+    async def close(self, code, reason=''):
+        async with self._send_lock:
+            if not self.closed:
+                self.closed = True
+                await self._send({'type': 'websocket.close', 'code': code, 'reason': reason})
+
+    def _header_token(self):
+        for name, value in self.scope.get('headers', ()):
+            if name.decode('latin1').lower() == 'authorization':
+                return value.decode('latin1')
+        return None
+
+    async def _connect(self, payload):
+        authorization = None
+        if isinstance(payload, dict):
+            authorization = payload.get('authorization') or payload.get('Authorization')
+        authorization = authorization or self._header_token()
+        user = AnonymousUser()
+        if authorization:
+            parts = authorization.split()
+            token = parts[-1]
+            if len(parts) == 2 and parts[0] != jwt_settings.JWT_AUTH_HEADER_PREFIX:
+                token = None
+            user = await run_in_executor('REQUEST', _authenticate, token) if token else None
+            if user is None:
+                await self.close(4403, 'Forbidden')
+                return
+        self.context = SubscriptionContext(self.scope, user)
+        await self.send({'type': 'connection_ack'})
+
+    async def run(self):
+        message = await self.receive()
+        if message['type'] != 'websocket.connect':
+            return
+        config = get_subscription_settings()
+        if (
+            self.scope.get('path', '').rstrip('/') != config['PATH'].rstrip('/')
+            or PROTOCOL not in self.scope.get('subprotocols', ())
+        ):
+            await self._send({'type': 'websocket.close', 'code': 4406})
+            return
+        await self._send({'type': 'websocket.accept', 'subprotocol': PROTOCOL})
+        WEBSOCKET_CONNECTIONS.inc()
+        deadline = time.monotonic() + config['CONNECTION_INIT_TIMEOUT']
+        try:
+            while not self.closed:
+                timeout = None if self.context is not None else deadline - time.monotonic()
+                try:
+                    message = await asyncio.wait_for(self.receive(), timeout)
+                except asyncio.TimeoutError:
+                    await self.close(4408, 'Connection initialisation timeout')
+                    break
+                if message['type'] == 'websocket.disconnect':
+                    self.closed = True
+                    break
+                if message['type'] == 'websocket.receive':
+                    await self.handle(message.get('text') or (message.get('bytes') or b'').decode())
+        finally:
+            for task in list(self.operations.values()):
+                task.cancel()
+            if self.operations:
+                await asyncio.gather(*self.operations.values(), return_exceptions=True)
+            WEBSOCKET_CONNECTIONS.dec()
+
+    async def handle(self, text):
+        try:
+            message = json.loads(text)
+            message_type = message['type']
+        except (ValueError, TypeError, KeyError):
+            await self.close(4400, 'Invalid message')
+            return
+        if message_type == 'connection_init':
+            if self.context is not None:
+                await self.close(4429, 'Too many initialisation requests')
+            else:
+                await self._connect(message.get('payload'))
+        elif message_type == 'ping':
+            await self.send({'type': 'pong'})
+        elif message_type == 'pong':
+            pass
+        elif message_type == 'subscribe':
+            if self.context is None:
+                await self.close(4401, 'Unauthorized')
+                return
+            operation_id = message.get('id')
+            if operation_id in self.operations:
+                await self.close(4409, f'Subscriber for {operation_id} already exists')
+                return
+            task = asyncio.get_running_loop().create_task(
+                self.operate(operation_id, message.get('payload') or {})
+            )
+            self.operations[operation_id] = task
+        elif message_type == 'complete':
+            task = self.operations.pop(message.get('id'), None)
+            if task is not None:
+                task.cancel()
+        else:
+            await self.close(4400, f'Unknown message type {message_type}')
+
+    def _prepare(self, payload):
+        """``(document, operation, errors)`` of a subscribe payload."""
+        try:
+            document = parse(payload.get('query') or '')
+        except GraphQLError as e:
+            return None, None, [e]
+        errors = validate(self.graphql_schema, document)
+        if errors:
+            return document, None, errors
+        operation = get_operation_ast(document, payload.get('operationName'))
+        if operation is None:
+            return document, None, [GraphQLError('Unknown operation')]
+        cost = analyze_operation(
+            self.graphql_schema, operation, document_fragments(document), payload.get('variables')
+        )
+        if cost is not None and cost.limit_errors():
+            return document, operation, cost.limit_errors()
+        return document, operation, []
+
+    def _execute(self, document, payload, root_value=None):
+        return execute(
+            self.graphql_schema,
+            document,
+            root_value=root_value,
+            context_value=self.context.for_event(),
+            variable_values=payload.get('variables'),
+            operation_name=payload.get('operationName'),
+            middleware=list(instantiate_middleware(graphene_settings.MIDDLEWARE)),
+        )
+
+    def _result_message(self, operation_id, result):
+        data = {'data': result.data}
+        if result.errors:
+            data['errors'] = [error.formatted for error in result.errors]
+        return {'id': operation_id, 'type': 'next', 'payload': data}
+
+    async def operate(self, operation_id, payload):
+        try:
+            document, operation, errors = self._prepare(payload)
+            if errors:
+                await self.send({
+                    'id': operation_id, 'type': 'error',
+                    'payload': [error.formatted for error in errors],
+                })
+                return
+            if operation.operation != OperationType.SUBSCRIPTION:
+                result = await run_in_executor('RESOLVER', self._execute, document, payload)
+                await self.send(self._result_message(operation_id, result))
+            else:
+                await self.subscribe(operation_id, document, operation, payload)
+            await self.send({'id': operation_id, 'type': 'complete'})
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('Subscription %s failed', operation_id)
+            await self.send({
+                'id': operation_id, 'type': 'error',
+                'payload': [{'message': 'Internal server error'}],
+            })
+        finally:
+            self.operations.pop(operation_id, None)
+
+    async def subscribe(self, operation_id, document, operation, payload):
+        field = root_field_names(operation, document_fragments(document))[0]
+        stream = await create_source_event_stream(
+            self.graphql_schema,
+            document,
+            context_value=self.context,
+            variable_values=payload.get('variables'),
+            operation_name=payload.get('operationName'),
+        )
+        if isinstance(stream, ExecutionResult):
+            await self.send({
+                'id': operation_id, 'type': 'error',
+                'payload': [error.formatted for error in stream.errors],
+            })
+            return
+        ACTIVE_SUBSCRIPTIONS.inc(field=field)
+        try:
+            async for message in stream:
+                result = await run_in_executor('RESOLVER', self._execute, document, payload, message)
+                await self.send(self._result_message(operation_id, result))
+                SUBSCRIPTION_EVENTS.inc(field=field)
+                FAN_OUT_LATENCY.observe(time.time() - message['published_at'], field=field)
+        finally:
+            ACTIVE_SUBSCRIPTIONS.dec(field=field)
+            await stream.aclose()
+
+
+class GraphQLWebSocketApp:
+    """
+    ASGI application serving GraphQL over websockets.
+    """
+
+    def __init__(self, schema=None):
+        self.schema = schema
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'websocket':
+            raise ValueError(f"GraphQLWebSocketApp cannot handle {scope['type']} connections")
+        schema = self.schema
+        if schema is None:
+            from .schema import schema
+        await GraphQLWebSocketConnection(schema, scope, receive, send).run()
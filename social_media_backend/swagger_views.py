@@ -835,13 +835,18 @@ def create_comment(request):
     **GraphQL Equivalent:**
     ```graphql
     query {
-      searchPosts(query: "GraphQL") {
-        id
-        content
-        author { username }
-        createdAt
-        likesCount
-        commentsCount
+      searchPosts(query: "GraphQL", first: 20) {
+        edges {
+          node {
+            id
+            content
+            author { username }
+            createdAt
+            likesCount
+            commentsCount
+          }
+        }
+        pageInfo { hasNextPage endCursor }
       }
     }
     ```
@@ -888,13 +893,18 @@ def search_posts(request):
         'message': 'Use GraphQL endpoint: /graphql/',
         'query': '''
         query SearchPosts {
-          searchPosts(query: "GraphQL") {
-            id
-            content
-            author { username }
-            createdAt
-            likesCount
-            commentsCount
+          searchPosts(query: "GraphQL", first: 20) {
+            edges {
+              node {
+                id
+                content
+                author { username }
+                createdAt
+                likesCount
+                commentsCount
+              }
+            }
+            pageInfo { hasNextPage endCursor }
           }
         }
         ''',
@@ -0,0 +1,674 @@
+import asyncio
+import json
+import os
+import pickle
+import tempfile
+import threading
+from unittest import mock
+
+import graphene
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from graphql import create_source_event_stream, parse
+
+from interactions.notifications import notify
+from posts import timelines
+from posts.models import Comment, Post
+from users.models import Follow, User
+
+from . import persisted_queries, pubsub
+from .async_graphql import AsyncNexusGraphQLView, ConcurrentExecutionContext, concurrent_resolver
+from .dataloaders import Loaders, ModelLoader
+from .graphql_testing import execute_operation
+from .graphql_view import NexusGraphQLView
+from .object_cache import get_object, get_object_cache
+from .persisted_queries import DocumentCache, query_hash
+from .rate_limit import RateLimitExceeded, SlidingWindowLimiter, parse_rate, sliding_window_wait
+from .schema import schema
+from .subscriptions import SubscriptionContext
+
+
+class DataLoaderTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors = [
+            User.objects.create_user(username=name, email=f'{name}@example.com', password='secret')
+            for name in ('ann', 'bob', 'cid')
+        ]
+        cls.post = Post.objects.create(author=cls.authors[0], content='hello')
+        cls.comments = [
+            Comment.objects.create(post=cls.post, author=author, content=f'by {author.username}')
+            for author in cls.authors + cls.authors
+        ]
+
+    def setUp(self):
+        caches['default'].clear()
+        for model in (User, Post):
+            get_object_cache(model).local.clear()
+
+    def test_queued_keys_are_fetched_in_one_query(self):
+        loader = ModelLoader(Comment)
+        for comment in self.comments:
+            loader.queue(comment.pk)
+        with self.assertNumQueries(1):
+            loaded = [loader.load(comment.pk) for comment in self.comments]
+        self.assertEqual(loaded, self.comments)
+
+    def test_results_and_misses_are_cached(self):
+        loader = ModelLoader(Comment)
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                loader.load_many([self.comments[0].pk, 0, self.comments[0].pk]),
+                [self.comments[0], None, self.comments[0]],
+            )
+        with self.assertNumQueries(0):
+            self.assertIsNone(loader.load(0))
+            self.assertEqual(loader.load(str(self.comments[0].pk)), self.comments[0])
+
+    def test_collect_queues_foreign_keys(self):
+        loaders = Loaders()
+        comments = list(Comment.objects.order_by('pk'))
+        loaders.collect(comments)
+        # Every author of the page and their post, in one query each
+        with self.assertNumQueries(2):
+            authors = [loaders.users.load(comment.author_id) for comment in comments]
+            self.assertEqual(loaders.posts.load(self.post.pk), self.post)
+        self.assertEqual(authors, self.authors + self.authors)
+        # Collected rows are primed
+        with self.assertNumQueries(0):
+            self.assertEqual(loaders.comments.load(comments[0].pk), comments[0])
+
+    def test_collect_skips_related_rows_already_joined(self):
+        loaders = Loaders()
+        loaders.collect(list(Comment.objects.select_related('author')))
+        self.assertEqual(loaders.users._queue, set())
+        self.assertEqual(loaders.posts._queue, {self.post.pk})
+
+
+class SlidingWindowWaitTests(TestCase):
+    def test_fits_when_under_the_limit(self):
+        self.assertEqual(sliding_window_wait(0, 0, 10, 60, 0), 0)
+        self.assertEqual(sliding_window_wait(0, 9, 10, 60, 30), 0)
+
+    def test_last_slot_of_the_window(self):
+        # 5 * 0.5 + 4 + 1 == 7.5: the hit that reaches the limit is accepted
+        self.assertEqual(sliding_window_wait(5, 4, 8, 60, 30), 0)
+        self.assertGreater(sliding_window_wait(5, 5, 8, 60, 30), 0)
+
+    def test_previous_window_counts_fully_at_the_boundary(self):
+        # Right after the boundary the whole previous window still overlaps
+        wait = sliding_window_wait(10, 0, 10, 60, 0)
+        self.assertAlmostEqual(wait, 6.0)
+        self.assertEqual(sliding_window_wait(10, 0, 10, 60, wait), 0)
+        self.assertGreater(sliding_window_wait(10, 0, 10, 60, wait - 0.01), 0)
+
+    def test_previous_window_has_slid_out_at_the_end(self):
+        # Less than 1% of the previous window is left, but it still counts
+        self.assertGreater(sliding_window_wait(10, 9, 10, 60, 59.9), 0)
+        self.assertEqual(sliding_window_wait(10, 9, 10, 60, 60), 0)
+
+    def test_full_current_window_waits_for_the_next_one(self):
+        wait = sliding_window_wait(0, 10, 10, 60, 45)
+        # 15s to the boundary, then 6s for one of the 10 hits to slide out
+        self.assertAlmostEqual(wait, 21.0)
+        self.assertEqual(sliding_window_wait(10, 0, 10, 60, wait - 15), 0)
+
+    def test_zero_limit(self):
+        self.assertEqual(sliding_window_wait(0, 0, 0, 60, 10), 60)
+
+    def test_cost(self):
+        self.assertEqual(sliding_window_wait(0, 7, 10, 60, 30, cost=3), 0)
+        self.assertGreater(sliding_window_wait(0, 8, 10, 60, 30, cost=3), 0)
+        # 6 * 0.5 + 0 + 4 > 6: wait until 2 / 6 of the previous window is left
+        self.assertAlmostEqual(sliding_window_wait(6, 0, 6, 60, 30, cost=4), 10.0)
+        self.assertEqual(sliding_window_wait(0, 0, 5, 60, 0, cost=6), 60)
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate('100/m'), (100, 60))
+        self.assertEqual(parse_rate('10/30s'), (10, 30))
+        self.assertEqual(parse_rate('5 / 2h'), (5, 7200))
+        self.assertIsNone(parse_rate(None))
+        with self.assertRaises(ValueError):
+            parse_rate('100 per minute')
+
+
+class SlidingWindowLimiterTests(TestCase):
+    def setUp(self):
+        self.cache = caches['default']
+        self.cache.clear()
+        self.limiter = SlidingWindowLimiter(self.cache)
+
+    def test_rejects_the_hit_over_the_limit(self):
+        limits = [('operations:user:1', 3, 60, 1)]
+        for now in (0, 1, 2):
+            self.limiter.hit(limits, now=now)
+        with self.assertRaises(RateLimitExceeded) as context:
+            self.limiter.hit(limits, now=3)
+        self.assertEqual(context.exception.scope, 'operations')
+        # 57s to the boundary plus 20s for one of the 3 hits to slide out
+        self.assertEqual(context.exception.retry_after, 77)
+
+    def test_window_boundary(self):
+        limits = [('operations:user:1', 3, 60, 1)]
+        for now in (57, 58, 59.999):
+            self.limiter.hit(limits, now=now)
+        with self.assertRaises(RateLimitExceeded) as context:
+            self.limiter.hit(limits, now=60)
+        self.assertEqual(context.exception.retry_after, 20)
+        self.limiter.hit(limits, now=80)
+        with self.assertRaises(RateLimitExceeded):
+            self.limiter.hit(limits, now=80)
+
+    def test_rejected_hits_are_not_counted(self):
+        limits = [('operations:user:1', 2, 60, 1), ('createPost:user:1', 1, 60, 1)]
+        self.limiter.hit(limits, now=0)
+        for _ in range(3):
+            with self.assertRaises(RateLimitExceeded) as context:
+                self.limiter.hit(limits, now=1)
+            self.assertEqual(context.exception.scope, 'createPost')
+        # Only the accepted hit counted against the tier limit
+        self.limiter.hit(limits[:1], now=2)
+
+    def test_clients_are_counted_separately(self):
+        self.limiter.hit([('operations:user:1', 1, 60, 1)], now=0)
+        self.limiter.hit([('operations:user:2', 1, 60, 1)], now=0)
+
+    def test_cost_counts_several_hits(self):
+        limits = [('createPost:user:1', 5, 60, 3)]
+        self.limiter.hit(limits, now=0)
+        with self.assertRaises(RateLimitExceeded):
+            self.limiter.hit(limits, now=1)
+        # The rejected hits were not counted: two more still fit
+        self.limiter.hit([('createPost:user:1', 5, 60, 2)], now=2)
+
+    def test_cost_over_the_limit_never_fits(self):
+        with self.assertRaises(RateLimitExceeded) as context:
+            self.limiter.hit([('createPost:user:1', 5, 60, 6)], now=0)
+        self.assertEqual(context.exception.retry_after, 60)
+
+
+@override_settings(RATE_LIMITS={
+    'TIERS': {'anonymous': '2/m'},
+    'OPERATIONS': {'createPost': {'default': '3/m'}},
+})
+class GraphQLRateLimitTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.view = NexusGraphQLView.as_view(schema=schema)
+
+    def post(self, query):
+        request = RequestFactory().post(
+            '/graphql/', json.dumps({'query': query}), content_type='application/json'
+        )
+        return self.view(request)
+
+    def test_over_the_limit_is_429(self):
+        for _ in range(2):
+            self.assertEqual(self.post('{ __typename }').status_code, 200)
+        response = self.post('{ __typename }')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+
+    def test_counted_once_per_operation(self):
+        for _ in range(2):
+            self.assertEqual(self.post('{ a: __typename b: __typename }').status_code, 200)
+        self.assertEqual(self.post('{ __typename }').status_code, 429)
+
+    def create_posts(self, count):
+        fields = ' '.join(
+            f'p{i}: createPost(content: "spam") {{ success }}' for i in range(count)
+        )
+        return self.post(f'mutation {{ {fields} }}')
+
+    def test_aliased_fields_count_once_each(self):
+        self.assertEqual(self.create_posts(2).status_code, 200)
+        # 2 + 2 createPost selections exceed 3 per minute
+        self.assertEqual(self.create_posts(2).status_code, 429)
+        self.assertEqual(self.create_posts(1).status_code, 200)
+
+    def test_aliased_fields_over_the_limit_are_rejected(self):
+        self.assertEqual(self.create_posts(30).status_code, 429)
+        self.assertEqual(self.create_posts(3).status_code, 200)
+
+    @override_settings(RATE_LIMITS={'ENABLED': False, 'TIERS': {'anonymous': '2/m'}})
+    def test_disabled(self):
+        for _ in range(3):
+            self.assertEqual(self.post('{ __typename }').status_code, 200)
+
+
+class GraphQLViewTestCase(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.view = NexusGraphQLView.as_view(schema=schema)
+
+    def post(self, query, variables=None, user=None, **data):
+        request = RequestFactory().post(
+            '/graphql/', json.dumps({'query': query, 'variables': variables, **data}),
+            content_type='application/json'
+        )
+        if user is not None:
+            request.user = user
+        response = self.view(request)
+        return response, json.loads(response.content)
+
+
+@override_settings(QUERY_COST={
+    'MAX_DEPTH': 4,
+    'MAX_COST': 200,
+    'MAX_ALIASES': 2,
+    'LIST_SIZES': {'Query.allUsers': 150},
+    'FIELD_COSTS': {'Query.searchUsers': 10},
+})
+class QueryCostTests(GraphQLViewTestCase):
+    def cost(self, query, variables=None):
+        response, body = self.post(query, variables)
+        self.assertEqual(response.status_code, 200, body)
+        return body['extensions']['cost']
+
+    def test_lists_multiply_their_selection(self):
+        cost = self.cost('{ allPosts(first: 5) { id author { username } } }')
+        self.assertEqual(cost, {'requested': 10, 'maximum': 200, 'depth': 3, 'aliases': 0})
+
+    def test_size_from_variables_and_defaults(self):
+        query = 'query($n: Int = 3) { allPosts(first: $n) { author { id } } }'
+        self.assertEqual(self.cost(query)['requested'], 6)
+        self.assertEqual(self.cost(query, {'n': 7})['requested'], 14)
+
+    def test_unbounded_lists_and_field_costs(self):
+        self.assertEqual(self.cost('{ allPosts { id } }')['requested'], 20)
+        self.assertEqual(self.cost('{ searchUsers(query: "a", first: 2) { id } }')['requested'], 20)
+
+    def test_connection_edges_are_counted_once(self):
+        cost = self.cost('{ allPostsConnection(first: 4) { edges { node { id } } pageInfo { hasNextPage } } }')
+        # 4 * (connection + edges + node) + pageInfo
+        self.assertEqual(cost['requested'], 16)
+
+    def test_fragments_count_and_introspection_is_free(self):
+        cost = self.cost("""{ __typename allPosts(first: 2) { ...author } }
+            fragment author on PostType { author { id } }""")
+        self.assertEqual(cost['requested'], 4)
+
+    def assert_rejected(self, query, code):
+        with self.assertNumQueries(0):
+            response, body = self.post(query)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['extensions']['code'] for error in body['errors']], [code])
+        self.assertNotIn('data', body)
+
+    def test_too_deep(self):
+        self.assert_rejected(
+            '{ allPosts(first: 1) { comments { post { author { id } } } } }', 'QUERY_TOO_DEEP'
+        )
+
+    def test_too_complex(self):
+        self.assertEqual(self.cost('{ allUsers { id } }')['requested'], 150)
+        self.assert_rejected('{ allUsers { id } allPosts(first: 60) { id } }', 'QUERY_TOO_COMPLEX')
+
+    def test_too_many_aliases(self):
+        self.assert_rejected(
+            '{ a: allPosts(first: 1) { id } b: allPosts(first: 1) { x: id } }', 'TOO_MANY_ALIASES'
+        )
+
+    @override_settings(QUERY_COST={'ENABLED': False, 'MAX_DEPTH': 1})
+    def test_disabled(self):
+        response, body = self.post('{ allPosts(first: 1) { author { id } } }')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('cost', body.get('extensions', {}))
+
+
+class PersistedQueryTests(GraphQLViewTestCase):
+    query = '{ allPosts(first: 1) { id } }'
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(persisted_queries, '_document_cache', DocumentCache(2))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def extensions(self, sha256=None):
+        return {'persistedQuery': {'version': 1, 'sha256Hash': sha256 or query_hash(self.query)}}
+
+    def error_codes(self, body):
+        return [error['extensions']['code'] for error in body['errors']]
+
+    def test_unknown_hash_then_registration(self):
+        response, body = self.post(None, extensions=self.extensions())
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.error_codes(body), ['PERSISTED_QUERY_NOT_FOUND'])
+
+        response, body = self.post(self.query, extensions=self.extensions())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body['data'], {'allPosts': []})
+
+        response, body = self.post(None, extensions=self.extensions())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body['data'], {'allPosts': []})
+
+    def test_hash_mismatch_is_not_registered(self):
+        wrong = query_hash('{ __typename }')
+        response, body = self.post(self.query, extensions=self.extensions(wrong))
+        self.assertEqual(self.error_codes(body), ['PERSISTED_QUERY_HASH_MISMATCH'])
+        response, body = self.post(None, extensions=self.extensions(wrong))
+        self.assertEqual(self.error_codes(body), ['PERSISTED_QUERY_NOT_FOUND'])
+
+    def test_persisted_get_is_cacheable(self):
+        self.post(self.query, extensions=self.extensions())
+        request = RequestFactory().get('/graphql/', {'extensions': json.dumps(self.extensions())})
+        response = self.view(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('max-age=60', response['Cache-Control'])
+
+    def test_allow_list(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as manifest:
+            json.dump({query_hash(self.query): self.query}, manifest)
+        self.addCleanup(os.remove, manifest.name)
+        with override_settings(PERSISTED_QUERIES={'ALLOW_LIST': True, 'MANIFEST': manifest.name}):
+            for query, extensions in ((self.query, None), (None, self.extensions())):
+                response, body = self.post(query, extensions=extensions)
+                self.assertEqual(body['data'], {'allPosts': []})
+            response, body = self.post('{ __typename }')
+            self.assertEqual(self.error_codes(body), ['PERSISTED_QUERY_NOT_ALLOWED'])
+
+    def test_documents_are_parsed_once(self):
+        with mock.patch('social_media_backend.graphql_view.parse', wraps=parse) as parse_document:
+            for _ in range(3):
+                self.post(self.query)
+        parse_document.assert_called_once_with(self.query)
+
+    def test_document_cache_is_bounded(self):
+        documents = DocumentCache(2)
+        for query in ('{ a }', '{ b }'):
+            documents.add(query, parse(query))
+        documents.get('{ a }')
+        documents.add('{ c }', parse('{ c }'))
+        self.assertEqual(len(documents), 2)
+        self.assertIsNone(documents.get('{ b }'))
+        self.assertIsNotNone(documents.get('{ a }'))
+
+
+class ResponseCacheTests(GraphQLViewTestCase):
+    query = '{ allPosts(first: 5) { content author { username } } }'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='secret'
+        )
+        Post.objects.create(author=cls.author, content='first')
+
+    def contents(self, body):
+        return [post['content'] for post in body['data']['allPosts']]
+
+    def cache_status(self, body):
+        return body.get('extensions', {}).get('responseCache')
+
+    def test_anonymous_hit(self):
+        response, body = self.post(self.query)
+        self.assertEqual(self.cache_status(body), {'status': 'MISS', 'maxAge': 30})
+        with self.assertNumQueries(0):
+            response, cached = self.post('{allPosts(first:5){content author{username}}}')
+        self.assertEqual(self.cache_status(cached), {'status': 'HIT', 'maxAge': 30})
+        self.assertEqual(cached['data'], body['data'])
+
+    def test_create_post_invalidates(self):
+        self.post(self.query)
+        with self.captureOnCommitCallbacks(execute=True):
+            result, _ = execute_operation(
+                'mutation { createPost(content: "second") { success } }', user=self.author
+            )
+        self.assertTrue(result.data['createPost']['success'])
+        response, body = self.post(self.query)
+        self.assertEqual(self.cache_status(body)['status'], 'MISS')
+        self.assertEqual(self.contents(body), ['second', 'first'])
+
+    def test_variables_are_part_of_the_key(self):
+        query = 'query($first: Int) { allPosts(first: $first) { content } }'
+        self.post(query, {'first': 1})
+        response, body = self.post(query, {'first': 2})
+        self.assertEqual(self.cache_status(body)['status'], 'MISS')
+
+    def test_uncacheable_operations(self):
+        for query, user in (
+            (self.query, self.author),
+            ('{ allPosts(visibility: "private") { content } }', None),
+            ('{ allPosts { content } feed { content } }', None),
+            ('{ allPosts { content comments { content } } }', None),
+        ):
+            with self.subTest(query=query, user=user):
+                for _ in range(2):
+                    response, body = self.post(query, user=user)
+                self.assertIsNone(self.cache_status(body))
+
+
+class ObjectCacheTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.object_cache = get_object_cache(User)
+        self.object_cache.local.clear()
+        self.user = User.objects.create_user(
+            username='cached', email='cached@example.com', password='secret'
+        )
+
+    def cached_entries(self):
+        version = self.object_cache._versions([self.user.pk])[self.user.pk]
+        return [
+            caches['default'].get(self.object_cache._key(self.user.pk, version)),
+            self.object_cache.local.get(self.user.pk),
+        ]
+
+    def assert_password_not_cached(self):
+        for data in self.cached_entries():
+            self.assertIsNotNone(data)
+            self.assertNotIn(self.user.password.encode(), data)
+            self.assertNotIn('password', pickle.loads(data).__dict__)
+
+    def test_password_is_not_cached(self):
+        cached = get_object(User, self.user.pk)
+        self.assert_password_not_cached()
+        self.assertEqual(cached.username, 'cached')
+        # Loaded from the database on access
+        with self.assertNumQueries(1):
+            self.assertTrue(cached.check_password('secret'))
+
+    def test_password_fetched_by_a_loader_is_not_cached(self):
+        loaded = ModelLoader(User).load(self.user.pk)
+        self.assertEqual(loaded.username, 'cached')
+        self.assert_password_not_cached()
+
+    def test_saving_a_cached_user_keeps_the_password(self):
+        cached = get_object(User, self.user.pk)
+        cached.bio = 'hello'
+        cached.save()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.bio, 'hello')
+        self.assertTrue(self.user.check_password('secret'))
+
+
+@override_settings(TIMELINES={'CELEBRITY_FOLLOWER_THRESHOLD': 3})
+class SubscriptionTests(TransactionTestCase):
+    def setUp(self):
+        self.reader, self.friend, self.celebrity, self.stranger = [
+            User.objects.create_user(username=name, email=f'{name}@example.com', password='secret')
+            for name in ('reader', 'friend', 'celebrity', 'stranger')
+        ]
+        for author in (self.friend, self.celebrity):
+            Follow.objects.create(follower=self.reader, following=author)
+        User.objects.filter(pk=self.celebrity.pk).update(followers_count=5)
+        self.celebrity.refresh_from_db()
+        for patcher in (
+            mock.patch.object(pubsub, '_backend', pubsub.InMemoryPubSub()),
+            mock.patch.object(timelines, '_backend', timelines.InMemoryTimelineBackend()),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def receive(self, query, user, publish, count=1):
+        """Payloads of the first ``count`` events of subscription ``query``."""
+        async def scenario():
+            stream = await create_source_event_stream(
+                schema.graphql_schema, parse(query),
+                context_value=SubscriptionContext({}, user),
+            )
+            first = asyncio.ensure_future(stream.__anext__())
+            # Let the subscription reach the pub/sub before publishing
+            for _ in range(50):
+                if pubsub.get_pubsub()._subscribers:
+                    break
+                await asyncio.sleep(0.01)
+            await sync_to_async(publish, thread_sensitive=False)()
+            messages = [await asyncio.wait_for(first, 5)]
+            while len(messages) < count:
+                messages.append(await asyncio.wait_for(stream.__anext__(), 5))
+            await stream.aclose()
+            return [(message['event'], message['payload']) for message in messages]
+
+        return async_to_sync(scenario)()
+
+    def create_posts(self, *authors):
+        for author in authors:
+            timelines.fan_out(Post.objects.create(author=author, content=f'by {author.username}'))
+
+    def post_ids(self, *authors):
+        return [Post.objects.get(author=author).pk for author in authors]
+
+    def test_feed_items_of_followed_authors(self):
+        events = self.receive(
+            'subscription { feedItemAdded { id } }', self.reader,
+            lambda: self.create_posts(self.stranger, self.friend, self.celebrity), count=2,
+        )
+        self.assertEqual(
+            events,
+            [('feedItemAdded', {'id': pk}) for pk in self.post_ids(self.friend, self.celebrity)],
+        )
+
+    def test_celebrity_posts_reach_only_their_followers(self):
+        events = self.receive(
+            'subscription { feedItemAdded { id } }', self.stranger,
+            lambda: self.create_posts(self.celebrity, self.stranger),
+        )
+        self.assertEqual(events, [('feedItemAdded', {'id': self.post_ids(self.stranger)[0]})])
+
+    def test_notifications_reach_only_their_recipient(self):
+        notifications = []
+
+        def publish():
+            for recipient in (self.stranger, self.reader):
+                notifications.append(notify(recipient, self.friend, 'follow', 'hi')[0])
+
+        events = self.receive('subscription { notificationCreated { id } }', self.reader, publish)
+        self.assertEqual(events, [('notificationCreated', {'id': notifications[1].pk})])
+
+    def test_merged_notifications_are_announced_again(self):
+        post = Post.objects.create(author=self.reader, content='liked')
+
+        def like(sender):
+            return notify(
+                self.reader, sender, 'like', 'liked your post',
+                content_type=ContentType.objects.get_for_model(Post), object_id=post.pk,
+            )[0]
+
+        notification = like(self.friend)
+        events = self.receive(
+            'subscription { notificationCreated { id } }', self.reader, lambda: like(self.stranger)
+        )
+        self.assertEqual(events, [('notificationCreated', {'id': notification.pk})])
+
+    def test_unread_count_changes_when_a_notification_is_read(self):
+        notification = notify(self.reader, self.friend, 'follow', 'hi')[0]
+
+        def read():
+            notification.is_read = True
+            notification.save()
+
+        events = self.receive('subscription { unreadCountChanged }', self.reader, read)
+        self.assertEqual(events, [('unreadCountChanged', {})])
+
+
+class ConcurrentExecutionTests(SimpleTestCase):
+    def execute(self, query):
+        barrier = threading.Barrier(2, timeout=5)
+
+        class Query(graphene.ObjectType):
+            left = graphene.String()
+            right = graphene.String()
+            plain = graphene.String()
+            broken = graphene.String()
+
+            @concurrent_resolver
+            def resolve_left(root, info):
+                # Only returns if ``right`` is resolved at the same time
+                barrier.wait()
+                return 'left'
+
+            @concurrent_resolver
+            def resolve_right(root, info):
+                barrier.wait()
+                return 'right'
+
+            def resolve_plain(root, info):
+                return threading.current_thread().name
+
+            @concurrent_resolver
+            def resolve_broken(root, info):
+                raise ValueError('broken')
+
+        return graphene.Schema(query=Query).execute(
+            query, execution_context_class=ConcurrentExecutionContext
+        )
+
+    def test_concurrent_root_fields_run_in_parallel(self):
+        result = self.execute('{ right plain left }')
+        self.assertIsNone(result.errors)
+        self.assertEqual(list(result.data), ['right', 'plain', 'left'])
+        self.assertEqual(result.data['left'], 'left')
+        self.assertEqual(result.data['plain'], threading.current_thread().name)
+
+    def test_errors_stay_on_their_field(self):
+        result = self.execute('{ plain broken }')
+        self.assertEqual(result.data['broken'], None)
+        self.assertEqual(result.errors[0].path, ['broken'])
+        self.assertEqual(result.data['plain'], threading.current_thread().name)
+
+
+@override_settings(TIMELINES={'CELEBRITY_FOLLOWER_THRESHOLD': 3})
+class AsyncGraphQLViewTests(TransactionTestCase):
+    query = """{
+        allPosts(first: 5) { content author { username } }
+        feed(first: 5) { content }
+        unreadCount
+        myNotifications { message }
+        trendingHashtags { name }
+    }"""
+
+    def setUp(self):
+        caches['default'].clear()
+        self.reader, self.friend = [
+            User.objects.create_user(username=name, email=f'{name}@example.com', password='secret')
+            for name in ('reader', 'friend')
+        ]
+        Follow.objects.create(follower=self.reader, following=self.friend)
+        patcher = mock.patch.object(timelines, '_backend', timelines.InMemoryTimelineBackend())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for i in range(3):
+            timelines.fan_out(Post.objects.create(author=self.friend, content=f'post {i}'))
+        notify(self.reader, self.friend, 'follow', 'friend followed you')
+
+    def request(self):
+        request = RequestFactory().post(
+            '/graphql/', json.dumps({'query': self.query}), content_type='application/json'
+        )
+        request.user = self.reader
+        return request
+
+    def test_same_result_as_the_sync_view(self):
+        response = NexusGraphQLView.as_view(schema=schema)(self.request())
+        async_response = async_to_sync(AsyncNexusGraphQLView.as_view(schema=schema))(self.request())
+        self.assertEqual(async_response.status_code, 200)
+        data = json.loads(response.content)['data']
+        self.assertEqual(json.loads(async_response.content)['data'], data)
+        self.assertEqual(len(data['feed']), 3)
+        self.assertEqual(data['unreadCount'], 1)
@@ -0,0 +1,216 @@
+"""
+Operation-level tracing of GraphQL requests
+
+``NexusGraphQLView`` opens an ``OperationTrace`` per operation and times its
+parse, validate and execute phases. A sampled fraction of operations
+(``TRACING['SAMPLE_RATE']``) is traced in detail:
+
+- ``TracingMiddleware`` times every resolver except plain attribute reads and
+  keeps the durations on the trace instead of logging them;
+- the SQL statements run during execution are counted and timed through a
+  database ``execute_wrapper``.
+
+When the operation finishes its trace is folded into the process metrics
+(``social_media_backend.metrics.REGISTRY``) in one pass, which the internal
+``metrics/`` endpoint renders in the Prometheus text format. Sampled traces can
+also be returned under ``extensions.tracing`` of the response.
+"""
+
+import random
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import partial
+
+from django.conf import settings
+from django.db import connection
+from django.utils.crypto import constant_time_compare
+from graphene.types.resolver import attr_resolver, dict_or_attr_resolver, dict_resolver
+
+from .metrics import COUNT_BUCKETS, REGISTRY
+
+DEFAULTS = {
+    'ENABLED': True,
+    # Fraction of operations traced per resolver and per SQL query
+    'SAMPLE_RATE': 0.1,
+    # Distinct operation names kept as metric labels, the rest count as "other"
+    'MAX_OPERATION_NAMES': 200,
+    # Return sampled traces under extensions.tracing
+    'EXTENSIONS': False,
+    # The metrics endpoint requires "Authorization: Bearer <token>" when set,
+    # and a request from METRICS_ALLOWED_IPS otherwise
+    'METRICS_TOKEN': '',
+    'METRICS_ALLOWED_IPS': ('127.0.0.1', '::1'),
+}
+
+OPERATIONS = REGISTRY.counter(
+    'graphql_operations_total', 'GraphQL operations handled.',
+    ('operation', 'type', 'status')
+)
+OPERATION_DURATION = REGISTRY.histogram(
+    'graphql_operation_duration_seconds', 'Duration of GraphQL operations.',
+    ('operation', 'type')
+)
+PHASE_DURATION = REGISTRY.histogram(
+    'graphql_phase_duration_seconds', 'Duration of the parse, validate and execute phases.',
+    ('phase',)
+)
+RESOLVER_DURATION = REGISTRY.histogram(
+    'graphql_resolver_duration_seconds', 'Duration of field resolvers (sampled operations).',
+    ('field',)
+)
+SQL_QUERIES = REGISTRY.histogram(
+    'graphql_operation_sql_queries', 'SQL queries per operation (sampled operations).',
+    ('operation',), buckets=COUNT_BUCKETS
+)
+SQL_DURATION = REGISTRY.histogram(
+    'graphql_operation_sql_duration_seconds', 'SQL time per operation (sampled operations).',
+    ('operation',)
+)
+
+_TRIVIAL_RESOLVERS = (attr_resolver, dict_or_attr_resolver, dict_resolver)
+_trivial_fields = {}
+_operation_names = set()
+
+
+def get_tracing_settings():
+    return {**DEFAULTS, **getattr(settings, 'TRACING', {})}
+
+
+def operation_label(name):
+    """Metric label of an operation name, bounded to ``MAX_OPERATION_NAMES``."""
+    name = name or 'anonymous'
+    if name not in _operation_names:
+        if len(_operation_names) >= get_tracing_settings()['MAX_OPERATION_NAMES']:
+            return 'other'
+        _operation_names.add(name)
+    return name
+
+
+class OperationTrace:
+    """
+    Timings of one GraphQL operation.
+    """
+
+    def __init__(self, sampled=False):
+        self.sampled = sampled
+        self.operation_name = None
+        self.operation_type = None
+        self.phases = {}
+        self.resolvers = defaultdict(list)
+        self.sql_count = 0
+        self.sql_duration = 0.0
+        self.duration = None
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def _execute_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_count += 1
+            self.sql_duration += time.perf_counter() - start
+
+    @contextmanager
+    def capture_sql(self):
+        if not self.sampled:
+            yield
+            return
+        with connection.execute_wrapper(self._execute_wrapper):
+            yield
+
+    def record_resolver(self, field, duration):
+        self.resolvers[field].append(duration)
+
+    def finish(self, errors=None):
+        """Fold the trace into the process metrics."""
+        self.duration = time.perf_counter() - self._started
+        operation = operation_label(self.operation_name)
+        operation_type = self.operation_type or 'unknown'
+        OPERATIONS.inc(operation=operation, type=operation_type, status='error' if errors else 'success')
+        OPERATION_DURATION.observe(self.duration, operation=operation, type=operation_type)
+        for phase, duration in self.phases.items():
+            PHASE_DURATION.observe(duration, phase=phase)
+        if self.sampled and 'execute' in self.phases:
+            for field, durations in self.resolvers.items():
+                RESOLVER_DURATION.observe_many(durations, field=field)
+            SQL_QUERIES.observe(self.sql_count, operation=operation)
+            SQL_DURATION.observe(self.sql_duration, operation=operation)
+
+    def as_extension(self):
+        """Summary of the trace in milliseconds."""
+        milliseconds = lambda seconds: round(seconds * 1000, 3)
+        return {
+            'operation': self.operation_name,
+            'duration': milliseconds(self.duration or 0.0),
+            'phases': {phase: milliseconds(duration) for phase, duration in self.phases.items()},
+            'sql': {'count': self.sql_count, 'duration': milliseconds(self.sql_duration)},
+            'resolvers': {
+                field: {'count': len(durations), 'duration': milliseconds(sum(durations))}
+                for field, durations in sorted(self.resolvers.items())
+            },
+        }
+
+
+def start_trace(request):
+    """Attach a new trace to the request, or ``None`` when tracing is disabled."""
+    config = get_tracing_settings()
+    if not config['ENABLED']:
+        return None
+    trace = OperationTrace(sampled=random.random() < config['SAMPLE_RATE'])
+    request._graphql_trace = trace
+    return trace
+
+
+def get_trace(context):
+    context = getattr(context, 'context', context)
+    return getattr(context, '_graphql_trace', None)
+
+
+def _is_trivial(info):
+    """Whether the field is resolved by graphene's default attribute lookup."""
+    key = (info.parent_type.name, info.field_name)
+    trivial = _trivial_fields.get(key)
+    if trivial is None:
+        resolver = info.parent_type.fields[info.field_name].resolve
+        trivial = _trivial_fields[key] = (
+            isinstance(resolver, partial) and resolver.func in _TRIVIAL_RESOLVERS
+        )
+    return trivial
+
+
+class TracingMiddleware:
+    """
+    GraphQL middleware timing resolvers of sampled operations.
+
+    Durations include the middlewares listed after this one (e.g. the
+    DataLoader evaluating a queryset) and are aggregated per ``Type.field``.
+    """
+
+    def resolve(self, next, root, info, **args):
+        trace = get_trace(info)
+        if trace is None or not trace.sampled or _is_trivial(info):
+            return next(root, info, **args)
+        start = time.perf_counter()
+        try:
+            return next(root, info, **args)
+        finally:
+            trace.record_resolver(
+                f'{info.parent_type.name}.{info.field_name}', time.perf_counter() - start
+            )
+
+
+def metrics_allowed(request):
+    config = get_tracing_settings()
+    if config['METRICS_TOKEN']:
+        header = request.META.get('HTTP_AUTHORIZATION', '')
+        return constant_time_compare(header, f"Bearer {config['METRICS_TOKEN']}")
+    return request.META.get('REMOTE_ADDR') in config['METRICS_ALLOWED_IPS']
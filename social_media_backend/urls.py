@@ -15,7 +15,8 @@ from drf_spectacular.views import (
 
 # Try to import GraphQL safely
 try:
-    from graphene_django.views import GraphQLView
+    from .graphql_view import NexusGraphQLView
+    from .async_graphql import AsyncNexusGraphQLView, get_async_graphql_settings
     from .schema import schema
     GRAPHQL_AVAILABLE = True
 except ImportError:
@@ -145,6 +146,8 @@ urlpatterns = [
     # API endpoints
     path('api/health/', views.api_health, name='api-health'),
     path('api/stats/', views.api_stats, name='api-stats'),
+    # Internal Prometheus metrics
+    path('metrics/', views.metrics, name='metrics'),
     # OpenAPI schema and docs
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
     path('api/docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
@@ -155,8 +158,10 @@ urlpatterns = [
 
 # Add GraphQL if available
 if GRAPHQL_AVAILABLE:
+    # Async view for ASGI deployments (see social_media_backend.async_graphql)
+    graphql_view = AsyncNexusGraphQLView if get_async_graphql_settings()['ENABLED'] else NexusGraphQLView
     urlpatterns.append(
-        path('graphql/', csrf_exempt(GraphQLView.as_view(graphiql=True, schema=schema)), name='graphql')
+        path('graphql/', csrf_exempt(graphql_view.as_view(graphiql=True, schema=schema)), name='graphql')
     )
 
 # Static files handled by WhiteNoise middleware
@@ -1,5 +1,5 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
 from django.views.decorators.cache import cache_page
 from django.core.cache import cache
 from django.db.models import Count
@@ -59,6 +59,15 @@ def api_stats(request):
     
     return JsonResponse(stats)
 
+def metrics(request):
+    """Métriques du processus au format texte Prometheus (usage interne)"""
+    from .metrics import REGISTRY
+    from .tracing import metrics_allowed
+
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 def graphql_schema_info(request):
     """Information sur le schéma GraphQL"""
     schema_info = {
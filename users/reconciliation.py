@@ -0,0 +1,149 @@
+"""
+Reconciliation of denormalized user counters
+
+``followers_count``, ``following_count`` and ``posts_count`` are maintained
+incrementally by the mutations (``social_media_backend.counters``). This module
+recomputes them from the source tables to repair drift, set-based: users are
+scanned in primary-key windows, the true counts come from grouped ``COUNT``
+subqueries, net of the pending shards of sharded counters, the comparison
+happens in SQL so only drifted rows are fetched, and those are locked,
+recounted and written back with ``bulk_update``.
+
+Progress is checkpointed in the cache after every window so an interrupted run
+resumes where it stopped.
+"""
+
+import logging
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from posts.models import Post
+from social_media_backend import counters
+from .models import User, Follow
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_KEY = 'users:reconcile_statistics:last_id'
+
+# Counter column -> (source model, foreign key pointing at the user)
+USER_COUNTERS = {
+    'followers_count': (Follow, 'following'),
+    'following_count': (Follow, 'follower'),
+    'posts_count': (Post, 'author'),
+}
+
+
+def _count_subquery(model, foreign_key):
+    counts = (
+        model._default_manager.filter(**{foreign_key: OuterRef('pk')})
+        .order_by()
+        .values(foreign_key)
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def _pending_subquery(field):
+    from interactions.models import CounterShard
+
+    pending = (
+        CounterShard.objects.filter(
+            content_type=ContentType.objects.get_for_model(User),
+            object_id=OuterRef('pk'),
+            field=field,
+        )
+        .order_by()
+        .values('object_id')
+        .annotate(total=Sum('delta'))
+        .values('total')
+    )
+    return Coalesce(Subquery(pending, output_field=IntegerField()), 0)
+
+
+def _expected_value(field, model, foreign_key):
+    """The column value that, with pending shards, gives the actual count."""
+    actual = _count_subquery(model, foreign_key)
+    if not counters.is_sharded(User, field):
+        return actual
+    return Greatest(actual - _pending_subquery(field), Value(0))
+
+
+def drifted_users(start_id, end_id):
+    """Users in ``[start_id, end_id)`` whose counters differ from the source tables."""
+    annotations = {
+        f'expected_{field}': _expected_value(field, model, foreign_key)
+        for field, (model, foreign_key) in USER_COUNTERS.items()
+    }
+    drift = Q()
+    for field in USER_COUNTERS:
+        drift |= ~Q(**{field: F(f'expected_{field}')})
+    return (
+        User.objects.filter(id__gte=start_id, id__lt=end_id)
+        .only('id', *USER_COUNTERS)
+        .annotate(**annotations)
+        .filter(drift)
+        .order_by('id')
+    )
+
+
+def _repair(users):
+    """Set counters to their actual values, net of pending counter shards."""
+    for user in users:
+        for field in USER_COUNTERS:
+            setattr(user, field, getattr(user, f'expected_{field}'))
+
+
+def _lock_drifted_users(start_id, end_id):
+    """
+    Lock the drifted users of the window, then recount them. The counts are
+    read by a statement that starts after the locks are held: counter updates
+    committed before it are counted, and later ones wait for the repair and
+    apply on top of it. Must run in a transaction.
+    """
+    candidates = list(drifted_users(start_id, end_id).values_list('id', flat=True))
+    if not candidates:
+        return []
+    list(
+        User.objects.select_for_update().filter(id__in=candidates)
+        .order_by('id').values_list('id', flat=True)
+    )
+    return list(drifted_users(start_id, end_id).filter(id__in=candidates))
+
+
+def reconcile_user_statistics(start_id=None, end_id=None, chunk_size=1000, resume=False):
+    """
+    Repair drifted user counters for ids in ``[start_id, end_id)``.
+
+    With ``resume=True`` the scan restarts after the last checkpointed window.
+    Returns ``{'scanned_up_to', 'drifted'}``.
+    """
+    if resume and start_id is None:
+        last_id = cache.get(CHECKPOINT_KEY)
+        start_id = last_id + 1 if last_id is not None else None
+    if start_id is None:
+        start_id = 0
+    if end_id is None:
+        end_id = (User.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+
+    drifted = 0
+    window_start = start_id
+    while window_start < end_id:
+        window_end = min(window_start + chunk_size, end_id)
+        with transaction.atomic():
+            users = _lock_drifted_users(window_start, window_end)
+            if users:
+                _repair(users)
+                User.objects.bulk_update(users, list(USER_COUNTERS), batch_size=chunk_size)
+        drifted += len(users)
+        cache.set(CHECKPOINT_KEY, window_end - 1, None)
+        window_start = window_end
+
+    cache.delete(CHECKPOINT_KEY)
+    if drifted:
+        logger.warning(f"Repaired counters of {drifted} drifted users")
+    return {'scanned_up_to': end_id - 1, 'drifted': drifted}
@@ -11,6 +11,15 @@ from django.db import transaction, IntegrityError
 from django.core.exceptions import ValidationError
 
 from .models import User, Follow
+from posts import tasks as post_tasks
+from social_media_backend import counters
+from social_media_backend.celery import enqueue_on_commit
+from social_media_backend.dataloaders import get_loaders
+from social_media_backend.object_cache import get_object_by
+from social_media_backend.pagination import (
+    MAX_PAGE_SIZE, connection_from_queryset, connection_from_ranked_ids, page_size,
+)
+from .search import get_user_search_backend, index_user_on_commit
 
 
 class UserType(DjangoObjectType):
@@ -20,6 +29,12 @@ class UserType(DjangoObjectType):
     full_name = graphene.String()
     avatar_url = graphene.String()
     
+    # Columns read by custom fields, used by the query planner
+    query_hints = {
+        'full_name': ('first_name', 'last_name'),
+        'avatar_url': ('avatar',),
+    }
+    
     class Meta:
         model = User
         fields = (
@@ -34,6 +49,11 @@ class UserType(DjangoObjectType):
     
     def resolve_avatar_url(self, info):
         return self.get_avatar_url()
+    
+    # Include pending shards of sharded counters (see social_media_backend.counters)
+    resolve_followers_count = counters.resolve_counter('followers_count')
+    resolve_following_count = counters.resolve_counter('following_count')
+    resolve_posts_count = counters.resolve_counter('posts_count')
 
 
 class FollowType(DjangoObjectType):
@@ -45,6 +65,15 @@ class FollowType(DjangoObjectType):
         fields = '__all__'
 
 
+class UserConnection(graphene.relay.Connection):
+    """
+    Relay connection of users, paginated by (created_at, id) cursors of the
+    underlying relationship
+    """
+    class Meta:
+        node = UserType
+
+
 class UserQuery(graphene.ObjectType):
     """
     GraphQL Queries for Users
@@ -59,20 +88,43 @@ class UserQuery(graphene.ObjectType):
     followers = graphene.List(UserType, user_id=graphene.ID(required=True))
     following = graphene.List(UserType, user_id=graphene.ID(required=True))
     
-    # Search
-    search_users = graphene.List(UserType, query=graphene.String(required=True))
+    # Search (ranked by name similarity, verified users and followers first)
+    search_users = graphene.List(
+        UserType,
+        query=graphene.String(required=True),
+        first=graphene.Int()
+    )
+    search_users_connection = graphene.Field(
+        UserConnection,
+        query=graphene.String(required=True),
+        first=graphene.Int(),
+        after=graphene.String()
+    )
+    autocomplete_users = graphene.List(
+        UserType,
+        prefix=graphene.String(required=True),
+        limit=graphene.Int()
+    )
+    
+    # Cursor-paginated connections
+    followers_connection = graphene.Field(
+        UserConnection,
+        user_id=graphene.ID(required=True),
+        first=graphene.Int(),
+        after=graphene.String()
+    )
+    following_connection = graphene.Field(
+        UserConnection,
+        user_id=graphene.ID(required=True),
+        first=graphene.Int(),
+        after=graphene.String()
+    )
     
     def resolve_user(self, info, id):
-        try:
-            return User.objects.get(pk=id)
-        except User.DoesNotExist:
-            return None
+        return get_loaders(info).users.load(id)
     
     def resolve_user_by_username(self, info, username):
-        try:
-            return User.objects.get(username=username)
-        except User.DoesNotExist:
-            return None
+        return get_object_by(User, 'username', username)
     
     @login_required
     def resolve_me(self, info):
@@ -95,14 +147,38 @@ class UserQuery(graphene.ObjectType):
         except User.DoesNotExist:
             return []
     
-    def resolve_search_users(self, info, query):
-        return User.objects.filter(
-            username__icontains=query
-        ) | User.objects.filter(
-            first_name__icontains=query
-        ) | User.objects.filter(
-            last_name__icontains=query
+    def resolve_followers_connection(self, info, user_id, first=None, after=None):
+        follows = Follow.objects.filter(following_id=user_id).select_related('follower')
+        return connection_from_queryset(
+            UserConnection, follows, first, after, node=lambda follow: follow.follower
+        )
+    
+    def resolve_following_connection(self, info, user_id, first=None, after=None):
+        follows = Follow.objects.filter(follower_id=user_id).select_related('following')
+        return connection_from_queryset(
+            UserConnection, follows, first, after, node=lambda follow: follow.following
+        )
+    
+    def resolve_search_users(self, info, query, first=None):
+        user_ids = get_user_search_backend().search(query, limit=page_size(first))
+        return users_in_order(user_ids)
+    
+    def resolve_search_users_connection(self, info, query, first=None, after=None):
+        return connection_from_ranked_ids(
+            UserConnection,
+            lambda offset, limit: get_user_search_backend().search(query, offset=offset, limit=limit),
+            lambda user_ids: User.objects.in_bulk(user_ids),
+            first, after
         )
+    
+    def resolve_autocomplete_users(self, info, prefix, limit=10):
+        user_ids = get_user_search_backend().autocomplete(prefix, limit=min(limit, MAX_PAGE_SIZE))
+        return users_in_order(user_ids)
+
+
+def users_in_order(user_ids):
+    users = User.objects.in_bulk(user_ids)
+    return [users[user_id] for user_id in user_ids if user_id in users]
 
 
 class CreateUser(graphene.Mutation):
@@ -153,6 +229,7 @@ class CreateUser(graphene.Mutation):
                     first_name=first_name or '',
                     last_name=last_name or ''
                 )
+                index_user_on_commit(user.id)
                 return CreateUser(user=user, success=True, errors=[])
                 
         except IntegrityError as e:
@@ -199,6 +276,7 @@ class UpdateProfile(graphene.Mutation):
                 if value is not None:
                     setattr(user, field, value)
             user.save()
+            index_user_on_commit(user.id)
             return UpdateProfile(user=user, success=True, errors=[])
         except Exception as e:
             return UpdateProfile(user=None, success=False, errors=[str(e)])
@@ -231,10 +309,10 @@ class FollowUser(graphene.Mutation):
             
             if created:
                 # Update counts
-                follower.following_count += 1
-                following.followers_count += 1
-                follower.save(update_fields=['following_count'])
-                following.save(update_fields=['followers_count'])
+                counters.increment(follower, 'following_count')
+                counters.increment(following, 'followers_count')
+                
+                enqueue_on_commit(post_tasks.merge_author_into_timeline, follower.id, following.id)
             
             return FollowUser(follow=follow, success=True, errors=[])
         except User.DoesNotExist:
@@ -266,10 +344,10 @@ class UnfollowUser(graphene.Mutation):
             follow.delete()
             
             # Update counts
-            follower.following_count -= 1
-            following.followers_count -= 1
-            follower.save(update_fields=['following_count'])
-            following.save(update_fields=['followers_count'])
+            counters.decrement(follower, 'following_count')
+            counters.decrement(following, 'followers_count')
+            
+            enqueue_on_commit(post_tasks.purge_author_from_timeline, follower.id, following.id)
             
             return UnfollowUser(success=True, errors=[])
         except Follow.DoesNotExist:
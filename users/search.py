@@ -0,0 +1,335 @@
+"""
+User search and autocomplete
+
+``searchUsers`` used to OR three ``icontains`` scans with no ranking and no
+limit. Lookups now go through a pluggable backend (``settings.USER_SEARCH``):
+
+- ``PostgresUserSearchBackend``: ``pg_trgm`` GIN indexes on ``username``,
+  ``first_name`` and ``last_name`` (created by the users migrations), matched
+  with the ``%`` similarity operator and prefix ``ILIKE``.
+- ``InMemoryUserSearchBackend``: a process-local prefix trie plus a trigram
+  inverted index computed like ``pg_trgm``, for SQLite/dev.
+
+When no backend is configured it is picked from the database vendor. Results
+are ranked by name similarity, boosted for verified users and by
+``followers_count``. ``autocomplete`` only does prefix matching and is meant to
+be called on every keystroke.
+"""
+
+import heapq
+import math
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Lookup
+from django.utils.module_loading import import_string
+
+DEFAULTS = {
+    'BACKEND': None,
+    # Minimum trigram similarity for a fuzzy match
+    'SIMILARITY_THRESHOLD': 0.3,
+}
+
+AUTOCOMPLETE_CACHE_TIMEOUT = 60
+
+VERIFIED_BOOST = 0.2
+# Added per order of magnitude of followers
+FOLLOWERS_BOOST = 0.05
+
+
+def get_user_search_settings():
+    return {**DEFAULTS, **getattr(settings, 'USER_SEARCH', {})}
+
+
+def popularity_boost(is_verified, followers_count):
+    return VERIFIED_BOOST * bool(is_verified) + FOLLOWERS_BOOST * math.log10(followers_count + 1)
+
+
+class PrefixILike(Lookup):
+    """``column ILIKE 'prefix%'``, served by a trigram GIN index on PostgreSQL."""
+    lookup_name = 'iprefix'
+
+    def get_db_prep_lookup(self, value, connection):
+        escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return '%s', [f'{escaped}%']
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} ILIKE {rhs}', lhs_params + rhs_params
+
+
+class BaseUserSearchBackend:
+    """
+    Interface of a user search index.
+    """
+
+    def __init__(self, similarity_threshold=0.3, **options):
+        self.similarity_threshold = similarity_threshold
+
+    def search(self, query, offset=0, limit=20):
+        """Ids of matching active users, best match first."""
+        raise NotImplementedError
+
+    def autocomplete(self, prefix, limit=10):
+        """Ids of active users whose username or names start with ``prefix``."""
+        raise NotImplementedError
+
+    def index(self, user_ids):
+        """Refresh the given users after a create or profile update."""
+
+    def rebuild(self):
+        return 0
+
+
+class PostgresUserSearchBackend(BaseUserSearchBackend):
+    """
+    Trigram search on the indexed name columns.
+    """
+
+    NAME_FIELDS = ('username', 'first_name', 'last_name')
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        from django.contrib.postgres.lookups import TrigramSimilar
+        from django.db.models import CharField
+
+        CharField.register_lookup(TrigramSimilar)
+        CharField.register_lookup(PrefixILike)
+
+    def _users(self):
+        from .models import User
+
+        return User.objects.filter(is_active=True)
+
+    def _rank(self, users, similarity):
+        from django.db.models import Case, ExpressionWrapper, F, FloatField, Value, When
+        from django.db.models.functions import Log
+
+        boost = ExpressionWrapper(
+            Case(When(is_verified=True, then=Value(VERIFIED_BOOST)), default=Value(0.0)) +
+            Log(Value(10.0), F('followers_count') + Value(1.0)) * Value(FOLLOWERS_BOOST),
+            output_field=FloatField()
+        )
+        return users.annotate(score=similarity + boost).order_by('-score', 'id')
+
+    def search(self, query, offset=0, limit=20):
+        from django.contrib.postgres.search import TrigramSimilarity
+        from django.db.models import Q
+        from django.db.models.functions import Greatest
+
+        query = query.strip()
+        if not query:
+            return []
+        matches = Q()
+        for field in self.NAME_FIELDS:
+            matches |= Q(**{f'{field}__trigram_similar': query}) | Q(**{f'{field}__iprefix': query})
+        similarity = Greatest(*[TrigramSimilarity(field, query) for field in self.NAME_FIELDS])
+        users = self._rank(self._users().filter(matches), similarity)
+        return list(users.values_list('id', flat=True)[offset:offset + limit])
+
+    def autocomplete(self, prefix, limit=10):
+        from django.core.cache import cache
+        from django.db.models import Q
+
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        # Trigram indexes cannot serve prefixes shorter than a trigram, and
+        # those are the most frequent keystrokes: cache them briefly.
+        cache_key = f'users:autocomplete:{prefix}:{limit}' if len(prefix) < 3 else None
+        if cache_key:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return cached
+        matches = Q()
+        for field in self.NAME_FIELDS:
+            matches |= Q(**{f'{field}__iprefix': prefix})
+        users = self._users().filter(matches).order_by('-is_verified', '-followers_count', 'id')
+        user_ids = list(users.values_list('id', flat=True)[:limit])
+        if cache_key:
+            cache.set(cache_key, user_ids, AUTOCOMPLETE_CACHE_TIMEOUT)
+        return user_ids
+
+
+def trigrams(text):
+    """Trigrams of ``text`` as computed by pg_trgm (words padded with blanks)."""
+    grams = set()
+    for word in re.findall(r'\w+', (text or '').lower()):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrieNode:
+    __slots__ = ('children', 'user_ids')
+
+    def __init__(self):
+        self.children = {}
+        self.user_ids = set()
+
+
+class InMemoryUserSearchBackend(BaseUserSearchBackend):
+    """
+    Prefix trie over lowercased usernames and names, where every node keeps
+    the ids of the users below it, plus a trigram -> user ids inverted index
+    for fuzzy search.
+    """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self._lock = threading.RLock()
+        self._built = False
+        self._users = {}
+        self._root = TrieNode()
+        self._trigrams = defaultdict(set)
+
+    def _ensure_built(self):
+        if not self._built:
+            self.rebuild()
+
+    @staticmethod
+    def _terms(user):
+        username, first_name, last_name = user[:3]
+        return {term.lower() for term in (username, first_name, last_name) if term}
+
+    def _add(self, user_id, user):
+        self._remove(user_id)
+        self._users[user_id] = user
+        for term in self._terms(user):
+            node = self._root
+            node.user_ids.add(user_id)
+            for char in term:
+                node = node.children.setdefault(char, TrieNode())
+                node.user_ids.add(user_id)
+        for gram in self._user_trigrams(user):
+            self._trigrams[gram].add(user_id)
+
+    def _remove(self, user_id):
+        user = self._users.pop(user_id, None)
+        if user is None:
+            return
+        for term in self._terms(user):
+            node = self._root
+            node.user_ids.discard(user_id)
+            for char in term:
+                node = node.children.get(char)
+                if node is None:
+                    break
+                node.user_ids.discard(user_id)
+        for gram in self._user_trigrams(user):
+            self._trigrams[gram].discard(user_id)
+
+    @staticmethod
+    def _user_trigrams(user):
+        return trigrams(user[0]) | trigrams(f'{user[1]} {user[2]}')
+
+    def _load(self, users):
+        rows = users.filter(is_active=True).values_list(
+            'id', 'username', 'first_name', 'last_name', 'is_verified', 'followers_count'
+        )
+        return {row[0]: row[1:] for row in rows}
+
+    def _boost(self, user_id):
+        user = self._users[user_id]
+        return popularity_boost(user[3], user[4])
+
+    def search(self, query, offset=0, limit=20):
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+        with self._lock:
+            self._ensure_built()
+            shared = defaultdict(int)
+            for gram in query_grams:
+                for user_id in self._trigrams.get(gram, ()):
+                    shared[user_id] += 1
+            prefix_matches = self._prefix_ids(query)
+            scored = []
+            for user_id in shared.keys() | prefix_matches:
+                user = self._users[user_id]
+                similarity = max(
+                    self._similarity(query_grams, trigrams(user[0])),
+                    self._similarity(query_grams, trigrams(user[1])),
+                    self._similarity(query_grams, trigrams(user[2])),
+                )
+                if similarity < self.similarity_threshold and user_id not in prefix_matches:
+                    continue
+                scored.append((-(similarity + self._boost(user_id)), user_id))
+        scored.sort()
+        return [user_id for _, user_id in scored[offset:offset + limit]]
+
+    @staticmethod
+    def _similarity(query_grams, grams):
+        if not grams:
+            return 0.0
+        return len(query_grams & grams) / len(query_grams | grams)
+
+    def _prefix_ids(self, prefix):
+        node = self._root
+        for char in prefix.strip().lower():
+            node = node.children.get(char)
+            if node is None:
+                return set()
+        return node.user_ids if node is not self._root else set()
+
+    def autocomplete(self, prefix, limit=10):
+        with self._lock:
+            self._ensure_built()
+            user_ids = self._prefix_ids(prefix)
+            return heapq.nsmallest(
+                limit, user_ids,
+                key=lambda user_id: (-self._users[user_id][3], -self._users[user_id][4], user_id)
+            )
+
+    def index(self, user_ids):
+        from .models import User
+
+        user_ids = set(user_ids)
+        with self._lock:
+            self._ensure_built()
+            users = self._load(User.objects.filter(id__in=user_ids))
+            for user_id in user_ids:
+                if user_id in users:
+                    self._add(user_id, users[user_id])
+                else:
+                    self._remove(user_id)
+
+    def rebuild(self):
+        from .models import User
+
+        with self._lock:
+            self._users = {}
+            self._root = TrieNode()
+            self._trigrams = defaultdict(set)
+            for user_id, user in self._load(User.objects.all()).items():
+                self._add(user_id, user)
+            self._built = True
+            return len(self._users)
+
+
+_backend = None
+
+
+def get_user_search_backend():
+    """Return the configured user search backend (one instance per process)."""
+    global _backend
+    if _backend is None:
+        config = get_user_search_settings()
+        backend_path = config['BACKEND']
+        if backend_path is None:
+            backend_path = (
+                'users.search.PostgresUserSearchBackend' if connection.vendor == 'postgresql'
+                else 'users.search.InMemoryUserSearchBackend'
+            )
+        _backend = import_string(backend_path)(
+            similarity_threshold=config['SIMILARITY_THRESHOLD']
+        )
+    return _backend
+
+
+def index_user_on_commit(user_id):
+    transaction.on_commit(lambda: get_user_search_backend().index([user_id]))
@@ -40,27 +40,20 @@ def cleanup_expired_tokens():
         return f"Error: {e}"
 
 @shared_task
-def update_user_statistics():
-    """Mettre à jour les statistiques utilisateur"""
+def update_user_statistics(start_id=None, end_id=None, resume=True):
+    """Mettre à jour les statistiques utilisateur (seulement les compteurs divergents)"""
+    from .reconciliation import reconcile_user_statistics
     try:
         logger.info("📊 Mise à jour statistiques utilisateur démarrée")
         
-        # Mettre à jour les compteurs pour tous les utilisateurs
-        users = User.objects.all()
-        updated_count = 0
+        # Requêtes groupées par tranches d'ids, reprise au dernier point de contrôle
+        result = reconcile_user_statistics(start_id=start_id, end_id=end_id, resume=resume)
         
-        for user in users:
-            # Mettre à jour followers_count
-            user.followers_count = user.followers.count()
-            # Mettre à jour following_count  
-            user.following_count = user.following.count()
-            # Mettre à jour posts_count
-            user.posts_count = user.posts.count()
-            user.save(update_fields=['followers_count', 'following_count', 'posts_count'])
-            updated_count += 1
-        
-        logger.info(f"✅ Statistiques mises à jour pour {updated_count} utilisateurs")
-        return f"Statistiques mises à jour pour {updated_count} utilisateurs"
+        logger.info(
+            f"✅ Statistiques vérifiées jusqu'à l'id {result['scanned_up_to']}, "
+            f"{result['drifted']} utilisateurs corrigés"
+        )
+        return f"Statistiques corrigées pour {result['drifted']} utilisateurs"
     except Exception as e:
         logger.error(f"❌ Erreur mise à jour statistiques : {e}")
         return f"Erreur : {e}"
@@ -1,3 +1,176 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from interactions.models import CounterShard
+from posts.models import Post
+
+from social_media_backend.graphql_testing import QueryBudgetMixin
+
+from . import reconciliation, search
+from .models import Follow, User
+from .reconciliation import CHECKPOINT_KEY, reconcile_user_statistics
+
+
+class ReconciliationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [cls.create_user(f'user{i}') for i in range(6)]
+        # user0 is followed by everyone else, and everyone posts i times
+        for user in cls.users[1:]:
+            Follow.objects.create(follower=user, following=cls.users[0])
+        for i, user in enumerate(cls.users):
+            Post.objects.bulk_create([Post(author=user, content='hi') for _ in range(i)])
+        reconcile_user_statistics()
+
+    @staticmethod
+    def create_user(username):
+        return User.objects.create_user(
+            username=username, email=f'{username}@example.com', password='secret'
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def counts(self, user):
+        return User.objects.values_list(
+            'followers_count', 'following_count', 'posts_count'
+        ).get(pk=user.pk)
+
+    def drift(self, *users):
+        User.objects.filter(pk__in=[user.pk for user in users]).update(
+            followers_count=99, following_count=0, posts_count=0
+        )
+
+    def test_counts(self):
+        self.assertEqual(self.counts(self.users[0]), (5, 0, 0))
+        self.assertEqual(self.counts(self.users[3]), (0, 1, 3))
+
+    def test_only_drifted_users_are_repaired(self):
+        self.drift(self.users[0], self.users[4])
+        with mock.patch.object(User.objects, 'bulk_update', wraps=User.objects.bulk_update) as update:
+            result = reconcile_user_statistics()
+        self.assertEqual(result, {'scanned_up_to': self.users[-1].pk, 'drifted': 2})
+        self.assertEqual(
+            sorted(user.pk for user in update.call_args.args[0]),
+            [self.users[0].pk, self.users[4].pk],
+        )
+        self.assertEqual(self.counts(self.users[0]), (5, 0, 0))
+        self.assertEqual(self.counts(self.users[4]), (0, 1, 4))
+        self.assertEqual(reconcile_user_statistics()['drifted'], 0)
+
+    def test_id_range(self):
+        self.drift(self.users[0], self.users[4])
+        result = reconcile_user_statistics(start_id=self.users[1].pk, end_id=self.users[5].pk)
+        self.assertEqual(result['drifted'], 1)
+        self.assertEqual(self.counts(self.users[0])[0], 99)
+
+    def test_interrupted_run_resumes_after_the_checkpoint(self):
+        self.drift(*self.users)
+        lock = reconciliation._lock_drifted_users
+        first_id = self.users[0].pk
+
+        def interrupt(start_id, end_id):
+            if start_id >= first_id + 4:
+                raise RuntimeError('worker lost')
+            return lock(start_id, end_id)
+
+        with mock.patch.object(reconciliation, '_lock_drifted_users', side_effect=interrupt):
+            with self.assertRaises(RuntimeError):
+                reconcile_user_statistics(start_id=first_id, chunk_size=2)
+        self.assertEqual(cache.get(CHECKPOINT_KEY), first_id + 3)
+        self.assertEqual(self.counts(self.users[4])[0], 99)
+
+        # Windows before the checkpoint are not scanned again
+        self.drift(self.users[0])
+        self.assertEqual(reconcile_user_statistics(chunk_size=2, resume=True)['drifted'], 2)
+        self.assertEqual(self.counts(self.users[0])[0], 99)
+        self.assertEqual(self.counts(self.users[5]), (0, 1, 5))
+        self.assertIsNone(cache.get(CHECKPOINT_KEY))
+
+    @override_settings(COUNTERS={'SHARDED_FIELDS': ('users.User.followers_count',)})
+    def test_pending_shards_are_netted_out(self):
+        CounterShard.objects.create(
+            content_type=ContentType.objects.get_for_model(User),
+            object_id=self.users[0].pk, field='followers_count', shard=0, delta=2,
+        )
+        self.assertEqual(reconcile_user_statistics()['drifted'], 1)
+        # Column plus pending shards is the actual count
+        self.assertEqual(self.counts(self.users[0])[0], 3)
+        self.assertEqual(reconcile_user_statistics()['drifted'], 0)
+
+
+class UserSearchTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        rows = (
+            ('johnsmith', 'John', 'Smith', False, 10),
+            ('jonny', 'Jon', 'Ny', True, 0),
+            ('johanna', 'Johanna', 'Berg', False, 10000),
+            ('smithers', 'Waylon', 'Smithers', False, 3),
+            ('johnold', 'John', 'Old', False, 0),
+        )
+        for username, first_name, last_name, is_verified, followers_count in rows:
+            User.objects.create_user(
+                username=username, email=f'{username}@example.com', password='secret',
+                first_name=first_name, last_name=last_name, is_verified=is_verified,
+                followers_count=followers_count, is_active=username != 'johnold',
+            )
+
+    def setUp(self):
+        self.backend = search.InMemoryUserSearchBackend()
+        patcher = mock.patch.object(search, '_backend', self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def usernames(self, user_ids):
+        return [User.objects.get(pk=user_id).username for user_id in user_ids]
+
+    def test_trigrams_match_pg_trgm(self):
+        self.assertEqual(search.trigrams('Ab'), {'  a', ' ab', 'ab '})
+        self.assertEqual(search.trigrams('a b'), {'  a', ' a ', '  b', ' b '})
+
+    def test_search_ranks_by_similarity(self):
+        self.assertEqual(self.usernames(self.backend.search('smith')), ['johnsmith', 'smithers'])
+        self.assertEqual(self.usernames(self.backend.search('Johanna')), ['johanna', 'johnsmith'])
+        self.assertEqual(self.backend.search('  '), [])
+
+    def test_search_tolerates_typos(self):
+        self.assertEqual(self.usernames(self.backend.search('jhonsmith')), ['johnsmith'])
+
+    def test_inactive_users_are_not_found(self):
+        self.assertNotIn('johnold', self.usernames(self.backend.search('john old')))
+        self.assertNotIn('johnold', self.usernames(self.backend.autocomplete('john')))
+
+    def test_autocomplete_prefers_verified_then_popular_users(self):
+        self.assertEqual(
+            self.usernames(self.backend.autocomplete('Jo')), ['jonny', 'johanna', 'johnsmith']
+        )
+        self.assertEqual(self.usernames(self.backend.autocomplete('jo', limit=1)), ['jonny'])
+        # Last names are prefixes too
+        self.assertEqual(self.usernames(self.backend.autocomplete('smi')), ['johnsmith', 'smithers'])
+        self.assertEqual(self.backend.autocomplete('x'), [])
+
+    def test_profile_updates_are_reindexed(self):
+        self.backend.autocomplete('jo')
+        user = User.objects.get(username='smithers')
+        User.objects.filter(pk=user.pk).update(username='joker')
+        self.backend.index([user.pk])
+        self.assertIn(user.pk, self.backend.autocomplete('jok'))
+        self.assertEqual(self.backend.autocomplete('smithe'), [user.pk])
+
+    def test_queries(self):
+        self.backend.rebuild()
+        result = self.assertQueryBudget(
+            """{ searchUsers(query: "smith") { username }
+                autocompleteUsers(prefix: "jo", limit: 2) { username } }""",
+            2
+        )
+        self.assertEqual(
+            [user['username'] for user in result.data['searchUsers']], ['johnsmith', 'smithers']
+        )
+        self.assertEqual(
+            [user['username'] for user in result.data['autocompleteUsers']], ['jonny', 'johanna']
+        )